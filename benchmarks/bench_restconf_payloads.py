@@ -0,0 +1,85 @@
+"""
+Benchmark of the RESTCONF community lookup payload sizes and the host-meta parse.
+
+Builds community-config responses as IOS XE renders them, for the whole list
+and for the name/permission leaves selected with the fields query parameter,
+and reports the bytes per device with and without gzip. The saving compares
+gzip to gzip, since requests already asks for gzip responses by default, so
+it is the saving from the fields selection alone. Also times the host-meta
+parse against xmltodict when it is installed.
+
+Usage:
+    python benchmarks/bench_restconf_payloads.py [--communities 10 100 1000] [--repeat 5]
+"""
+
+import argparse
+import gzip
+import json
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from rotatekey.utils.restconf import parse_host_meta  # noqa: E402
+
+HOST_META = """<XRD xmlns='http://docs.oasis-open.org/ns/xri/xrd-1.0'>
+    <Link rel='restconf' href='/restconf'/>
+</XRD>
+"""
+
+
+def community_config(communities: int, fields: bool) -> bytes:
+    """
+    Render a community-config response body.
+
+    Args:
+        communities (int): Number of communities on the device
+        fields (bool): Render only the name and permission leaves
+
+    Returns:
+        body (bytes): The response body, indented as IOS XE sends it
+    """
+    entries = []
+    for n in range(communities):
+        entry = {"name": f"community-{n:05d}-5f3a9c", "permission": "rw" if n % 4 == 0 else "ro"}
+        if not fields:
+            entry.update({
+                "view": f"view-{n % 8}",
+                "access-list-name": f"SNMP-ACL-{n % 16}",
+                "ipv6": f"SNMP-V6-ACL-{n % 16}",
+            })
+        entries.append(entry)
+
+    return json.dumps({"Cisco-IOS-XE-snmp:community-config": entries}, indent=2).encode()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--communities", type=int, nargs="+", default=[10, 100, 1000],
+                        help="Community counts to render")
+    parser.add_argument("--repeat", type=int, default=5, help="Timing repetitions, the best is reported")
+    args = parser.parse_args()
+
+    print(f"{'communities':>12}{'full':>10}{'full gzip':>12}{'fields':>10}{'fields gzip':>13}{'saving':>9}")
+    for communities in args.communities:
+        full = community_config(communities, fields=False)
+        selected = community_config(communities, fields=True)
+        full_gzip = len(gzip.compress(full))
+        selected_gzip = len(gzip.compress(selected))
+        saving = 1 - selected_gzip / full_gzip
+        print(f"{communities:>12}{len(full):>10}{full_gzip:>12}{len(selected):>10}{selected_gzip:>13}{saving:>9.1%}")
+
+    number = 10000
+    best = min(timeit.repeat(lambda: parse_host_meta(HOST_META), number=number, repeat=args.repeat)) / number
+    print(f"\nhost-meta parse: parse_host_meta {best * 1e6:.2f} us", end="")
+    try:
+        import xmltodict
+    except ImportError:
+        print()
+    else:
+        best = min(timeit.repeat(lambda: xmltodict.parse(HOST_META), number=number, repeat=args.repeat)) / number
+        print(f", xmltodict {best * 1e6:.2f} us")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+"""
+Micro-benchmark of the SNMP community parser over synthetic configurations.
+
+Compares the parser with the previous line-by-line split() approach, on the
+output of the device-side filter and on a whole unfiltered configuration.
+
+Usage:
+    python benchmarks/bench_snmp_parser.py [--lines 100000] [--communities 50] [--repeat 5]
+"""
+
+import argparse
+import importlib.util
+import os
+import random
+import timeit
+
+# Load the parser module on its own, so the benchmark runs without the device libraries installed
+PARSER_PATH = os.path.join(os.path.dirname(__file__), "..", "rotatekey", "utils", "snmp_parser.py")
+spec = importlib.util.spec_from_file_location("snmp_parser", PARSER_PATH)
+snmp_parser = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(snmp_parser)
+
+COMMUNITY_FORMS = (
+    "snmp-server community {name} RO",
+    "snmp-server community {name} RW",
+    "snmp-server community {name} view {name}-view RO 10",
+    "snmp-server community {name} RO ipv6 V6-MGMT MGMT-ACL",
+    "snmp-server community 7 {name} RW",
+    "snmp-server community {name} group network-operator",
+    "snmp-server community {name} use-acl MGMT-ACL",
+)
+
+FILLER_LINES = (
+    "interface GigabitEthernet1/0/{n}",
+    " description access port {n}",
+    " switchport access vlan {n}",
+    " switchport mode access",
+    " spanning-tree portfast",
+    "!",
+    "ip route 10.{a}.{b}.0 255.255.255.0 192.0.2.1",
+    "access-list 10 permit 10.{a}.{b}.0 0.0.0.255",
+    "snmp-server host 192.0.2.{b} version 2c public",
+)
+
+
+def synthetic_config(lines: int, communities: int, seed: int = 1) -> tuple[str, str]:
+    """
+    Build a synthetic configuration and its community lines.
+
+    Args:
+        lines (int): Total number of lines in the configuration
+        communities (int): Number of community lines spread through it
+        seed (int): Random seed, so runs are comparable
+
+    Returns:
+        config (tuple): The whole configuration, and only its community lines
+    """
+    rng = random.Random(seed)
+    config = [
+        FILLER_LINES[n % len(FILLER_LINES)].format(n=n % 48 + 1, a=rng.randrange(256), b=rng.randrange(256))
+        for n in range(lines - communities)
+    ]
+    community_lines = [COMMUNITY_FORMS[n % len(COMMUNITY_FORMS)].format(name=f"community{n}") for n in range(communities)]
+    for line in community_lines:
+        config.insert(rng.randrange(len(config) + 1), line)
+
+    return "\n".join(config), "\n".join(community_lines)
+
+
+def split_parser(output: str) -> list[dict[str, str]]:
+    # The previous approach, which relied on the device having filtered the output
+    communities = []
+    for line in output.splitlines():
+        if not line.startswith("snmp-server community"):
+            continue
+        fields = line.split()
+        communities.append({"name": fields[2], "permission": fields[3]})
+    return communities
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--lines", type=int, default=100000, help="Lines in the synthetic configuration")
+    parser.add_argument("--communities", type=int, default=50, help="Community lines in the configuration")
+    parser.add_argument("--repeat", type=int, default=5, help="Timing repetitions, the best is reported")
+    args = parser.parse_args()
+
+    config, filtered = synthetic_config(args.lines, args.communities)
+    parsed = snmp_parser.parse_communities(config)
+    assert len(parsed) == args.communities, f"parsed {len(parsed)} of {args.communities} communities"
+
+    print(f"{args.lines} lines, {args.communities} communities, {len(config)} bytes unfiltered")
+    print(f"{'input':<12}{'parser':<14}{'best ms':>10}{'per line us':>14}")
+    for label, text in (("filtered", filtered), ("unfiltered", config)):
+        lines = text.count("\n") + 1
+        for name, func in (("split", split_parser), ("snmp_parser", snmp_parser.parse_communities)):
+            number = max(1, 20000 // lines)
+            best = min(timeit.repeat(lambda: func(text), number=number, repeat=args.repeat)) / number
+            print(f"{label:<12}{name:<14}{best * 1000:>10.3f}{best * 1e6 / lines:>14.3f}")
+
+
+if __name__ == "__main__":
+    main()
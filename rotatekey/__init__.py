@@ -0,0 +1,20 @@
+"""
+Rotate keys and secret strings on network devices.
+
+The Fleet class is the Python API behind the `rotatekey` command. It is
+imported on first use, so importing rotatekey.utils modules does not load
+click, pyATS and Genie.
+"""
+
+from .utils.device import DeviceRecord
+from .utils.secret_kinds import SnmpCommunities, TacacsKey, RadiusKey, EnableSecret, LocalUser
+
+__all__ = ["Fleet", "DeviceRecord", "SnmpCommunities", "TacacsKey", "RadiusKey", "EnableSecret", "LocalUser"]
+
+
+def __getattr__(name: str):
+    if name == "Fleet":
+        from .fleet import Fleet
+
+        return Fleet
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
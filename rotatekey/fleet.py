@@ -0,0 +1,1076 @@
+"""
+A Python API for working on a fleet of network devices.
+
+A Fleet is built once from an inventory and then used for any number of
+operations. Discovered transports are kept between calls, and with
+keep_sessions the connected device sessions are too, so only the first call
+pays for discovery and logins. Operations are generators that yield each
+device's result as soon as it completes.
+
+    fleet = Fleet.from_inventory("inventory.yaml", limit=["site:lab"])
+    for result in fleet.list_communities():
+        print(result["device_name"], result["communities"])
+
+The `rotatekey` commands are thin wrappers over this class.
+"""
+
+from __future__ import annotations
+import logging
+import os
+import threading
+import time
+from typing import Callable, Iterator, Optional
+import click
+from .utils.restconf import Restconf
+from .utils.cli_config import CliConfig
+from .utils.netconf import Netconf, NETCONF_AVAILABLE
+from .utils.utils import debug_msg, check_result, diff_communities, intended_communities
+from .utils.runner import iter_parallel
+from .utils.concurrency import AimdController, failure_kind
+from .utils.metrics import REGISTRY
+from .utils.history import RunHistory, TransportHistory
+from .utils.progress import ProgressDisplay
+from .utils.secret_kinds import SecretKind
+from .utils.snapshot import SnapshotWriter
+from .utils.sharding import select_shard, device_shard
+from .utils.inventory import load_inventory
+from .utils.device import DeviceRecord
+from .utils.selection import InventoryIndex
+from .utils.agent import SessionPool
+from .utils.session_log import SessionLogWriter, mask_secrets
+
+
+def transport_name(device_manager) -> str:
+    """
+    The name of the transport used by a device manager.
+
+    Args:
+        device_manager (Restconf | Netconf | CliConfig): A device manager
+
+    Returns:
+        transport (str): "restconf", "netconf" or "cli"
+    """
+    if isinstance(device_manager, Restconf):
+        return "restconf"
+    if isinstance(device_manager, Netconf):
+        return "netconf"
+    return "cli"
+
+
+def device_site(device: DeviceRecord):
+    """
+    The site a device belongs to, from the optional "site" or "group" inventory keys.
+
+    Args:
+        device (DeviceRecord): The device
+
+    Returns:
+        site (str): The site or group name, None if the device has neither
+    """
+    return device.site or device.group
+
+
+def record_device_metrics(command: str, device: DeviceRecord, result: dict, seconds: float) -> None:
+    """
+    Record the outcome and wall time of a command on one device in the run metrics.
+
+    Args:
+        command (str): The command, e.g. "snmp update"
+        device (DeviceRecord): The device
+        result (dict): The per-device result, None if the command raised
+        seconds (float): The wall time in seconds
+    """
+    transport = device.transport or "unknown"
+    success = isinstance(result, dict) and result["success"]
+    REGISTRY.inc("rotatekey_devices_total", command=command, transport=transport,
+                 status="ok" if success else "failed")
+    REGISTRY.observe("rotatekey_device_seconds", seconds, command=command, transport=transport)
+    if not success:
+        kind = failure_kind(result) if isinstance(result, dict) else "exception"
+        REGISTRY.inc("rotatekey_device_failures_total", command=command, reason=kind)
+
+
+def connect_failure(device_manager, result: dict) -> tuple[bool, str]:
+    """
+    The action result for a device that could not be connected to.
+
+    Rejected credentials are marked in the per-device result with error_kind "auth",
+    so they are told apart from devices that are unreachable.
+
+    Args:
+        device_manager (Restconf | Netconf | CliConfig): The device manager that failed to connect
+        result (dict): The per-device result
+
+    Returns:
+        action_result (tuple): Details on result (success_bool, reason)
+    """
+    if getattr(device_manager, "auth_failed", False):
+        result["error_kind"] = "auth"
+        return (False, "Authentication failed, check NETWORK_USERNAME and NETWORK_PASSWORD")
+    return (False, "Unable to connect to device")
+
+
+def mark_auth_failure(device_manager, result: dict) -> None:
+    """
+    Mark a result whose device rejected the credentials during the operation.
+
+    A device can accept the connection and then reject the credentials on the
+    operation itself, as RESTCONF does with a 401 to a data request. The
+    manager notes that in auth_failed, and the result gets error_kind "auth"
+    so it counts towards max_auth_failures.
+
+    Args:
+        device_manager (Restconf | Netconf | CliConfig): The device manager used for the operation
+        result (dict): The per-device result
+    """
+    if getattr(device_manager, "auth_failed", False) and result.get("error_kind") != "auth":
+        result["success"] = False
+        result["error_kind"] = "auth"
+        result["reasons"].append("auth: Authentication failed, check NETWORK_USERNAME and NETWORK_PASSWORD")
+
+
+class Fleet(object):
+    """
+    A set of devices and the settings, discovery results and sessions used to work on them.
+    """
+
+    def __init__(
+        self,
+        devices: list[DeviceRecord],
+        username: str,
+        password: str,
+        workers: int = 10,
+        adaptive: bool = False,
+        max_per_site: Optional[int] = None,
+        prefer_restconf: bool = False,
+        prefer_netconf: bool = False,
+        cli_verbose: bool = False,
+        debug: bool = False,
+        history_file: Optional[str] = None,
+        shard: Optional[tuple[int, int]] = None,
+        limit: Optional[list[str]] = None,
+        progress: bool = False,
+        keep_sessions: bool = False,
+        max_sessions: int = 100,
+        idle_timeout: float = 300.0,
+        session_log_dir: Optional[str] = None,
+        session_log_max_bytes: int = 10 * 1024 * 1024,
+        session_log_compress: bool = False,
+        transport: str = "inventory",
+        transport_history_file: Optional[str] = None,
+        max_auth_failures: Optional[int] = None,
+    ):
+        """
+        Args:
+            devices (list): The devices in the fleet
+            username (str): username for the network devices
+            password (str): password for the network devices
+            workers (int): Maximum number of devices to work on at the same time
+            adaptive (bool): Adapt the number of devices worked on at once, up to workers
+            max_per_site (int): Maximum number of devices from one site worked on at the same time
+            prefer_restconf (bool): Attempt to use RESTCONF on all devices
+            prefer_netconf (bool): Attempt to use NETCONF on all devices
+            cli_verbose (bool): Stream CLI connection output to the screen
+            debug (bool): Print debug messages
+            history_file (str): File of per-device run times, None to keep them in memory only
+            shard (tuple): Only work on this shard (K, N) of devices built from plans and snapshots
+            limit (list): Only work on devices from plans and snapshots matching these --limit patterns
+            progress (bool): Show a progress line on stderr when it is a terminal
+            keep_sessions (bool): Keep device sessions open between calls, close() ends them
+            max_sessions (int): Most sessions to keep open with keep_sessions
+            idle_timeout (float): Seconds a kept session may be idle before it is closed
+            session_log_dir (str): Write each device's CLI dialog and request summaries to a file here
+            session_log_max_bytes (int): Most bytes of session log to keep per device
+            session_log_compress (bool): Gzip compress the session logs
+            transport (str): "inventory" to use the inventory keys and prefer flags, or "auto"
+                to pick the fastest reliable transport per device from measured history
+            transport_history_file (str): File of per-device transport latency and success,
+                None to keep it in memory only
+            max_auth_failures (int): Stop all work once this many devices reject the credentials,
+                None to never stop
+        """
+        self.devices = list(devices)
+        self.username = username
+        self.password = password
+        self.workers = workers
+        self.max_per_site = max_per_site
+        self.prefer_restconf = prefer_restconf
+        self.prefer_netconf = prefer_netconf
+        self.cli_verbose = cli_verbose
+        self.debug = debug
+        self.history = RunHistory(history_file)
+        self.shard = shard
+        self.limit = list(limit) if limit else None
+        self.progress = progress
+
+        self.controller = None
+        if adaptive:
+            self.controller = AimdController(
+                workers,
+                on_change=lambda limit, reason: debug_msg(debug, f"Concurrency changed to {limit} ({reason})"),
+            )
+
+        # Discovered transport and reason, by device address, kept between calls
+        self.transports = {}
+
+        # With automatic selection, the transports to fall back to, by device address
+        self.transport_mode = transport
+        self.transport_history = TransportHistory(transport_history_file)
+        self.fallbacks = {}
+
+        # Devices that rejected the credentials, and whether that stopped the work
+        self.max_auth_failures = max_auth_failures
+        self.auth_failures = 0
+        self.auth_failed_devices = set()
+        self.auth_lock = threading.Lock()
+        self.auth_aborted = False
+        self.stop_requested = False
+        # Set to stop starting devices, on too many authentication failures or a stop()
+        self.halt = threading.Event()
+
+        self.session_logs = None
+        if session_log_dir:
+            self.session_logs = SessionLogWriter(session_log_dir, session_log_max_bytes, session_log_compress)
+
+        self.session_pool = None
+        if keep_sessions:
+            self.keep_sessions(max_sessions, idle_timeout)
+
+    @classmethod
+    def from_inventory(
+        cls,
+        path: str,
+        username: Optional[str] = None,
+        password: Optional[str] = None,
+        limit: Optional[list[str]] = None,
+        shard: Optional[tuple[int, int]] = None,
+        cache_dir: Optional[str] = ".rotatekey-cache",
+        **options,
+    ) -> "Fleet":
+        """
+        Build a fleet from an inventory file.
+
+        Args:
+            path (str): The inventory file (YAML, .jsonl or .csv)
+            username (str): username for the network devices, defaults to $NETWORK_USERNAME
+            password (str): password for the network devices, defaults to $NETWORK_PASSWORD
+            limit (list): Patterns selecting the devices to work on, as for --limit
+            shard (tuple): Only load shard (K, N) of the inventory
+            cache_dir (str): Directory for the YAML inventory cache, None to disable caching
+            options: Any other Fleet settings
+
+        Returns:
+            fleet (Fleet): The fleet
+
+        Raises:
+            ValueError: If no credentials are given or set in the environment
+        """
+        username = username or os.getenv("NETWORK_USERNAME")
+        password = password or os.getenv("NETWORK_PASSWORD")
+        if not username or not password:
+            raise ValueError("No credentials given and NETWORK_USERNAME or NETWORK_PASSWORD is not set")
+
+        devices = cls.load_devices(path, limit, shard, cache_dir, options.get("debug", False))
+        return cls(devices, username, password, shard=shard, limit=limit, **options)
+
+    @staticmethod
+    def load_devices(
+        path: str,
+        limit: Optional[list[str]] = None,
+        shard: Optional[tuple[int, int]] = None,
+        cache_dir: Optional[str] = ".rotatekey-cache",
+        debug: bool = False,
+    ) -> list[DeviceRecord]:
+        """
+        Load the selected devices from an inventory file.
+
+        Args:
+            path (str): The inventory file (YAML, .jsonl or .csv)
+            limit (list): Patterns selecting the devices to work on, as for --limit
+            shard (tuple): Only load shard (K, N) of the inventory
+            cache_dir (str): Directory for the YAML inventory cache, None to disable caching
+            debug (bool): Print debug messages
+
+        Returns:
+            devices (list): The selected devices
+        """
+        # Keep only the devices in this runner's shard while loading
+        device_filter = None
+        if shard:
+            shard_number, total = shard
+            device_filter = lambda device: device_shard(device["device_name"], device["address"], total) == shard_number
+        devices = [DeviceRecord.from_inventory(device) for device in load_inventory(path, device_filter, cache_dir)]
+
+        # Discovery, connections and output only apply to the selected devices
+        if limit:
+            devices = InventoryIndex(devices).select(list(limit))
+            debug_msg(debug, f"Selected {len(devices)} device(s) with --limit {' '.join(limit)}")
+
+        return devices
+
+    def keep_sessions(self, max_sessions: int = 100, idle_timeout: float = 300.0) -> None:
+        """
+        Keep device sessions open between calls, until they are idle for too long or close() is called.
+
+        Args:
+            max_sessions (int): Most sessions to keep open
+            idle_timeout (float): Seconds a session may be idle before it is closed
+        """
+        if self.session_pool is None:
+            self.session_pool = SessionPool(self.create_device_manager, max_sessions, idle_timeout)
+
+    def close(self) -> None:
+        """
+        Close any sessions kept open between calls and finish writing the session logs.
+        """
+        if self.session_pool is not None:
+            self.session_pool.close()
+            self.session_pool = None
+        if self.session_logs is not None:
+            self.session_logs.close()
+            self.session_logs = None
+
+    @property
+    def aborted(self) -> bool:
+        """
+        Whether work was stopped because too many devices rejected the credentials.
+        """
+        return self.auth_aborted
+
+    def stop(self) -> None:
+        """
+        Stop starting devices, in the operations running now and any started later.
+
+        Safe to call from a signal handler or another thread. The devices in
+        flight finish, and every device not started gets a "stopped" result.
+        """
+        self.stop_requested = True
+        self.halt.set()
+
+    def reset_auth_failures(self) -> None:
+        """
+        Forget earlier authentication failures, so work can start again after an abort.
+        """
+        with self.auth_lock:
+            self.auth_failures = 0
+            self.auth_failed_devices.clear()
+            self.auth_aborted = False
+            if not self.stop_requested:
+                self.halt.clear()
+
+    def _auth_failure(self, device: DeviceRecord) -> None:
+        # Count a device that rejected the credentials, stopping all work at the threshold.
+        # The credentials are shared by the whole fleet, so carrying on risks locking the account out.
+        # A device rejected in discovery fails again in the run, but is only counted once
+        with self.auth_lock:
+            if device.device_name in self.auth_failed_devices:
+                return
+            self.auth_failed_devices.add(device.device_name)
+            self.auth_failures += 1
+            tripped = (
+                self.max_auth_failures is not None
+                and self.auth_failures >= self.max_auth_failures
+                and not self.auth_aborted
+            )
+            if tripped:
+                self.auth_aborted = True
+                self.halt.set()
+
+        debug_msg(self.debug, f"Authentication failed on {device.device_name} ({self.auth_failures} so far)")
+        if tripped:
+            click.secho(
+                f"ERROR: {self.auth_failures} device(s) rejected the credentials, stopping all work",
+                fg='red',
+                err=True,
+            )
+
+    def __enter__(self) -> "Fleet":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def status(self) -> dict:
+        """
+        Describe the fleet and any sessions kept open.
+
+        Returns:
+            status (dict): Device and discovery counts, and the session pool status
+        """
+        status = {
+            "devices": len(self.devices),
+            "discovered": len(self.transports),
+            "auth_failures": self.auth_failures,
+            "aborted": self.aborted,
+            "stopped": self.stop_requested,
+        }
+        if self.session_pool is not None:
+            status.update(self.session_pool.status())
+        return status
+
+    def entry_devices(self, entries: list[dict]) -> list[DeviceRecord]:
+        """
+        Build devices from snapshot or plan entries, keeping those in the fleet's shard
+        and matching its --limit patterns, as for devices loaded from the inventory.
+
+        Entries record the device name, address and site, so tag: and group:
+        patterns do not match them.
+
+        Args:
+            entries (list): The snapshot or plan entries
+
+        Returns:
+            devices (list): The devices, with the transport recorded in each entry
+        """
+        devices = [DeviceRecord.from_entry(entry) for entry in entries]
+        if self.shard:
+            devices = select_shard(devices, *self.shard)
+        if self.limit:
+            devices = InventoryIndex(devices).select(self.limit)
+        return devices
+
+    def discover(self, devices: Optional[list[DeviceRecord]] = None) -> list[DeviceRecord]:
+        """
+        Work out the transport to use for each device.
+
+        Each address is discovered once for the life of the fleet, later calls
+        reuse the result.
+
+        Args:
+            devices (list): The devices, defaults to the whole fleet
+
+        Returns:
+            devices (list): The devices with the transport set
+        """
+        devices = self.devices if devices is None else devices
+
+        undiscovered = []
+        for device in devices:
+            if device.address in self.transports:
+                device.set_transport(*self.transports[device.address])
+            else:
+                undiscovered.append(device)
+
+        if undiscovered:
+            debug_msg(self.debug, f"Prefer RESTCONF status: {self.prefer_restconf}")
+            debug_msg(self.debug, f"Prefer NETCONF status: {self.prefer_netconf}")
+            # Discovery logs in too, so rejected credentials count towards stopping the work
+            for index, auth_failed in iter_parallel(
+                undiscovered, self._discover_device, self.workers, stop=self.halt
+            ):
+                device = undiscovered[index]
+                self.transports[device.address] = (device.transport, device.discovery)
+                if auth_failed:
+                    self._auth_failure(device)
+
+        return devices
+
+    def _discover_device(self, device: DeviceRecord) -> bool:
+        # Returns whether the device rejected the credentials
+        if self.transport_mode == "auto":
+            self._choose_transport(device)
+            return False
+
+        # Check for NETCONF support if the device is set to "netconf: True" in inventory
+        # or if prefer_netconf is set, falling back to RESTCONF or the CLI
+        netconf_enabled = False
+        if device.get("netconf") or self.prefer_netconf:
+            debug_msg(self.debug, f"Testing device {device.device_name} for NETCONF Support")
+            device_netconf = self.netconf_manager(device)
+            device_netconf.disconnect()
+            netconf_enabled = device_netconf.enabled
+            if device_netconf.auth_failed:
+                # Other transports use the same credentials, so falling back would only fail again
+                device.set_transport("netconf", "NETCONF authentication failed")
+                REGISTRY.inc("rotatekey_discovery_total", transport=device.transport, outcome=device.discovery)
+                return True
+            if not netconf_enabled:
+                debug_msg(self.debug, f"NETCONF unavailable on {device.device_name}")
+
+        # Check for RESTCONF support if the device is set to "restconf: True" in inventory
+        # or if prefer_restconf is set. Otherwise, the device uses the CLI
+        if netconf_enabled:
+            device.set_transport("netconf", "NETCONF available")
+        elif device.restconf or self.prefer_restconf:
+            debug_msg(self.debug, f"Testing device {device.device_name} for RESTCONF Support")
+            device_restconf = Restconf(device.address, self.username, self.password, self.session_log(device))
+            if device_restconf.enabled:
+                device.set_transport("restconf", "RESTCONF available")
+            elif device_restconf.auth_failed:
+                # A rejected login is not a missing RESTCONF service, so do not fall back to the CLI
+                device.set_transport("restconf", "RESTCONF authentication failed")
+            else:
+                device.set_transport("cli", "RESTCONF unavailable")
+        else:
+            debug_msg(self.debug, f"Device {device.device_name} will use CLI connection")
+            device.set_transport("cli", "RESTCONF not requested")
+
+        REGISTRY.inc("rotatekey_discovery_total", transport=device.transport, outcome=device.discovery)
+        return device.discovery == "RESTCONF authentication failed"
+
+    def _choose_transport(self, device: DeviceRecord) -> None:
+        # Rank the transports from the device's measured history, nothing is probed:
+        # a transport that does not connect falls back to the next when the device is opened
+        transports = (["netconf"] if NETCONF_AVAILABLE else []) + ["restconf", "cli"]
+        ranking, reason = self.transport_history.rank(device.device_name, transports)
+        device.set_transport(ranking[0], reason)
+        self.fallbacks[device.address] = ranking[1:]
+        debug_msg(self.debug, f"Device {device.device_name} will use {device.transport} ({reason})")
+
+        REGISTRY.inc("rotatekey_discovery_total", transport=device.transport, outcome="auto")
+
+    def run(
+        self,
+        devices: list[DeviceRecord],
+        func: Callable[[DeviceRecord], dict],
+        command: str,
+        start_at: Optional[Callable[[DeviceRecord], float]] = None,
+    ) -> Iterator[tuple[int, dict]]:
+        """
+        Run a per-device function across devices with the configured concurrency.
+
+        Devices are started longest-first using the run time history, so the
+        slowest devices overlap with the bulk of the work instead of finishing last.
+        The wall time of each device is recorded for the next run. An unexpected
+        error on one device gives that device a failed result, the rest carry on.
+
+        Devices that reject the credentials are counted, and once max_auth_failures
+        is reached no further devices are started. The devices in flight finish,
+        and every device not started gets an "aborted" result. After stop() the
+        same happens, with "stopped" results.
+
+        Args:
+            devices (list): The devices to process
+            func (Callable): The function to call for each device
+            command (str): The command name to record run times under
+            start_at (Callable): Optional time.monotonic() to start each device, instead of longest-first
+
+        Returns:
+            results (Iterator): (index in devices, result) for each device, in completion order
+        """
+        history = self.history
+        progress = ProgressDisplay(len(devices), label=command, enabled=None if self.progress else False)
+
+        def timed(device):
+            progress.started()
+            start = time.monotonic()
+            result = None
+            try:
+                result = func(device)
+                return result
+            except Exception as e:
+                # An unexpected error fails this device, not the whole run
+                reason = f"{type(e).__name__}: {mask_secrets(str(e))}"
+                check_result(device.device_name, command, (False, reason), self.debug)
+                result = {
+                    "device_name": device.device_name,
+                    "success": False,
+                    "reasons": [f"{command}: {reason}"],
+                    "transport": device.transport,
+                    "communities": [],
+                    "previous": None,
+                }
+                return result
+            finally:
+                seconds = time.monotonic() - start
+                history.record(device.device_name, command, seconds)
+                device.record_timing(command, seconds)
+                if isinstance(result, dict):
+                    device.set_result(result)
+                # Rejected credentials say nothing about how well the transport works
+                auth_failed = isinstance(result, dict) and result.get("error_kind") == "auth"
+                if self.transport_mode == "auto" and device.transport and not auth_failed:
+                    self.transport_history.record(
+                        device.device_name, device.transport, seconds, isinstance(result, dict) and result["success"]
+                    )
+                record_device_metrics(command, device, result, seconds)
+                progress.finished(isinstance(result, dict) and result["success"])
+
+        def estimate(index):
+            device = devices[index]
+            return history.estimate(device.device_name, command, device.transport or "cli")
+
+        order = sorted(range(len(devices)), key=estimate, reverse=True)
+        reported = set()
+        skipped = 0
+
+        try:
+            for position, result in iter_parallel(
+                [devices[index] for index in order],
+                timed,
+                self.workers,
+                self.controller,
+                group_key=device_site,
+                max_per_group=self.max_per_site,
+                start_at=start_at,
+                stop=self.halt,
+            ):
+                if isinstance(result, dict) and result.get("error_kind") == "auth":
+                    self._auth_failure(devices[order[position]])
+                reported.add(order[position])
+                yield (order[position], result)
+
+            # Report the devices never started after too many authentication failures or a stop()
+            if self.auth_aborted:
+                kind, reason = "aborted", f"aborted: not attempted after {self.auth_failures} authentication failures"
+            else:
+                kind, reason = "stopped", "stopped: not attempted, a stop was requested"
+            for index in order:
+                if index in reported:
+                    continue
+                # The same keys the commands' results have, so aborted results print and save like the rest
+                result = {
+                    "device_name": devices[index].device_name,
+                    "success": False,
+                    "reasons": [reason],
+                    "error_kind": kind,
+                    "transport": devices[index].transport,
+                    "communities": [],
+                    "previous": None,
+                }
+                devices[index].set_result(result)
+                skipped += 1
+                yield (index, result)
+        finally:
+            progress.close()
+            if self.controller:
+                click.echo(self.controller.summary(), err=True)
+            if self.aborted:
+                click.secho(
+                    f"Aborted: {self.auth_failures} device(s) rejected the credentials (limit {self.max_auth_failures}), "
+                    f"{skipped} of {len(devices)} device(s) not attempted. "
+                    "Check NETWORK_USERNAME and NETWORK_PASSWORD before running again.",
+                    fg='red',
+                    err=True,
+                )
+
+            for saved in (history, self.transport_history):
+                try:
+                    saved.save()
+                except OSError as e:
+                    debug_msg(self.debug, f"Unable to save history to {saved.path}: {e}")
+
+    def _results(
+        self,
+        devices: list[DeviceRecord],
+        func: Callable[[DeviceRecord], dict],
+        command: str,
+        start_at: Optional[Callable[[DeviceRecord], float]] = None,
+    ) -> Iterator[dict]:
+        for _, result in self.run(devices, func, command, start_at):
+            yield result
+
+    def list_communities(self, devices: Optional[list[DeviceRecord]] = None) -> Iterator[dict]:
+        """
+        Look up the SNMP communities on each device.
+
+        Args:
+            devices (list): The devices, defaults to the whole fleet
+
+        Returns:
+            results (Iterator): Per-device results with the communities, in completion order
+        """
+        devices = self.discover(devices)
+        return self._results(devices, self._list_device, "snmp list")
+
+    def update_communities(
+        self,
+        delete_current: bool = False,
+        ro_community: Optional[str] = None,
+        rw_community: Optional[str] = None,
+        verify: bool = False,
+        snapshot: Optional[SnapshotWriter] = None,
+        devices: Optional[list[DeviceRecord]] = None,
+        start_at: Optional[Callable[[DeviceRecord], float]] = None,
+    ) -> Iterator[dict]:
+        """
+        Update the SNMP communities on each device.
+
+        Args:
+            delete_current (bool): Whether to delete all current SNMP communities
+            ro_community (str): The new Read-Only community string to create
+            rw_community (str): The new Read-Write community string to create
+            verify (bool): Read the communities back after the changes and compare them to the intended set
+            snapshot (SnapshotWriter): Where to record the communities before changing them
+            devices (list): The devices, defaults to the whole fleet
+            start_at (Callable): Optional time.monotonic() to start each device, to spread the update over time
+
+        Returns:
+            results (Iterator): Per-device results, in completion order
+        """
+        devices = self.discover(devices)
+        return self._results(
+            devices,
+            lambda device: self._update_device(device, delete_current, ro_community, rw_community, verify, snapshot),
+            "snmp update",
+            start_at,
+        )
+
+    def plan_communities(
+        self,
+        plan: SnapshotWriter,
+        delete_current: bool = False,
+        ro_community: Optional[str] = None,
+        rw_community: Optional[str] = None,
+        devices: Optional[list[DeviceRecord]] = None,
+    ) -> Iterator[dict]:
+        """
+        Record the SNMP changes an update would make on each device, without making them.
+
+        Args:
+            plan (SnapshotWriter): The plan file to record the changes in
+            delete_current (bool): Whether to delete all current SNMP communities
+            ro_community (str): The new Read-Only community string to create
+            rw_community (str): The new Read-Write community string to create
+            devices (list): The devices, defaults to the whole fleet
+
+        Returns:
+            results (Iterator): Per-device results, in completion order
+        """
+        devices = self.discover(devices)
+        return self._results(
+            devices,
+            lambda device: self._plan_device(device, plan, delete_current, ro_community, rw_community),
+            "snmp plan",
+        )
+
+    def apply_plan(self, entries: list[dict]) -> Iterator[dict]:
+        """
+        Apply the SNMP changes recorded in a plan, using the transport recorded for each device.
+
+        Args:
+            entries (list): The plan entries
+
+        Returns:
+            results (Iterator): Per-device results, in completion order
+        """
+        by_name = {entry["device_name"]: entry for entry in entries}
+        devices = self.entry_devices(list(by_name.values()))
+        return self._results(devices, lambda device: self._apply_device(device, by_name[device.device_name]), "apply")
+
+    def restore_communities(self, entries: list[dict]) -> Iterator[dict]:
+        """
+        Return each device to the SNMP communities recorded in a snapshot.
+
+        Args:
+            entries (list): The snapshot entries
+
+        Returns:
+            results (Iterator): Per-device results, in completion order
+        """
+        by_name = {entry["device_name"]: entry for entry in entries}
+        devices = self.entry_devices(list(by_name.values()))
+        return self._results(
+            devices,
+            lambda device: self._restore_device(device, by_name[device.device_name]["communities"]),
+            "snmp rollback",
+        )
+
+    def rotate_secrets(self, secrets: list[SecretKind], devices: Optional[list[DeviceRecord]] = None) -> Iterator[dict]:
+        """
+        Apply a set of secret changes to each device in one batched write.
+
+        Args:
+            secrets (list): The secret changes to apply
+            devices (list): The devices, defaults to the whole fleet
+
+        Returns:
+            results (Iterator): Per-device results, in completion order
+        """
+        devices = self.discover(devices)
+        return self._results(devices, lambda device: self._rotate_device(device, secrets), "rotate")
+
+    def _list_device(self, device: DeviceRecord) -> dict:
+        debug_msg(self.debug, f"Processing device {device.device_name}")
+        result = {"device_name": device.device_name, "success": True, "reasons": [], "communities": []}
+        device_manager = self._open(device)
+        try:
+            current_snmp = device_manager.lookup_snmp_communities() if device_manager.enabled else None
+            debug_msg(self.debug, f"SNMP Lookup Results: {current_snmp}")
+            if not device_manager.enabled:
+                result["success"] = False
+                result["reasons"].append(f"snmp-list: {connect_failure(device_manager, result)[1]}")
+            elif current_snmp is None:
+                result["success"] = False
+                result["reasons"].append("snmp-list: Unable to read communities")
+            else:
+                result["communities"] = current_snmp
+        except Exception as e:
+            result["success"] = False
+            result["reasons"].append(f"snmp-list: {mask_secrets(str(e))}")
+        finally:
+            # Close connection to device
+            self._close(device, device_manager)
+            mark_auth_failure(device_manager, result)
+
+        check_result(device.device_name, "snmp-list", (result["success"], ", ".join(result["reasons"])), self.debug)
+        return result
+
+    def _update_device(
+        self,
+        device: DeviceRecord,
+        delete_current: bool,
+        ro_community: str,
+        rw_community: str,
+        verify: bool = False,
+        snapshot: Optional[SnapshotWriter] = None,
+    ) -> dict:
+        # The result includes the transport, the communities before the update and any verification mismatches
+        debug_msg(self.debug, f"Processing device {device.device_name}")
+        result = {"device_name": device.device_name, "success": True, "reasons": []}
+
+        def record(action, action_result):
+            check_result(device.device_name, action, action_result, self.debug)
+            if not action_result[0]:
+                result["success"] = False
+                result["reasons"].append(f"{action}: {action_result[1]}")
+
+        device_manager = self._open(device)
+        if not device_manager.enabled:
+            record("connect", connect_failure(device_manager, result))
+            self._close(device, device_manager)
+            return result
+
+        try:
+            # Record the current communities before changing anything
+            current = device_manager.lookup_snmp_communities()
+            if current is None:
+                record("snmp-snapshot", (False, "Unable to read current communities, no changes made"))
+                return result
+            result["transport"] = transport_name(device_manager)
+            result["previous"] = current
+            if snapshot:
+                snapshot.record(device, result["transport"], current)
+
+            # Apply every delete and create for the device in one bulk write
+            intended = intended_communities(current, delete_current, ro_community, rw_community)
+            creates, deletes = diff_communities(current, intended)
+            debug_msg(self.debug, f"Creating communities {[snmp['name'] for snmp in creates]}, deleting {deletes}")
+            if creates or deletes:
+                record("snmp-update", device_manager.apply_snmp_changes(creates, deletes))
+
+            # Read the communities back on the same connection and compare to the intended set
+            if verify:
+                final = device_manager.lookup_snmp_communities(refresh=True)
+                if final is None:
+                    record("snmp-verify", (False, "Unable to read communities after update"))
+                else:
+                    missing, unexpected = diff_communities(final, intended)
+                    unexpected = [community for community in final if community["name"] in unexpected]
+                    if missing or unexpected:
+                        result["mismatches"] = {"missing": missing, "unexpected": unexpected}
+                        record("snmp-verify", (False, f"{len(missing)} missing, {len(unexpected)} unexpected"))
+        except Exception as e:
+            record("snmp-update", (False, mask_secrets(str(e))))
+        finally:
+            # Close connection to device
+            self._close(device, device_manager)
+            mark_auth_failure(device_manager, result)
+
+        return result
+
+    def _plan_device(
+        self, device: DeviceRecord, plan: SnapshotWriter, delete_current: bool, ro_community: str, rw_community: str
+    ) -> dict:
+        result = {"device_name": device.device_name, "success": True, "reasons": []}
+        device_manager = self._open(device)
+        try:
+            current = device_manager.lookup_snmp_communities() if device_manager.enabled else None
+            if not device_manager.enabled:
+                result["success"] = False
+                result["reasons"].append(f"plan: {connect_failure(device_manager, result)[1]}")
+            elif current is None:
+                result["success"] = False
+                result["reasons"].append("plan: Unable to read current communities")
+            else:
+                intended = intended_communities(current, delete_current, ro_community, rw_community)
+                creates, deletes = diff_communities(current, intended)
+                plan.record(device, transport_name(device_manager), current, creates=creates, deletes=deletes)
+        except Exception as e:
+            result["success"] = False
+            result["reasons"].append(f"plan: {mask_secrets(str(e))}")
+        finally:
+            self._close(device, device_manager)
+            mark_auth_failure(device_manager, result)
+
+        check_result(device.device_name, "snmp-plan", (result["success"], ", ".join(result["reasons"])), self.debug)
+        return result
+
+    def _apply_device(self, device: DeviceRecord, entry: dict) -> dict:
+        debug_msg(self.debug, f"Applying plan to device {device.device_name}")
+        result = {"device_name": device.device_name, "success": True, "reasons": []}
+
+        device_manager = self._open(device)
+        try:
+            if not device_manager.enabled:
+                action_result = connect_failure(device_manager, result)
+            else:
+                current = device_manager.lookup_snmp_communities()
+                planned = {(snmp["name"], snmp.get("permission")) for snmp in entry["communities"]}
+                if current is None or {(snmp["name"], snmp.get("permission")) for snmp in current} != planned:
+                    action_result = (False, "Device state drifted since the plan was made, refusing to apply")
+                elif not entry["creates"] and not entry["deletes"]:
+                    action_result = (True, None)
+                else:
+                    action_result = device_manager.apply_snmp_changes(entry["creates"], entry["deletes"])
+        except Exception as e:
+            action_result = (False, mask_secrets(str(e)))
+        finally:
+            self._close(device, device_manager)
+            mark_auth_failure(device_manager, result)
+
+        check_result(device.device_name, "apply", action_result, self.debug)
+        if not action_result[0]:
+            result["success"] = False
+            result["reasons"].append(f"apply: {action_result[1]}")
+
+        return result
+
+    def _restore_device(self, device: DeviceRecord, communities: list[dict[str, str]]) -> dict:
+        debug_msg(self.debug, f"Restoring device {device.device_name}")
+        result = {"device_name": device.device_name, "success": True, "reasons": []}
+
+        device_manager = self._open(device)
+        try:
+            if not device_manager.enabled:
+                action_result = connect_failure(device_manager, result)
+            else:
+                current = device_manager.lookup_snmp_communities()
+                if current is None:
+                    action_result = (False, "Unable to read current communities")
+                else:
+                    creates, deletes = diff_communities(current, communities)
+                    debug_msg(self.debug, f"Restoring {device.device_name}: create {creates}, delete {deletes}")
+                    action_result = device_manager.apply_snmp_changes(creates, deletes)
+        except Exception as e:
+            action_result = (False, mask_secrets(str(e)))
+        finally:
+            self._close(device, device_manager)
+            mark_auth_failure(device_manager, result)
+
+        check_result(device.device_name, "snmp-rollback", action_result, self.debug)
+        if not action_result[0]:
+            result["success"] = False
+            result["reasons"].append(f"snmp-rollback: {action_result[1]}")
+
+        return result
+
+    def _rotate_device(self, device: DeviceRecord, secrets: list[SecretKind]) -> dict:
+        debug_msg(self.debug, f"Processing device {device.device_name}")
+        result = {"device_name": device.device_name, "success": True, "reasons": []}
+
+        device_manager = self._open(device)
+        try:
+            if not device_manager.enabled:
+                action_result = connect_failure(device_manager, result)
+            else:
+                action_result = device_manager.apply_secrets(secrets)
+        except Exception as e:
+            action_result = (False, mask_secrets(str(e)))
+        finally:
+            self._close(device, device_manager)
+            mark_auth_failure(device_manager, result)
+
+        check_result(device.device_name, "rotate", action_result, self.debug)
+        if not action_result[0]:
+            result["success"] = False
+            result["reasons"].append(f"rotate: {action_result[1]}")
+
+        return result
+
+    def _open(self, device: DeviceRecord):
+        # Connect with the device's transport, with automatic selection falling back
+        # through the device's other transports until one connects. Rejected credentials
+        # are not a transport problem, so they do not fall back
+        device_manager = self._connect(device)
+        fallbacks = self.fallbacks.get(device.address, [])
+        for index, transport in enumerate(fallbacks):
+            if device_manager.enabled or getattr(device_manager, "auth_failed", False):
+                break
+
+            failed = device.transport
+            self.transport_history.record(device.device_name, failed, None, False)
+            self._close(device, device_manager)
+            debug_msg(self.debug, f"{failed} failed on {device.device_name}, falling back to {transport}")
+
+            # Later calls on this fleet start from the transport fallen back to
+            device.set_transport(transport, f"auto: {failed} failed to connect, fell back to {transport}")
+            self.transports[device.address] = (device.transport, device.discovery)
+            self.fallbacks[device.address] = fallbacks[index + 1:]
+            device_manager = self._connect(device)
+
+        return device_manager
+
+    def _connect(self, device: DeviceRecord):
+        # Connect with the device's transport, reusing a kept session if there is one
+        if self.session_pool is not None:
+            device_manager = self.session_pool.acquire((device.address, device.transport), device)
+            # A warm session may have cached state from an earlier call
+            if device_manager.enabled:
+                device_manager.invalidate_cache()
+            return device_manager
+
+        return self.create_device_manager(device)
+
+    def _close(self, device: DeviceRecord, device_manager) -> None:
+        # Return a kept session to the pool, otherwise disconnect
+        if self.session_pool is not None:
+            self.session_pool.release((device.address, device.transport))
+        else:
+            device_manager.disconnect()
+
+    def session_log(self, device: DeviceRecord) -> Optional[logging.Logger]:
+        """
+        The session logger for a device.
+
+        Args:
+            device (DeviceRecord): The device
+
+        Returns:
+            logger (logging.Logger): The device's session logger, None without a session log directory
+        """
+        if self.session_logs is None:
+            return None
+        return self.session_logs.logger(device.device_name)
+
+    def create_device_manager(self, device: DeviceRecord):
+        """
+        Create a new connection to a device with its transport.
+
+        Args:
+            device (DeviceRecord): The device
+
+        Returns:
+            device_manager (Restconf | Netconf | CliConfig): The connected device manager
+        """
+        if device.transport == "netconf":
+            return self.netconf_manager(device)
+        # Use RESTCONF if supported
+        if device.transport == "restconf":
+            return Restconf(device.address, self.username, self.password, self.session_log(device))
+        # Attempt to use CLI instead
+        return CliConfig(
+            device.address,
+            self.username,
+            self.password,
+            verbose=self.cli_verbose,
+            session_log=self.session_log(device),
+        )
+
+    def netconf_manager(self, device: DeviceRecord) -> Netconf:
+        """
+        Open a NETCONF session to a device, on the inventory netconf_port if set.
+
+        Args:
+            device (DeviceRecord): The device
+
+        Returns:
+            device_manager (Netconf): The device manager, check enabled for the result
+        """
+        return Netconf(
+            device.address,
+            self.username,
+            self.password,
+            port=int(device.get("netconf_port", 830)),
+            session_log=self.session_log(device),
+        )
@@ -3,11 +3,27 @@ Command line tool for changing keys and secret strings in the network.
 """
 
 import click
+import json
 import os
+import random
+import signal
+import threading
+import time
 import yaml
-from .utils.restconf import Restconf
-from .utils.cli_config import CliConfig
-from .utils.utils import debug_msg, check_result
+from typing import Callable, Optional
+from .fleet import Fleet
+from .utils.utils import debug_msg
+from .utils.runner import parse_waves
+from .utils.metrics import MetricsWriter
+from .utils.progress import ProgressDisplay
+from .utils.secret_kinds import SnmpCommunities, TacacsKey, RadiusKey, EnableSecret, LocalUser
+from .utils.snapshot import SnapshotWriter, default_snapshot_file, load_snapshot, load_journal
+from .utils.sharding import parse_shard
+from .utils.device import DeviceRecord
+from .utils.selection import check_patterns
+from .utils.agent import AgentServer, AgentClient, default_socket_path
+from .utils.results import write_results, merge_files, missing_shards
+from .utils.schedule import DaemonStatus, parse_duration, spread_start_times
 
 # TODO: The following must be considered as part of all work on this exercise
 #       - Provide good help messages to users for all commands and options
@@ -27,13 +43,61 @@ from .utils.utils import debug_msg, check_result
 #       - Default to the value "inventory.yaml"
 # TODO: Add an option "--prefer-restconf" that controls whether the tool will attempt to use RESTCONF for all communications
 
+# Commands that run without network credentials or an inventory
+OFFLINE_COMMANDS = {"merge-results", "daemon-status"}
+
+# Commands that need network credentials but not an inventory
+NO_INVENTORY_COMMANDS = {"agent"}
+
+
 @click.group()
 @click.option('--debug',  is_flag=True, default=False, help="Print debug messages during procesing")
 @click.option('--cli-verbose', is_flag=True, help="Stream CLI connection info to screen")
 @click.option('--prefer-restconf',  is_flag=True, help="Attempt to use RESTCONF even if not defined in inventory.")
-@click.option('--inventory','-i', help="The network inventory file to operate on", default='inventory.yaml')
+@click.option('--prefer-netconf', is_flag=True,
+              help="Attempt to use NETCONF (port from inventory netconf_port, default 830) before RESTCONF or CLI.")
+@click.option('--transport', type=click.Choice(['inventory', 'auto']), default='inventory', show_default=True,
+              help="How to pick each device's transport: from the inventory and --prefer-* flags, or 'auto' "
+                   "to use the fastest reliable transport measured on earlier runs, falling back when it fails")
+@click.option('--transport-history-file', default='.rotatekey-transports.json', show_default=True,
+              help="File of per-device transport latency and success rates, used by --transport auto")
+@click.option('--inventory','-i', help="The network inventory file to operate on (YAML, .jsonl or .csv)",
+              default='inventory.yaml')
+@click.option('--inventory-cache', default='.rotatekey-cache', show_default=True,
+              help="Directory to cache parsed YAML inventories in, empty to disable")
+@click.option('--limit', '-l', 'limit', multiple=True, metavar='PATTERN',
+              help="Only work on matching devices: name, glob, ~regex, address/CIDR, tag:/site:/group:NAME, "
+                   "or !PATTERN to exclude. May be given more than once")
+@click.option('--workers', '-w', type=click.IntRange(min=1), default=10, show_default=True,
+              help="Maximum number of devices to work on at the same time")
+@click.option('--adaptive', is_flag=True,
+              help="Adjust the number of devices worked on at once, up to --workers, from observed latency and errors")
+@click.option('--max-per-site', type=click.IntRange(min=1),
+              help="Maximum number of devices from one inventory site (or group) to work on at the same time")
+@click.option('--max-auth-failures', type=click.IntRange(min=1), metavar='N',
+              help="Stop all work, including devices in the queue, once N devices reject the credentials")
+@click.option('--history-file', default='.rotatekey-history.json', show_default=True,
+              help="File of per-device run times, used to start the slowest devices first")
+@click.option('--shard', metavar='K/N', help="Only process shard K of N, for splitting the inventory across hosts")
+@click.option('--results-file', help="Write the per-device results of the command to this file")
+@click.option('--metrics-file', metavar='PATH',
+              help="Write run statistics to this file in the Prometheus textfile collector format")
+@click.option('--metrics-interval', type=click.FloatRange(min=1), metavar='SECONDS',
+              help="Also rewrite the metrics file this often during the run")
+@click.option('--session-log-dir', metavar='DIR',
+              help="Write each device's CLI dialog and RESTCONF/NETCONF request summaries to its own file in DIR")
+@click.option('--session-log-max-size', type=click.IntRange(min=1), default=10, show_default=True, metavar='MB',
+              help="Most megabytes of session log to keep per device")
+@click.option('--session-log-compress', is_flag=True, help="Gzip compress the session logs")
+@click.option('--no-progress', is_flag=True,
+              help="Do not show the live progress line (it is only shown when stderr is a terminal)")
+@click.option('--agent-socket', envvar='ROTATEKEY_AGENT_SOCKET',
+              help="Send snmp list/update to a running `rotatekey agent` on this socket")
 @click.pass_context
-def cli(ctx, inventory, debug, cli_verbose, prefer_restconf):
+def cli(ctx, inventory, inventory_cache, limit, debug, cli_verbose, prefer_restconf, prefer_netconf, transport,
+        transport_history_file, workers, adaptive, max_per_site, max_auth_failures, history_file, shard,
+        results_file, metrics_file, metrics_interval, session_log_dir, session_log_max_size, session_log_compress,
+        no_progress, agent_socket):
     """
     Utilities for rotating network secrets and keys.
 
@@ -45,56 +109,130 @@ def cli(ctx, inventory, debug, cli_verbose, prefer_restconf):
     Args:
         ctx (Click.Context):
         inventory (str): Network inventory file
+        inventory_cache (str): Directory to cache parsed YAML inventories in
+        limit (tuple): Patterns selecting the devices to work on
         debug (bool): Debug flag
         cli_verbose (bool): Debug flag
         prefer_restconf (bool): Attempt to use RESTCONF on all devices
+        prefer_netconf (bool): Attempt to use NETCONF on all devices
+        transport (str): "inventory" or "auto" transport selection
+        transport_history_file (str): File of per-device transport latency and success rates
+        workers (int): Maximum number of devices to process concurrently
+        adaptive (bool): Adapt the number of devices processed concurrently
+        max_per_site (int): Maximum number of devices from one site processed concurrently
+        max_auth_failures (int): Stop all work once this many devices reject the credentials
+        history_file (str): File of per-device run times
+        shard (str): Only process this shard of the inventory, as K/N
+        results_file (str): File to write the per-device results to
+        metrics_file (str): File to write run statistics to
+        metrics_interval (float): Seconds between metrics file writes during the run
+        session_log_dir (str): Directory for per-device session logs
+        session_log_max_size (int): Most megabytes of session log per device
+        session_log_compress (bool): Gzip compress the session logs
+        no_progress (bool): Do not show the live progress line
+        agent_socket (str): Socket of a running agent to send requests to
     """
+    # ensure that ctx.obj exists and is a dict (in case `cli()` is called
+    # by means other than the `if` block below)
+    ctx.ensure_object(dict)
+    ctx.obj["results_file"] = results_file
+
+    # Commands that only work on local files need no credentials or inventory
+    if ctx.invoked_subcommand in OFFLINE_COMMANDS:
+        return
+
     # Check for network credentials set as environment variables
     if "NETWORK_USERNAME" not in os.environ or "NETWORK_PASSWORD" not in os.environ:
 
         click.secho("ERROR: You must set the NETWORK_USERNAME and NETWORK_PASSWORD environment variables.", fg='red')
         exit(1)
 
-    # ensure that ctx.obj exists and is a dict (in case `cli()` is called
-    # by means other than the `if` block below)
-    ctx.ensure_object(dict)
+    try:
+        ctx.obj["shard"] = parse_shard(shard) if shard else None
+    except ValueError as e:
+        raise click.BadParameter(str(e), param_hint="--shard")
+
+    try:
+        check_patterns(list(limit))
+    except ValueError as e:
+        raise click.BadParameter(str(e), param_hint="--limit")
+
+    # Write the run statistics when the command finishes, and periodically if asked
+    if metrics_file:
+        metrics_writer = MetricsWriter(metrics_file, metrics_interval)
+
+        def write_metrics():
+            try:
+                metrics_writer.close()
+            except OSError as e:
+                click.secho(f"WARNING: Unable to write metrics to {metrics_file}: {e}", fg='yellow', err=True)
+
+        ctx.call_on_close(write_metrics)
 
     # Set and store the flags for command
     ctx.obj["debug"] = debug
-    ctx.obj["cli_verbose"] = cli_verbose
-    ctx.obj["prefer_restconf"] = prefer_restconf
-
-    # load the inventory file
-    with open(inventory) as f:
-        inventory = yaml.safe_load(f)
-
-    # save the inventory file in the context
-    ctx.obj["inventory"] = inventory
-    ctx.obj["network_username"] = os.getenv("NETWORK_USERNAME")
-    ctx.obj["network_password"] = os.getenv("NETWORK_PASSWORD")
-
-    # Setup RESTCONF Objects for each device if supported
-    debug_msg(ctx.obj["debug"], f"Prefer RESTCONF status: {prefer_restconf}")
-    for device in ctx.obj["inventory"]:
-        # Check for RESTCONF support if the device is set to "restconf: True" in inventory
-        # or if the "prefer-restconf" flag was set. Otherwise, set the device's restconf = False
-        if device.get("restconf", False) or prefer_restconf:
-            debug_msg(ctx.obj["debug"], f"Testing device {device['device_name']} for RESTCONF Support")
-            device_restconf = Restconf(device["address"], ctx.obj["network_username"], ctx.obj["network_password"])
-            device["restconf"] = device_restconf.enabled
-        else:
-            debug_msg(ctx.obj["debug"], f"Device {device['device_name']} will use CLI connection")
-            device["restconf"] = False
+    ctx.obj["progress"] = not no_progress
+    ctx.obj["agent_socket"] = agent_socket
+    ctx.obj["fleet_options"] = {
+        "workers": workers,
+        "adaptive": adaptive,
+        "max_per_site": max_per_site,
+        "max_auth_failures": max_auth_failures,
+        "prefer_restconf": prefer_restconf,
+        "prefer_netconf": prefer_netconf,
+        "transport": transport,
+        "transport_history_file": transport_history_file if transport == "auto" else None,
+        "cli_verbose": cli_verbose,
+        "debug": debug,
+        "history_file": history_file,
+        "progress": not no_progress,
+        "session_log_dir": session_log_dir,
+        "session_log_max_bytes": session_log_max_size * 1024 * 1024,
+        "session_log_compress": session_log_compress,
+    }
+
+    # The agent builds its own fleet from the devices in each request
+    if ctx.invoked_subcommand in NO_INVENTORY_COMMANDS:
+        return
+
+    # load the inventory file, keeping only the devices in this runner's shard and matching --limit
+    ctx.obj["fleet"] = Fleet.from_inventory(
+        inventory,
+        limit=list(limit),
+        shard=ctx.obj["shard"],
+        cache_dir=inventory_cache or None,
+        **ctx.obj["fleet_options"],
+    )
+    ctx.call_on_close(ctx.obj["fleet"].close)
+
+    # Long running commands reload the inventory to pick up changes
+    ctx.obj["load_devices"] = lambda: Fleet.load_devices(inventory, list(limit), ctx.obj["shard"],
+                                                         inventory_cache or None, debug)
+
+
+def in_order(devices: list[DeviceRecord], results) -> list[dict]:
+    """
+    Collect streamed per-device results in the order of the devices.
+
+    Args:
+        devices (list): The devices, in the order to report them
+        results (Iterable): The per-device results, in any order
+
+    Returns:
+        results (list): The results, in the same order as the devices
+    """
+    position = {device.device_name: index for index, device in enumerate(devices)}
+    return sorted(results, key=lambda result: position.get(result["device_name"], len(position)))
 
 
 @cli.command()
 @click.pass_context
 def check_inventory(ctx):
     """
-    Display status of communication protocols for each device in inventory.
+    Display the transport chosen for each device in inventory, and why.
     """
-    for device in ctx.obj["inventory"]:
-        click.echo(f"Device {device['device_name']} RESTCONF enabled: {device['restconf']}")
+    for device in ctx.obj["fleet"].discover():
+        click.echo(f"Device {device.device_name} transport: {device.transport} ({device.discovery})")
 
 
 # TODO: Make snmp a new command group under the CLI command as `rotatekey snmp`
@@ -112,43 +250,51 @@ def snmp_list(ctx):
     """
     Lookup and list the SNMP communities created on the devices in inventory.
     """
+    fleet = ctx.obj["fleet"]
+    if ctx.obj["agent_socket"]:
+        results = agent_request(ctx, "snmp list", fleet.devices)
+    else:
+        results = in_order(fleet.devices, fleet.list_communities())
+
     click.echo(f"{'Device':15} {'Community':15} {'Rights':5}")
     click.echo("-" * 40)
-    for device in ctx.obj["inventory"]:
-        debug_msg(ctx.obj["debug"], f"Processing device {device['device_name']}")
-        # Use RESTCONF if it is enabled
-        if device["restconf"]:
-            device_manager = Restconf(
-                device["address"],
-                ctx.obj["network_username"],
-                ctx.obj["network_password"],
-            )
-        # Attempt to use CLI instead
-        else:
-            device_manager = CliConfig(
-                device["address"],
-                ctx.obj["network_username"],
-                ctx.obj["network_password"],
-                verbose=ctx.obj["cli_verbose"],
-            )
-
-        current_snmp = device_manager.lookup_snmp_communities()
-        debug_msg(ctx.obj["debug"], f"SNMP Lookup Results: {current_snmp}")
-        for snmp in current_snmp:
-            print(f"{device['device_name']:15} {snmp['name']:15} {snmp['permission']:5}")
+    for result in results:
+        for snmp in result.get("communities", []):
+            print(f"{result['device_name']:15} {snmp['name']:15} {snmp['permission']:5}")
 
-        # Close connection to device
-        device_manager.disconnect()
+    save_results(ctx, results)
+    exit_if_aborted(ctx, results)
 
 
 @snmp.command('update')
 @click.option('--delete-current','-d', is_flag=True, help="Whether to delete all current SNMP communities")
 @click.option('--ro-community', '--ro', help='The new Read-Only community string to create')
 @click.option('--rw-community', '--rw', help="The new Read-Write community string to create")
+@click.option('--waves', help="Cumulative rollout sizes as counts or percentages, e.g. '1,10%,50%,100%'")
+@click.option('--max-failure-rate', type=click.FloatRange(0, 1), default=0.0, show_default=True,
+              help="Halt the rollout when the failure rate of a wave is above this fraction")
+@click.option('--verify', is_flag=True, help="Read the communities back after the update and report any mismatches")
+@click.option('--snapshot-file', help="File to record the current communities in before changing them "
+              "(default: snmp-snapshot-<timestamp>.jsonl)")
 @click.pass_context
-def snmp_update(ctx, delete_current: bool, ro_community: str, rw_community: str):
+def snmp_update(ctx, delete_current: bool, ro_community: str, rw_community: str, waves: str, max_failure_rate: float,
+                verify: bool, snapshot_file: str):
     """
     Update the SNMP community strings configured on devices in the inventory.
+
+    With --waves the inventory is updated in stages. Every device in a wave is
+    updated concurrently and verified before the next wave starts. If the
+    failure rate of a wave is above --max-failure-rate the rollout halts.
+
+    The communities configured on each device are recorded in a snapshot file
+    before any change is made, for use with `rotatekey snmp rollback`. The
+    snapshot records each community's name and permission, not its view or ACL.
+
+    With --verify (always on for --waves) the communities are read back on the
+    same connection after the update and compared to the intended set.
+
+    Exits non-zero if any device failed, including when the last wave is over
+    --max-failure-rate.
     """
     print("Updating the network devices to: ")
     if delete_current:
@@ -158,56 +304,539 @@ def snmp_update(ctx, delete_current: bool, ro_community: str, rw_community: str)
     if rw_community:
         click.secho(f"  - A new read-write community string '{rw_community}' will be created", fg='green')
 
-    # Loop through each device in inventory
-    for device in ctx.obj["inventory"]:
-        debug_msg(ctx.obj["debug"], f"Processing device {device['device_name']}")
-
-        # Use RESTCONF if supported
-        if device["restconf"]:
-            device_manager = Restconf(
-                device["address"],
-                ctx.obj["network_username"],
-                ctx.obj["network_password"],
+    # With an agent, discovery happens (and is cached) in the agent
+    fleet = ctx.obj["fleet"]
+    inventory = fleet.devices if ctx.obj["agent_socket"] else fleet.discover()
+    try:
+        wave_sizes = parse_waves(waves, len(inventory)) if waves else [len(inventory)]
+    except ValueError as e:
+        raise click.BadParameter(str(e), param_hint="--waves")
+
+    snapshot = SnapshotWriter(snapshot_file or default_snapshot_file())
+    click.echo(f"Recording current SNMP communities to {snapshot.path}")
+
+    all_results = []
+    start = 0
+    for wave_number, wave_size in enumerate(wave_sizes, start=1):
+        wave = inventory[start:start + wave_size]
+        start += wave_size
+        if waves:
+            click.secho(f"Wave {wave_number}/{len(wave_sizes)}: updating {len(wave)} device(s)", fg='cyan')
+
+        try:
+            if ctx.obj["agent_socket"]:
+                wave_devices = {device.device_name: device for device in wave}
+
+                def record_previous(result):
+                    # Flushed as each result arrives, so an interrupted request keeps what was changed so far
+                    device = wave_devices.get(result["device_name"])
+                    if device is not None and result.get("previous") is not None:
+                        snapshot.record(device, result["transport"], result["previous"])
+
+                results = agent_request(ctx, "snmp update", wave, on_result=record_previous,
+                                        delete_current=delete_current, ro_community=ro_community,
+                                        rw_community=rw_community, verify=verify or bool(waves))
+            else:
+                results = in_order(wave, fleet.update_communities(delete_current, ro_community, rw_community,
+                                                                  verify=verify or bool(waves), snapshot=snapshot,
+                                                                  devices=wave))
+        except BaseException:
+            snapshot.close()
+            raise
+        all_results.extend(results)
+
+        failures = [result for result in results if not result["success"]]
+        failure_rate = len(failures) / len(results) if results else 0.0
+        if waves:
+            click.echo(f"Wave {wave_number}: {len(results) - len(failures)} succeeded, {len(failures)} failed")
+
+        if failures and failure_rate > max_failure_rate and start < len(inventory):
+            click.secho(
+                f"ERROR: Wave {wave_number} failure rate {failure_rate:.0%} is above the maximum "
+                f"of {max_failure_rate:.0%}. Halting rollout, {len(inventory) - start} device(s) were not updated.",
+                fg='red',
+                err=True,
             )
-        # Attempt to use CLI instead
+            snapshot.close()
+            print_summary(all_results)
+            save_results(ctx, all_results)
+            exit(1)
+
+    snapshot.close()
+    print_summary(all_results)
+    save_results(ctx, all_results)
+
+    # Any failed device fails the command, as for rollback and apply, whatever --max-failure-rate allowed
+    if any(not result["success"] for result in all_results):
+        exit(1)
+
+
+def exit_if_aborted(ctx, results: list[dict]) -> None:
+    """
+    Exit non-zero if the run stopped after too many devices rejected the credentials.
+
+    Args:
+        ctx (Click.Context):
+        results (list): The per device results of the run, which come from the agent in agent mode
+    """
+    if ctx.obj["fleet"].aborted or any(result.get("error_kind") == "aborted" for result in results):
+        exit(1)
+
+
+def save_results(ctx, results: list[dict]) -> None:
+    """
+    Write the per-device results of a command if --results-file was given.
+
+    Args:
+        ctx (Click.Context):
+        results (list): The per device results of the run
+    """
+    if not ctx.obj.get("results_file"):
+        return
+
+    command = " ".join(ctx.command_path.split()[1:])
+    write_results(ctx.obj["results_file"], command, results, shard=ctx.obj.get("shard"))
+    debug_msg(ctx.obj["debug"], f"Results written to {ctx.obj['results_file']}")
+
+
+def print_summary(results: list[dict]) -> None:
+    """
+    Print a summary of a run, including any verification mismatches.
+
+    Args:
+        results (list): The per device results of the run
+    """
+    failures = [result for result in results if not result["success"]]
+    click.echo(f"Run summary: {len(results) - len(failures)} succeeded, {len(failures)} failed")
+
+    mismatched = [result for result in results if result.get("mismatches")]
+    if mismatched:
+        click.secho("Verification mismatches:", fg='red')
+        click.echo(f"{'Device':15} {'Community':15} {'Rights':6} {'Problem':10}")
+        click.echo("-" * 50)
+        for result in mismatched:
+            for problem, communities in result["mismatches"].items():
+                for community in communities:
+                    click.echo(f"{result['device_name']:15} {community['name']:15} "
+                               f"{str(community.get('permission')):6} {problem:10}")
+
+
+@snmp.command('rollback')
+@click.option('--snapshot', 'snapshot_file', required=True, type=click.Path(exists=True, dir_okay=False),
+              help="Snapshot file written by `rotatekey snmp update`")
+@click.pass_context
+def snmp_rollback(ctx, snapshot_file: str):
+    """
+    Restore the SNMP communities recorded in a snapshot file.
+
+    Devices are restored concurrently. Only the communities that differ from the
+    snapshot are changed, using one bulk write per device. Snapshots record the
+    name and permission of each community, so views and ACLs are not restored.
+    """
+    # Use the transport recorded in the snapshot rather than discovering it again
+    fleet = ctx.obj["fleet"]
+    entries = load_snapshot(snapshot_file)
+    click.secho(
+        "WARNING: Snapshots record community names and permissions only, "
+        "views and ACLs on restored communities must be reapplied by hand",
+        fg='yellow',
+        err=True,
+    )
+    click.echo(f"Restoring SNMP communities on {len(fleet.entry_devices(entries))} device(s) from {snapshot_file}")
+
+    results = list(fleet.restore_communities(entries))
+    save_results(ctx, results)
+
+    failures = [result for result in results if not result["success"]]
+    click.echo(f"Rollback complete: {len(results) - len(failures)} restored, {len(failures)} failed")
+    if failures:
+        exit(1)
+
+
+@snmp.command('plan')
+@click.option('--delete-current','-d', is_flag=True, help="Whether to delete all current SNMP communities")
+@click.option('--ro-community', '--ro', help='The new Read-Only community string to create')
+@click.option('--rw-community', '--rw', help="The new Read-Write community string to create")
+@click.option('--plan-file', help="File to write the plan to (default: snmp-plan-<timestamp>.jsonl)")
+@click.pass_context
+def snmp_plan(ctx, delete_current: bool, ro_community: str, rw_community: str, plan_file: str):
+    """
+    Read every device and record the SNMP changes an update would make.
+
+    The plan lists the transport, current communities and the exact creates and
+    deletes for each device. Run it with `rotatekey apply PLAN`. A plan file can
+    also be used as a snapshot for `rotatekey snmp rollback`.
+    """
+    fleet = ctx.obj["fleet"]
+    plan = SnapshotWriter(
+        plan_file or default_snapshot_file("plan"),
+        kind="plan",
+        options={"delete_current": delete_current, "ro_community": ro_community, "rw_community": rw_community},
+    )
+
+    try:
+        results = in_order(fleet.devices, fleet.plan_communities(plan, delete_current, ro_community, rw_community))
+    finally:
+        plan.close()
+
+    click.echo(f"Plan written to {plan.path}")
+    print_summary(results)
+    save_results(ctx, results)
+    exit_if_aborted(ctx, results)
+
+
+@cli.command('apply')
+@click.argument('plan_file', metavar='PLAN', type=click.Path(exists=True, dir_okay=False))
+@click.pass_context
+def apply_plan(ctx, plan_file: str):
+    """
+    Apply the SNMP changes recorded by `rotatekey snmp plan`.
+
+    No discovery or planning is repeated: each device is connected with the
+    transport recorded in the plan. The communities are read once on that
+    connection and a device is refused if they no longer match the plan.
+    Exits non-zero if any device failed or was refused.
+    """
+    header, entries = load_journal(plan_file)
+    if header.get("kind") != "plan":
+        raise click.BadParameter(f"{plan_file} is not a plan file", param_hint="PLAN")
+    fleet = ctx.obj["fleet"]
+    click.echo(f"Applying plan {plan_file} created {header.get('created')} to "
+               f"{len(fleet.entry_devices(entries))} device(s)")
+
+    results = list(fleet.apply_plan(entries))
+    print_summary(results)
+    save_results(ctx, results)
+
+    if any(not result["success"] for result in results):
+        exit(1)
+
+
+@cli.command('merge-results')
+@click.argument('files', nargs=-1, required=True, type=click.Path(exists=True, dir_okay=False))
+@click.option('--output', '-o', help="Write the combined results to this file")
+@click.option('--journal-output', help="Write the combined snapshot or plan entries to this file")
+@click.pass_context
+def merge_results(ctx, files: tuple, output: str, journal_output: str):
+    """
+    Combine results, snapshot and plan files from sharded runs into one fleet report.
+
+    Needs no credentials or inventory. Files written with --results-file on
+    each runner host are reported together, and snapshots or plans from the
+    same hosts can be merged into a single file for a fleet wide rollback.
+    """
+    merged = merge_files(files)
+
+    for group_name, group in merged.items():
+        devices = list(group["devices"].values())
+        click.secho(f"{group_name}: {len(devices)} device(s) from {len(group['headers'])} file(s)", fg='cyan')
+
+        missing = missing_shards(group["headers"])
+        if missing:
+            click.secho(f"  WARNING: No file for shard(s) {', '.join(str(shard) for shard in missing)}", fg='red')
+
+        if group["headers"][0].get("kind") == "results":
+            failures = [device for device in devices if not device.get("success")]
+            click.echo(f"  {len(devices) - len(failures)} succeeded, {len(failures)} failed")
+            for device in failures:
+                click.echo(f"  {device['device_name']:15} {'; '.join(device.get('reasons', []))}")
+            if output:
+                write_results(output, group["headers"][0].get("command", ""), devices,
+                              merged_from=[header["file"] for header in group["headers"]])
+        elif journal_output:
+            journal = SnapshotWriter(journal_output, kind=group["headers"][0].get("kind", "snapshot"),
+                                     merged_from=[header["file"] for header in group["headers"]])
+            for device in devices:
+                journal.record(
+                    DeviceRecord.from_entry(device), device["transport"], device["communities"],
+                    **{key: value for key, value in device.items()
+                       if key not in ("device_name", "address", "site", "transport", "communities")},
+                )
+            journal.close()
+
+
+@cli.command('rotate')
+@click.option('--snmp-ro', help="A new Read-Only SNMP community string to create")
+@click.option('--snmp-rw', help="A new Read-Write SNMP community string to create")
+@click.option('--tacacs-key', help="The new global TACACS+ server key")
+@click.option('--radius-key', help="The new global RADIUS server key")
+@click.option('--enable-secret', help="The new enable secret")
+@click.option('--user', 'users', multiple=True, metavar='USERNAME:PASSWORD',
+              help="A local user password to set, may be given more than once")
+@click.pass_context
+def rotate(ctx, snmp_ro: str, snmp_rw: str, tacacs_key: str, radius_key: str, enable_secret: str, users: tuple):
+    """
+    Rotate several kinds of secret on the devices in the inventory at once.
+
+    Every change for a device is applied over a single connection with one
+    batched configuration write.
+    """
+    secrets = []
+    snmp_creates = [
+        {"name": name, "permission": permission}
+        for name, permission in ((snmp_ro, "ro"), (snmp_rw, "rw"))
+        if name
+    ]
+    if snmp_creates:
+        secrets.append(SnmpCommunities(snmp_creates))
+    if tacacs_key:
+        secrets.append(TacacsKey(tacacs_key))
+    if radius_key:
+        secrets.append(RadiusKey(radius_key))
+    if enable_secret:
+        secrets.append(EnableSecret(enable_secret))
+    for user in users:
+        username, separator, password = user.partition(":")
+        if not separator or not username or not password:
+            raise click.BadParameter(f"'{user}' is not in the form USERNAME:PASSWORD", param_hint="--user")
+        secrets.append(LocalUser(username, password))
+
+    if not secrets:
+        raise click.UsageError("Nothing to rotate, provide at least one secret option.")
+
+    click.echo("Rotating on the network devices: ")
+    for secret in secrets:
+        click.secho(f"  - {secret.describe()}", fg='blue')
+
+    fleet = ctx.obj["fleet"]
+    results = in_order(fleet.devices, fleet.rotate_secrets(secrets))
+    print_summary(results)
+    save_results(ctx, results)
+    exit_if_aborted(ctx, results)
+
+
+@cli.command('agent')
+@click.option('--socket', 'socket_path', default=default_socket_path, show_default="$XDG_RUNTIME_DIR/rotatekey-UID.sock",
+              help="Unix socket to listen on")
+@click.option('--max-sessions', type=click.IntRange(min=1), default=100, show_default=True,
+              help="Maximum number of device sessions to keep open")
+@click.option('--idle-timeout', type=click.FloatRange(min=1), default=300, show_default=True,
+              help="Seconds a device session may be idle before it is closed")
+@click.pass_context
+def agent(ctx, socket_path: str, max_sessions: int, idle_timeout: float):
+    """
+    Run a local agent that keeps device sessions warm between invocations.
+
+    Point other invocations at it with --agent-socket (or ROTATEKEY_AGENT_SOCKET)
+    and `snmp list` and `snmp update` are sent to the agent, which reuses its
+    discovery results and authenticated sessions instead of connecting again.
+    """
+    # Discovery results and sessions are kept by the fleet between requests,
+    # progress is shown by the invocation that sent the request
+    fleet = Fleet(
+        [],
+        os.getenv("NETWORK_USERNAME"),
+        os.getenv("NETWORK_PASSWORD"),
+        keep_sessions=True,
+        max_sessions=max_sessions,
+        idle_timeout=idle_timeout,
+        **{**ctx.obj["fleet_options"], "progress": False},
+    )
+
+    def handle(request):
+        if request["op"] == "status":
+            yield fleet.status()
+            return
+
+        # Each request is a separate run, as an invocation without the agent would be
+        fleet.reset_auth_failures()
+        devices = [DeviceRecord.from_inventory(entry) for entry in request["devices"]]
+        if request["op"] == "snmp list":
+            yield from fleet.list_communities(devices)
+        elif request["op"] == "snmp update":
+            options = request["options"]
+            yield from fleet.update_communities(options["delete_current"], options["ro_community"],
+                                                options["rw_community"], verify=options["verify"], devices=devices)
         else:
-            device_manager = CliConfig(
-                device["address"],
-                ctx.obj["network_username"],
-                ctx.obj["network_password"],
-                verbose=ctx.obj["cli_verbose"],
-            )
+            raise ValueError(f"Unknown operation '{request['op']}'")
+
+    server = AgentServer(socket_path, handle)
+    click.echo(f"rotatekey agent listening on {socket_path}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        fleet.close()
+
+
+def agent_request(
+    ctx, op: str, devices: list[DeviceRecord], on_result: Optional[Callable[[dict], None]] = None, **options
+) -> list[dict]:
+    """
+    Send a per-device operation to the agent and collect the results.
 
-        # Delete Current Communities
-        if delete_current:
-            debug_msg(ctx.obj["debug"], "Clearing all currently configured communties")
-            result = device_manager.clear_snmp_communities()
-            check_result(device["device_name"], "snmp-delete-current", result, ctx.obj["debug"])
-
-        # Read Only Community Create
-        if ro_community:
-            debug_msg(ctx.obj["debug"], f"Creating new Read-Only Community: {ro_community}")
-            result = device_manager.create_snmp_community(ro_community)
-            check_result(
-                device["device_name"],
-                f"snmp-create-ro [{ro_community}]",
-                result,
-                ctx.obj["debug"],
-            )
+    Args:
+        ctx (Click.Context):
+        op (str): The operation, "snmp list" or "snmp update"
+        devices (list): The devices to work on
+        on_result (Callable): Called with each result as it arrives, before the rest are collected
+        options: Options for the operation
+
+    Returns:
+        results (list): One result per device, in the same order as the devices. A device
+            the agent sent no result for is reported as failed
+    """
+    client = AgentClient(ctx.obj["agent_socket"])
+    progress = ProgressDisplay(len(devices), label=op, enabled=None if ctx.obj.get("progress") else False)
+    results = []
+    try:
+        for result in client.request(op, devices=[device.to_inventory() for device in devices], options=options):
+            progress.finished(result["success"])
+            if on_result is not None:
+                on_result(result)
+            results.append(result)
+    except (ConnectionError, RuntimeError) as e:
+        progress.close()
+        click.secho(f"ERROR: {e}", fg='red', err=True)
+        exit(1)
+    progress.close()
+
+    # The agent streams results as they complete, so match them to the devices by name
+    by_name = {result["device_name"]: result for result in results}
+    for device in devices:
+        if device.device_name not in by_name:
+            click.secho(f"ERROR: The agent sent no result for {device.device_name}", fg='red', err=True)
+            by_name[device.device_name] = {
+                "device_name": device.device_name,
+                "success": False,
+                "reasons": [f"{op}: no result from the agent"],
+                "transport": device.transport,
+                "communities": [],
+                "previous": None,
+            }
+    return [by_name[device.device_name] for device in devices]
+
+
+@cli.command('daemon')
+@click.option('--schedule', required=True, metavar='INTERVAL',
+              help="Time between the starts of rotation cycles, e.g. 30m, 12h or 1d")
+@click.option('--window', default='1h', show_default=True, metavar='DURATION',
+              help="Spread each cycle's devices over this long, with per-device jitter")
+@click.option('--delete-current','-d', is_flag=True, help="Whether to delete all current SNMP communities")
+@click.option('--ro-community', '--ro', help='The Read-Only community string to enforce')
+@click.option('--rw-community', '--rw', help="The Read-Write community string to enforce")
+@click.option('--secrets-file', type=click.Path(dir_okay=False),
+              help="YAML file with ro_community, rw_community and delete_current, re-read every cycle")
+@click.option('--verify', is_flag=True, help="Read the communities back after each update")
+@click.option('--status-socket', default=lambda: default_socket_path("rotatekey-daemon"),
+              show_default="$XDG_RUNTIME_DIR/rotatekey-daemon-UID.sock", help="Unix socket serving the daemon status")
+@click.option('--max-sessions', type=click.IntRange(min=1), default=100, show_default=True,
+              help="Maximum number of device sessions to keep open between devices and cycles")
+@click.option('--idle-timeout', type=click.FloatRange(min=1), default=3600, show_default=True,
+              help="Seconds a device session may be idle before it is closed")
+@click.option('--cycles', type=click.IntRange(min=1), help="Stop after this many cycles")
+@click.pass_context
+def daemon(ctx, schedule: str, window: str, delete_current: bool, ro_community: str, rw_community: str,
+           secrets_file: str, verify: bool, status_socket: str, max_sessions: int, idle_timeout: float, cycles: int):
+    """
+    Rotate SNMP communities on a schedule, spreading each cycle over a time window.
 
-        # Read Write Community Create
-        if rw_community:
-            debug_msg(ctx.obj["debug"], f"Creating new Read-Write Community: {rw_community}")
-            result = device_manager.create_snmp_community(rw_community, "rw")
-            check_result(
-                device["device_name"],
-                f"snmp-create-rw [{rw_community}]",
-                result,
-                ctx.obj["debug"],
+    Each cycle reloads the inventory (and --secrets-file), gives every device a
+    start time spread across --window with random jitter, and updates devices
+    as their time comes, within the usual concurrency limits. Discovery results
+    and device sessions are kept between cycles. A snapshot is written for
+    every cycle. Query the state with `rotatekey daemon-status`.
+    """
+    try:
+        interval = parse_duration(schedule)
+        spread = parse_duration(window)
+    except ValueError as e:
+        raise click.BadParameter(str(e))
+    if spread > interval:
+        raise click.BadParameter("--window must not be longer than --schedule", param_hint="--window")
+
+    fleet = ctx.obj["fleet"]
+    fleet.progress = False
+    fleet.keep_sessions(max_sessions, idle_timeout)
+
+    status = DaemonStatus(interval, spread)
+    server = AgentServer(status_socket, lambda request: iter([status.snapshot()]))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    stopping = threading.Event()
+
+    def stop(signum, frame):
+        # Wakes the cycle wait, and stops the cycle in progress starting devices
+        stopping.set()
+        fleet.stop()
+
+    signal.signal(signal.SIGTERM, stop)
+
+    click.echo(f"rotatekey daemon: every {schedule}, spread over {window}, status on {status_socket}")
+    rng = random.Random()
+    cycle = 0
+    next_cycle = time.monotonic()
+    try:
+        while not stopping.is_set():
+            status.waiting(time.time() + max(0.0, next_cycle - time.monotonic()))
+            if stopping.wait(max(0.0, next_cycle - time.monotonic())):
+                break
+
+            cycle += 1
+            cycle_start = time.monotonic()
+            next_cycle = cycle_start + interval
+
+            try:
+                fleet.devices = ctx.obj["load_devices"]()
+            except (OSError, ValueError, yaml.YAMLError) as e:
+                click.secho(f"WARNING: Unable to reload the inventory, using the previous one: {e}", fg='yellow', err=True)
+            options = {"delete_current": delete_current, "ro_community": ro_community, "rw_community": rw_community}
+            if secrets_file:
+                try:
+                    with open(secrets_file) as f:
+                        options.update(yaml.safe_load(f) or {})
+                except (OSError, yaml.YAMLError) as e:
+                    click.secho(f"ERROR: Unable to read {secrets_file}, skipping cycle {cycle}: {e}", fg='red', err=True)
+                    continue
+
+            # Cycles are hours apart, so one that stopped on rejected credentials does not stop the next
+            fleet.reset_auth_failures()
+            start_times = spread_start_times(fleet.devices, spread, cycle_start, rng)
+            snapshot = SnapshotWriter(default_snapshot_file())
+            status.start_cycle(cycle, len(fleet.devices))
+            click.echo(f"Cycle {cycle}: updating {len(fleet.devices)} device(s), snapshot {snapshot.path}")
+
+            results = fleet.update_communities(
+                bool(options.get("delete_current")), options.get("ro_community"), options.get("rw_community"),
+                verify=verify, snapshot=snapshot, start_at=lambda device: start_times[device.device_name],
             )
-
-        # Close connection to device
-        device_manager.disconnect()
+            try:
+                # After a stop the devices in flight finish, the rest come back "stopped"
+                for result in results:
+                    if result.get("error_kind") != "stopped":
+                        status.record(result)
+            finally:
+                results.close()
+                snapshot.close()
+
+            summary = status.finish_cycle()
+            click.echo(f"Cycle {cycle}: {summary['succeeded']} succeeded, {summary['failed']} failed")
+
+            if cycles and cycle >= cycles:
+                break
+    except KeyboardInterrupt:
+        pass
+    finally:
+        click.echo("rotatekey daemon stopping")
+        server.shutdown()
+        server.server_close()
+
+
+@cli.command('daemon-status')
+@click.option('--status-socket', default=lambda: default_socket_path("rotatekey-daemon"),
+              show_default="$XDG_RUNTIME_DIR/rotatekey-daemon-UID.sock", help="The daemon's status socket")
+def daemon_status(status_socket: str):
+    """
+    Show the state of a running `rotatekey daemon`.
+    """
+    try:
+        for status in AgentClient(status_socket, timeout=10).request("status"):
+            click.echo(json.dumps(status, indent=2))
+    except (ConnectionError, RuntimeError, OSError) as e:
+        click.secho(f"ERROR: {e}", fg='red', err=True)
+        exit(1)
 
 
 # TODO: All commands and subcommands to the CLI application
@@ -0,0 +1,323 @@
+"""
+A long running local agent that keeps device sessions warm between invocations.
+
+The agent listens on a Unix socket. Each request is one JSON line, and the
+agent answers with one JSON line per result followed by a final line with
+"done" set. Device sessions are kept in a SessionPool, with a cap on the number
+of sessions and eviction of sessions that have been idle for too long.
+"""
+
+from __future__ import annotations
+from collections import OrderedDict
+import json
+import os
+import socket
+import socketserver
+import threading
+import time
+from typing import Any, Callable, Iterator, Optional
+
+
+def default_socket_path(name: str = "rotatekey") -> str:
+    """
+    The default agent socket path for the current user.
+
+    Args:
+        name (str): The socket name, e.g. "rotatekey-daemon" for the daemon's status socket
+
+    Returns:
+        path (str): The socket path
+    """
+    return os.path.join(os.environ.get("XDG_RUNTIME_DIR", "/tmp"), f"{name}-{os.getuid()}.sock")
+
+
+def session_alive(manager: Any) -> bool:
+    """
+    Whether a pooled device manager can be handed out again.
+
+    Managers without an is_connected() check count as alive while enabled.
+
+    Args:
+        manager (Any): The device manager
+
+    Returns:
+        alive (bool): Whether the session is still connected
+    """
+    if manager is None:
+        return False
+    is_connected = getattr(manager, "is_connected", None)
+    if is_connected is None:
+        return getattr(manager, "enabled", False)
+    try:
+        return bool(is_connected())
+    except Exception:
+        return False
+
+
+class PooledSession(object):
+    """
+    A device manager held by the pool, with a lock so only one request uses it at a time.
+    """
+
+    __slots__ = ("lock", "manager", "last_used")
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.manager = None
+        self.last_used = time.monotonic()
+
+
+class SessionPool(object):
+    """
+    A pool of connected device managers, keyed by device address and transport.
+    """
+
+    def __init__(
+        self,
+        factory: Callable[[Any], Any],
+        max_sessions: int = 100,
+        idle_timeout: float = 300.0,
+    ):
+        """
+        Args:
+            factory (Callable): Creates a connected device manager for a device
+            max_sessions (int): Most sessions to keep open, idle sessions are evicted beyond this
+            idle_timeout (float): Seconds a session may be idle before it is closed
+        """
+        self.factory = factory
+        self.max_sessions = max_sessions
+        self.idle_timeout = idle_timeout
+        self.sessions = OrderedDict()
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+
+        self.reaper = threading.Thread(target=self._reap, daemon=True)
+        self.reaper.start()
+
+    def acquire(self, key: tuple, device: Any) -> Any:
+        """
+        Get the device manager for a device, connecting if there is no warm session
+        or the warm session is no longer connected.
+
+        The session stays locked to the caller until release() is called.
+
+        Args:
+            key (tuple): The session key, (address, transport)
+            device (Any): The device, passed to the factory when connecting
+
+        Returns:
+            device_manager (Any): The connected device manager
+        """
+        with self.lock:
+            session = self.sessions.get(key)
+            if session is None:
+                session = self.sessions[key] = PooledSession()
+            self.sessions.move_to_end(key)
+
+        session.lock.acquire()
+        if session.manager is not None and not session_alive(session.manager):
+            # The device or the network closed the warm session while it was idle
+            self._disconnect(session)
+        if session.manager is None:
+            try:
+                session.manager = self.factory(device)
+            except BaseException:
+                self._discard(key, session)
+                raise
+            self._evict_over_cap()
+
+        return session.manager
+
+    def release(self, key: tuple) -> None:
+        """
+        Return a session to the pool. Sessions that are no longer connected, or whose
+        last request failed with a transport error, are closed and removed.
+
+        Args:
+            key (tuple): The session key, (address, transport)
+        """
+        with self.lock:
+            session = self.sessions.get(key)
+        if session is None:
+            return
+
+        session.last_used = time.monotonic()
+        if not session_alive(session.manager):
+            self._discard(key, session)
+        else:
+            session.lock.release()
+
+    def _discard(self, key: tuple, session: PooledSession) -> None:
+        # Called with the session lock held
+        with self.lock:
+            if self.sessions.get(key) is session:
+                del self.sessions[key]
+        self._disconnect(session)
+        session.lock.release()
+
+    def _disconnect(self, session: PooledSession) -> None:
+        if session.manager is not None:
+            try:
+                session.manager.disconnect()
+            except Exception:
+                pass
+            session.manager = None
+
+    def _evict(self, only_idle: bool) -> None:
+        now = time.monotonic()
+        with self.lock:
+            candidates = list(self.sessions.items())
+
+        for key, session in candidates:
+            if not only_idle and len(self.sessions) <= self.max_sessions:
+                break
+            if only_idle and now - session.last_used < self.idle_timeout:
+                continue
+            # Skip sessions that are in use
+            if session.lock.acquire(blocking=False):
+                self._discard(key, session)
+
+    def _evict_over_cap(self) -> None:
+        if len(self.sessions) > self.max_sessions:
+            self._evict(only_idle=False)
+
+    def _reap(self) -> None:
+        while not self.stopped.wait(max(1.0, self.idle_timeout / 4)):
+            self._evict(only_idle=True)
+
+    def status(self) -> dict:
+        """
+        Describe the sessions in the pool.
+
+        Returns:
+            status (dict): Session count, limits and the idle time of each session
+        """
+        now = time.monotonic()
+        with self.lock:
+            sessions = [
+                {
+                    "address": key[0],
+                    "transport": key[1],
+                    "idle": round(now - session.last_used, 1),
+                    "in_use": session.lock.locked(),
+                }
+                for key, session in self.sessions.items()
+            ]
+        return {
+            "sessions": len(sessions),
+            "max_sessions": self.max_sessions,
+            "idle_timeout": self.idle_timeout,
+            "session_list": sessions,
+        }
+
+    def close(self) -> None:
+        """
+        Stop the reaper and disconnect every session.
+        """
+        self.stopped.set()
+        with self.lock:
+            sessions = list(self.sessions.values())
+            self.sessions.clear()
+        for session in sessions:
+            with session.lock:
+                self._disconnect(session)
+
+
+class AgentServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """
+    A Unix socket server that passes each JSON request to a handler function.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, path: str, handler: Callable[[dict], Iterator[dict]]):
+        """
+        Args:
+            path (str): The Unix socket path to listen on
+            handler (Callable): Called with each request, yields the result lines to send back
+        """
+        self.path = path
+        self.handler = handler
+
+        if os.path.exists(path):
+            os.unlink(path)
+
+        # Only the current user may talk to the agent, it holds their device credentials
+        previous_umask = os.umask(0o177)
+        try:
+            super().__init__(path, _AgentRequestHandler)
+        finally:
+            os.umask(previous_umask)
+
+    def server_close(self) -> None:
+        super().server_close()
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+
+
+class _AgentRequestHandler(socketserver.StreamRequestHandler):
+    def handle(self) -> None:
+        line = self.rfile.readline()
+        if not line:
+            return
+
+        try:
+            request = json.loads(line)
+            for result in self.server.handler(request):
+                self._send(result)
+            self._send({"done": True})
+        except Exception as e:
+            self._send({"done": True, "error": str(e)})
+
+    def _send(self, message: dict) -> None:
+        self.wfile.write((json.dumps(message, default=str) + "\n").encode())
+        self.wfile.flush()
+
+
+class AgentClient(object):
+    """
+    Sends requests to a running agent.
+    """
+
+    def __init__(self, path: str, timeout: Optional[float] = None):
+        """
+        Args:
+            path (str): The agent's Unix socket path
+            timeout (float): Socket timeout in seconds, None to wait indefinitely
+        """
+        self.path = path
+        self.timeout = timeout
+
+    def request(self, op: str, **payload) -> Iterator[dict]:
+        """
+        Send a request and yield the result lines as they arrive.
+
+        Args:
+            op (str): The operation, e.g. "snmp list"
+            payload: The rest of the request
+
+        Returns:
+            results (Iterator): The result lines, excluding the final "done" line
+
+        Raises:
+            ConnectionError: If the agent is not running
+            RuntimeError: If the agent reports an error
+        """
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as connection:
+            connection.settimeout(self.timeout)
+            try:
+                connection.connect(self.path)
+            except (FileNotFoundError, ConnectionRefusedError) as e:
+                raise ConnectionError(f"No rotatekey agent listening on {self.path}: {e}")
+
+            connection.sendall((json.dumps({"op": op, **payload}) + "\n").encode())
+            with connection.makefile("r") as stream:
+                for line in stream:
+                    message = json.loads(line)
+                    if message.get("done"):
+                        if message.get("error"):
+                            raise RuntimeError(f"Agent error: {message['error']}")
+                        return
+                    yield message
+
+        raise ConnectionError("Agent closed the connection before finishing the request")
@@ -4,8 +4,14 @@ CLI Configuration releated classes and functions for interacting with network de
 
 from __future__ import annotations
 from typing import Optional
+import logging
 from pyats.topology import Testbed, Device
 from genie.conf import Genie
+from .concurrency import is_auth_error, is_transport_error
+from .metrics import REGISTRY
+from .secret_kinds import SecretKind, SnmpCommunities
+from .session_log import mask_secrets
+from .snmp_parser import parse_communities, show_command
 
 # import unicon
 # import logging
@@ -23,6 +29,7 @@ class CliConfig(object):
         username: str,
         password: str,
         verbose: Optional[bool] = False,
+        session_log: Optional[logging.Logger] = None,
     ):
         """
         Setup a CliConfig object for a device.
@@ -32,12 +39,14 @@ class CliConfig(object):
             username (str): username for network device
             password (str): password for network device
             verbose (bool): whether to log output from device to std_out
+            session_log (logging.Logger): Optional logger to capture the device dialog in
 
         """
         self.address = address
         self.username = username
         self.password = password
         self.verbose = verbose
+        self.session_log = session_log
 
         # Create a pyATS testbed object for the device
         self.testbed = Testbed(
@@ -73,9 +82,31 @@ class CliConfig(object):
         # device.connections.log.setLevel(logging.WARNING)
         device.testbed = self.testbed
 
+        # Configuration read during this session, cleared by any change
+        self._snmp_cache = None
+        # Whether the device rejected the credentials
+        self.auth_failed = False
+        # Whether a command failed because the session broke
+        self.transport_failed = False
+
         # Attempt to connect to device and verify access
         self.validate()
 
+    def invalidate_cache(self) -> None:
+        """
+        Forget the configuration read during this session so the next lookup goes to the device.
+        """
+        self._snmp_cache = None
+
+    def is_connected(self) -> bool:
+        """
+        Whether the session is still open and has not broken during a command.
+
+        Returns:
+            connected (bool): Whether the session can be used again
+        """
+        return self.enabled and not self.transport_failed and self.pyats.is_connected()
+
     def disconnect(self) -> None:
         """
         Disconnect from the device.
@@ -86,9 +117,14 @@ class CliConfig(object):
         """
         Check if CliConfig is supported on the device by testing.
 
+        A connection failure caused by rejected credentials sets auth_failed.
+
         Returns:
             enabled (bool): Whether CliConfig is enabled on device
         """
+        # With a session log the unicon dialog goes to the device's own log instead of stdout
+        connect_options = {"logger": self.session_log} if self.session_log is not None else {}
+
         try:
             # Connect to the device, learn hostname and OS
             self.testbed.connect(
@@ -97,6 +133,7 @@ class CliConfig(object):
                 log_stdout=self.verbose,
                 init_exec_commands=[],
                 init_config_commands=[],
+                **connect_options,
             )
 
             # With the OS learned, enable Genie features on testbed
@@ -104,31 +141,72 @@ class CliConfig(object):
             self.pyats = self.testbed.devices[self.address]
 
             self.enabled = True
-        except Exception:
+        except Exception as e:
+            if self.session_log is not None:
+                self.session_log.info(f"CLI connection to {self.address} failed: {e}")
+            self.auth_failed = is_auth_error(e)
             self.enabled = False
 
         return self.enabled
 
-    def lookup_snmp_communities(self) -> list[dict[str, str]]:
+    def _execute(self, command: str) -> str:
+        # Run an exec command, recording its count and latency
+        REGISTRY.inc("rotatekey_transport_requests_total", transport="cli", operation="execute")
+        try:
+            with REGISTRY.time("rotatekey_cli_command_seconds", operation="execute"):
+                return self.pyats.execute(command)
+        except Exception as e:
+            if is_transport_error(e):
+                self.transport_failed = True
+            raise
+
+    def _configure(self, config) -> str:
+        # Send configuration, recording its count and latency
+        REGISTRY.inc("rotatekey_transport_requests_total", transport="cli", operation="configure")
+        try:
+            with REGISTRY.time("rotatekey_cli_command_seconds", operation="configure"):
+                return self.pyats.configure(config)
+        except Exception as e:
+            if is_transport_error(e):
+                self.transport_failed = True
+            raise
+
+    def lookup_snmp_communities(self, refresh: bool = False) -> list[dict[str, str]]:
         """
         Lookup the currently configured SNMP communities.
 
+        The result is kept for the rest of the session and served from memory
+        until a change is made or refresh is set.
+
+        Args:
+            refresh (bool): Read from the device even if the communities are cached
+
         Returns:
             snmp_communities (list): List of SNMP communities and permissions
         """
         # Note 1: pyATS lacks a parser for snmp community
         # Note 2: No show command on IOS displays the permissions on a community
-        # Note 3: Will use the well known structure of `snmp-server community STRING PERMISSION`
-
-        snmp_communities = []
+        # Note 3: The configuration lines are parsed with the grammar in snmp_parser
+
+        if self._snmp_cache is None or refresh:
+            # Filter on the device as narrowly as the OS allows, then parse what comes back
+            snmp_configuration = self._execute(show_command(getattr(self.pyats, "os", None)))
+
+            # Only name and permission, the same as the other transports report. An encrypted
+            # community keeps its type in the name, as a delete has to give the string as configured
+            snmp_communities = [
+                {
+                    "name": f"{community['encryption']} {community['name']}"
+                    if community["encryption"] else community["name"],
+                    "permission": community["permission"],
+                }
+                for community in parse_communities(snmp_configuration)
+            ]
 
-        # Lookup SNMP community string configuration
-        snmp_configuration = self.pyats.execute("show run | inc snmp-server community").splitlines()
-        for community in snmp_configuration:
-            community = community.split()
-            snmp_communities.append({"name": community[2], "permission": community[3]})
+            self._snmp_cache = snmp_communities
 
-        return snmp_communities
+        # Hand out copies so callers cannot change the cached result
+        return [dict(community) for community in self._snmp_cache]
 
     def create_snmp_community(self, community_name: str, permission: Optional[str] = "ro") -> tuple[bool, str]:
         """
@@ -141,13 +219,14 @@ class CliConfig(object):
         Returns:
             action_result (tuple): Details on result (success_bool, reason)
         """
+        self.invalidate_cache()
         target_config = f"snmp-server community {community_name} {permission}"
 
         try:
-            self.pyats.configure(target_config)
+            self._configure(target_config)
             return (True, None)
         except Exception as e:
-            return (False, e)
+            return (False, mask_secrets(str(e)))
 
     def delete_snmp_community(self, community_name: str) -> tuple[bool, str]:
         """
@@ -159,13 +238,14 @@ class CliConfig(object):
         Returns:
             action_result (tuple): Details on result (success_bool, reason)
         """
+        self.invalidate_cache()
         target_config = f"no snmp-server community {community_name}"
 
         try:
-            self.pyats.configure(target_config)
+            self._configure(target_config)
             return (True, None)
         except Exception as e:
-            return (False, e)
+            return (False, mask_secrets(str(e)))
 
     def clear_snmp_communities(self) -> tuple[bool, str]:
         """
@@ -184,6 +264,41 @@ class CliConfig(object):
             success, reason = self.delete_snmp_community(community["name"])
             if not success:
                 return_status = False
-                return_reasons = return_reasons.append(f"Community {community}, {reason}")
+                return_reasons.append(f"Community {community}, {reason}")
 
         return (return_status, ", ".join(return_reasons))
+
+    def apply_snmp_changes(self, creates: list[dict[str, str]], deletes: list[str]) -> tuple[bool, str]:
+        """
+        Delete and create a set of SNMP communities in a single configuration session.
+
+        Args:
+            creates (list): Communities (name, permission) to create
+            deletes (list): Names of communities to delete
+
+        Returns:
+            action_result (tuple): Details on result (success_bool, reason)
+        """
+        return self.apply_secrets([SnmpCommunities(creates, deletes)])
+
+    def apply_secrets(self, secrets: list[SecretKind]) -> tuple[bool, str]:
+        """
+        Apply a set of secret changes in a single configuration session.
+
+        Args:
+            secrets (list): The secret changes to apply
+
+        Returns:
+            action_result (tuple): Details on result (success_bool, reason)
+        """
+        self.invalidate_cache()
+        target_config = [command for secret in secrets for command in secret.cli_commands()]
+
+        if not target_config:
+            return (True, None)
+
+        try:
+            self._configure(target_config)
+            return (True, None)
+        except Exception as e:
+            return (False, mask_secrets(str(e)))
@@ -0,0 +1,215 @@
+"""
+Adaptive control of the number of devices worked on at the same time.
+"""
+
+from __future__ import annotations
+from collections import deque
+import re
+import threading
+import time
+from typing import Callable, Optional
+
+# Failure kinds that indicate the devices, or the AAA servers behind them, are struggling
+BACKOFF_FAILURES = {"timeout", "auth", "server"}
+
+FAILURE_PATTERNS = [
+    ("auth", re.compile(r"auth|401|403|unauthori[sz]ed|forbidden|permission denied", re.I)),
+    ("timeout", re.compile(r"time[d ]?out", re.I)),
+    ("server", re.compile(r"\b5\d\d\b|internal server error|service unavailable|bad gateway", re.I)),
+]
+
+
+# Errors from SSH, unicon, ncclient and HTTP that mean the credentials were rejected
+AUTH_ERROR_PATTERN = re.compile(
+    r"authentication (failed|failure)|auth(entication)?exception|bad (username or )?password|login incorrect"
+    r"|permission denied|access denied|invalid (username|user name|password)|\b401\b|unauthori[sz]ed",
+    re.I,
+)
+
+
+def is_auth_error(error: BaseException) -> bool:
+    """
+    Whether a connection error was caused by rejected credentials.
+
+    The whole exception chain is checked, since connection libraries wrap the
+    authentication error in their own connection errors.
+
+    Args:
+        error (BaseException): The error raised while connecting
+
+    Returns:
+        auth_error (bool): Whether the credentials were rejected
+    """
+    seen = set()
+    while error is not None and id(error) not in seen:
+        seen.add(id(error))
+        if AUTH_ERROR_PATTERN.search(f"{type(error).__name__} {error}"):
+            return True
+        error = error.__cause__ or error.__context__
+    return False
+
+
+# Exception names from sockets, requests, ncclient, paramiko and unicon that mean the session itself broke
+TRANSPORT_ERROR_PATTERN = re.compile(
+    r"ConnectionError|Timeout|TransportError|SessionCloseError|SSHException|SSHError|EOF|BrokenPipe|ConnectionReset"
+)
+
+
+def is_transport_error(error: BaseException) -> bool:
+    """
+    Whether a request failed because the session to the device broke, rather than
+    because the device refused the request.
+
+    Args:
+        error (BaseException): The error raised by the request
+
+    Returns:
+        transport_error (bool): Whether the session should not be used again
+    """
+    seen = set()
+    while error is not None and id(error) not in seen:
+        seen.add(id(error))
+        if isinstance(error, OSError) or TRANSPORT_ERROR_PATTERN.search(type(error).__name__):
+            return True
+        error = error.__cause__ or error.__context__
+    return False
+
+
+def failure_kind(result: dict) -> Optional[str]:
+    """
+    Classify the failure of a device operation.
+
+    Args:
+        result (dict): The per-device result with success and reasons
+
+    Returns:
+        kind (str): "auth", "timeout", "server" or "other", None if the operation succeeded
+    """
+    if result is None or result.get("success", True):
+        return None
+
+    if result.get("error_kind"):
+        return result["error_kind"]
+
+    reasons = " ".join(str(reason) for reason in result.get("reasons", []))
+    for kind, pattern in FAILURE_PATTERNS:
+        if pattern.search(reasons):
+            return kind
+
+    return "other"
+
+
+def percentile(values: list[float], fraction: float) -> float:
+    """
+    Nearest-rank percentile of a list of values.
+
+    Args:
+        values (list): The values
+        fraction (float): The percentile as a fraction, e.g. 0.95
+
+    Returns:
+        value (float): The percentile value
+    """
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, int(round(fraction * len(ordered))) - 1))]
+
+
+class AimdController(object):
+    """
+    Additive-increase/multiplicative-decrease controller for in-flight device operations.
+
+    A round is as many completed operations as the current limit. The limit grows
+    by one after a round without a back-off whose p95 latency stays close to the
+    best observed p95, and is halved, at most once per round, when an operation
+    fails with a timeout, authentication failure or server error.
+    """
+
+    def __init__(
+        self,
+        max_limit: int,
+        initial_limit: int = 2,
+        latency_tolerance: float = 1.5,
+        on_change: Optional[Callable[[int, str], None]] = None,
+    ):
+        """
+        Args:
+            max_limit (int): The most operations allowed in flight
+            initial_limit (int): The number of operations in flight to start with
+            latency_tolerance (float): How far p95 latency may rise above the best seen and still count as flat
+            on_change (Callable): Called with the new limit and the reason whenever the limit changes
+        """
+        self.max_limit = max(1, max_limit)
+        self.limit = max(1, min(initial_limit, self.max_limit))
+        self.latency_tolerance = latency_tolerance
+        self.on_change = on_change
+
+        self.lock = threading.Lock()
+        self.started = time.monotonic()
+        self.round_latencies = []
+        self.round_completed = 0
+        self.best_p95 = None
+        self.backed_off_in_round = False
+        self.history = [(0.0, self.limit, "start")]
+        self.recent = deque(maxlen=100)
+
+    def _set_limit(self, limit: int, reason: str) -> None:
+        limit = max(1, min(limit, self.max_limit))
+        if limit == self.limit:
+            return
+        self.limit = limit
+        self.history.append((round(time.monotonic() - self.started, 3), limit, reason))
+        if self.on_change:
+            self.on_change(limit, reason)
+
+    def record(self, latency: float, failure: Optional[str] = None) -> None:
+        """
+        Record the outcome of one device operation and adjust the limit.
+
+        Args:
+            latency (float): Wall time of the operation in seconds
+            failure (str): The failure kind, None if the operation succeeded
+        """
+        with self.lock:
+            self.recent.append(latency)
+            self.round_completed += 1
+
+            if failure in BACKOFF_FAILURES:
+                # Back off at most once per round so a burst of failures does not collapse to one
+                if not self.backed_off_in_round:
+                    self.backed_off_in_round = True
+                    self._set_limit(self.limit // 2, f"{failure} failure")
+            else:
+                self.round_latencies.append(latency)
+
+            # A round is limit operations of any outcome, so sustained failures keep backing off
+            if self.round_completed < self.limit:
+                return
+
+            latencies, self.round_latencies = self.round_latencies, []
+            backed_off, self.backed_off_in_round = self.backed_off_in_round, False
+            self.round_completed = 0
+            if backed_off or not latencies:
+                return
+
+            # A full round without a back-off has completed, compare its p95 latency to the best seen
+            p95 = percentile(latencies, 0.95)
+
+            if self.best_p95 is None or p95 < self.best_p95:
+                self.best_p95 = p95
+
+            if p95 <= self.best_p95 * self.latency_tolerance:
+                self._set_limit(self.limit + 1, f"p95 {p95:.2f}s flat")
+
+    def summary(self) -> str:
+        """
+        A one line description of how the limit changed during the run.
+
+        Returns:
+            summary (str): Description of the limit history
+        """
+        limits = [limit for _, limit, _ in self.history]
+        p95 = f", p95 latency {percentile(list(self.recent), 0.95):.2f}s" if self.recent else ""
+        return (
+            f"Adaptive concurrency: started {limits[0]}, range {min(limits)}-{max(limits)}, "
+            f"final {self.limit}, {len(self.history) - 1} change(s){p95}"
+        )
@@ -0,0 +1,194 @@
+"""
+The record kept for each device in the inventory.
+"""
+
+from __future__ import annotations
+import threading
+from typing import Any, Optional
+
+# Inventory keys that map directly to DeviceRecord fields
+INVENTORY_FIELDS = ("device_name", "address", "restconf", "site", "group", "tags")
+
+
+class DeviceRecord(object):
+    """
+    A device from the inventory along with the state gathered while working on it.
+
+    Records use __slots__ to keep per-device memory low on large inventories.
+    Updates made from worker threads go through the methods below, which hold
+    a lock shared by all records.
+    """
+
+    __slots__ = (
+        "device_name",
+        "address",
+        "restconf",
+        "site",
+        "group",
+        "tags",
+        "attributes",
+        "transport",
+        "discovery",
+        "timings",
+        "status",
+        "reasons",
+    )
+
+    # One lock for every record, rather than one per record, to keep records small
+    _lock = threading.Lock()
+
+    def __init__(
+        self,
+        device_name: str,
+        address: str,
+        restconf: bool = False,
+        site: Optional[str] = None,
+        group: Optional[str] = None,
+        tags: Optional[tuple[str, ...]] = None,
+        attributes: Optional[dict[str, Any]] = None,
+        transport: Optional[str] = None,
+    ):
+        """
+        Args:
+            device_name (str): The name of the device
+            address (str): The address of the device
+            restconf (bool): Whether the inventory asks for RESTCONF on the device
+            site (str): The site the device is at
+            group (str): The group the device belongs to
+            tags (tuple): Tags for selecting the device with --limit
+            attributes (dict): Any other inventory keys for the device
+            transport (str): The transport to use, "restconf", "netconf" or "cli", None until discovered
+        """
+        self.device_name = device_name
+        self.address = address
+        self.restconf = bool(restconf)
+        self.site = site
+        self.group = group
+        self.tags = tuple(tags) if tags else ()
+        self.attributes = attributes or None
+        self.transport = transport
+        self.discovery = None
+        self.timings = None
+        self.status = "pending"
+        self.reasons = None
+
+    @classmethod
+    def from_inventory(cls, entry: dict[str, Any]) -> "DeviceRecord":
+        """
+        Build a record from an inventory entry.
+
+        Args:
+            entry (dict): The inventory entry with device_name, address and optional keys
+
+        Returns:
+            device (DeviceRecord): The device record
+        """
+        attributes = {
+            key: value for key, value in entry.items() if key not in INVENTORY_FIELDS and key != "transport"
+        }
+
+        # Tags may be a list or a comma/space separated string
+        tags = entry.get("tags") or ()
+        if isinstance(tags, str):
+            tags = tags.replace(",", " ").split()
+
+        return cls(
+            entry["device_name"],
+            entry["address"],
+            restconf=entry.get("restconf", False),
+            site=entry.get("site"),
+            group=entry.get("group"),
+            tags=tags,
+            attributes=attributes,
+            transport=entry.get("transport"),
+        )
+
+    @classmethod
+    def from_entry(cls, entry: dict[str, Any]) -> "DeviceRecord":
+        """
+        Build a record from a snapshot or plan entry, using the recorded transport.
+
+        Args:
+            entry (dict): The snapshot or plan entry
+
+        Returns:
+            device (DeviceRecord): The device record
+        """
+        return cls(
+            entry["device_name"],
+            entry["address"],
+            restconf=entry["transport"] == "restconf",
+            site=entry.get("site"),
+            transport=entry["transport"],
+        )
+
+    def to_inventory(self) -> dict[str, Any]:
+        """
+        Convert the record back to an inventory entry, including the transport if known.
+
+        Returns:
+            entry (dict): The inventory entry
+        """
+        entry = {"device_name": self.device_name, "address": self.address, "restconf": self.restconf}
+        for key in ("site", "group", "transport"):
+            if getattr(self, key):
+                entry[key] = getattr(self, key)
+        if self.tags:
+            entry["tags"] = list(self.tags)
+        if self.attributes:
+            entry.update(self.attributes)
+        return entry
+
+    def get(self, key: str, default: Any = None) -> Any:
+        """
+        Look up an inventory attribute that has no dedicated field.
+
+        Args:
+            key (str): The inventory key
+            default (Any): Value to return if the key is not set
+
+        Returns:
+            value (Any): The inventory value
+        """
+        if self.attributes is None:
+            return default
+        return self.attributes.get(key, default)
+
+    def set_transport(self, transport: str, discovery: str) -> None:
+        """
+        Record the transport chosen for the device and why.
+
+        Args:
+            transport (str): "restconf", "netconf" or "cli"
+            discovery (str): A short description of the discovery result
+        """
+        with self._lock:
+            self.transport = transport
+            self.discovery = discovery
+
+    def record_timing(self, command: str, seconds: float) -> None:
+        """
+        Record the wall time of a command on the device.
+
+        Args:
+            command (str): The command, e.g. "snmp update"
+            seconds (float): The wall time in seconds
+        """
+        with self._lock:
+            if self.timings is None:
+                self.timings = {}
+            self.timings[command] = seconds
+
+    def set_result(self, result: dict) -> None:
+        """
+        Record the outcome of a command on the device.
+
+        Args:
+            result (dict): The per-device result with success and reasons
+        """
+        with self._lock:
+            self.status = "ok" if result["success"] else "failed"
+            self.reasons = list(result["reasons"]) or None
+
+    def __repr__(self) -> str:
+        return f"DeviceRecord({self.device_name!r}, {self.address!r}, transport={self.transport!r})"
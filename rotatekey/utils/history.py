@@ -0,0 +1,247 @@
+"""
+Per-device run time history, used to schedule the slowest devices first, and
+per-device transport history, used to pick the fastest reliable transport.
+"""
+
+from __future__ import annotations
+import json
+import os
+import tempfile
+import threading
+import time
+from typing import Optional
+
+# Expected seconds per device when there is no history, by transport
+DEFAULT_SECONDS = {"restconf": 5.0, "netconf": 5.0, "cli": 30.0}
+
+# Weight given to the newest run when updating a device's average run time
+SMOOTHING = 0.5
+
+
+def save_json(path: str, data: dict) -> None:
+    """
+    Write a JSON file, replacing it atomically.
+
+    The data goes to a uniquely named temporary file in the same directory
+    first, so concurrent runs never write the same temporary file, and a
+    failed write leaves the old file in place.
+
+    Args:
+        path (str): The file to write
+        data (dict): The data to write
+    """
+    f = tempfile.NamedTemporaryFile(
+        "w", dir=os.path.dirname(path) or ".", prefix=f"{os.path.basename(path)}.", suffix=".tmp", delete=False
+    )
+    try:
+        with f:
+            json.dump(data, f, indent=1, sort_keys=True)
+        os.replace(f.name, path)
+    except BaseException:
+        os.unlink(f.name)
+        raise
+
+
+class RunHistory(object):
+    """
+    Smoothed wall time of each command on each device, stored as a JSON file.
+    """
+
+    def __init__(self, path: Optional[str]):
+        """
+        Load the history file if it exists.
+
+        Args:
+            path (str): The history file, None to keep the history in memory only
+        """
+        self.path = path
+        self.lock = threading.Lock()
+        self.devices = {}
+        if path is None:
+            return
+
+        try:
+            with open(path) as f:
+                self.devices = json.load(f)
+        except (FileNotFoundError, ValueError):
+            self.devices = {}
+
+    def record(self, device_name: str, command: str, seconds: float) -> None:
+        """
+        Record the wall time of a command on a device.
+
+        Args:
+            device_name (str): The name of the device
+            command (str): The command that was run, e.g. "snmp update"
+            seconds (float): The wall time of the command on the device
+        """
+        with self.lock:
+            timings = self.devices.setdefault(device_name, {})
+            previous = timings.get(command)
+            if previous is None:
+                timings[command] = {"seconds": seconds, "runs": 1}
+            else:
+                timings[command] = {
+                    "seconds": SMOOTHING * seconds + (1 - SMOOTHING) * previous["seconds"],
+                    "runs": previous["runs"] + 1,
+                }
+
+    def estimate(self, device_name: str, command: str, transport: str) -> float:
+        """
+        The expected wall time of a command on a device.
+
+        Uses the device's history for the command, then for any command, then the
+        default for the transport.
+
+        Args:
+            device_name (str): The name of the device
+            command (str): The command that will be run
+            transport (str): "restconf", "netconf" or "cli"
+
+        Returns:
+            seconds (float): The expected wall time
+        """
+        timings = self.devices.get(device_name, {})
+        if command in timings:
+            return timings[command]["seconds"]
+        if timings:
+            return max(timing["seconds"] for timing in timings.values())
+
+        return DEFAULT_SECONDS.get(transport, DEFAULT_SECONDS["cli"])
+
+    def save(self) -> None:
+        """
+        Write the history file, replacing it atomically.
+        """
+        if self.path is None:
+            return
+
+        with self.lock:
+            save_json(self.path, self.devices)
+
+
+# Weight kept by a transport's earlier outcomes each time it is used on a device
+OUTCOME_DECAY = 0.8
+
+# Lowest weighted success rate for a transport to count as reliable on a device
+RELIABLE_SUCCESS_RATE = 0.8
+
+# Seconds before a transport that proved unreliable on a device is tried again
+RETRY_SECONDS = 86400
+
+
+class TransportHistory(object):
+    """
+    Smoothed latency and success rate of each transport on each device, stored as a JSON file.
+    """
+
+    def __init__(self, path: Optional[str]):
+        """
+        Load the history file if it exists.
+
+        Args:
+            path (str): The history file, None to keep the history in memory only
+        """
+        self.path = path
+        self.lock = threading.Lock()
+        self.devices = {}
+        if path is None:
+            return
+
+        try:
+            with open(path) as f:
+                self.devices = json.load(f)
+        except (FileNotFoundError, ValueError):
+            self.devices = {}
+
+    def record(self, device_name: str, transport: str, seconds: Optional[float], success: bool) -> None:
+        """
+        Record the outcome of using a transport on a device.
+
+        Args:
+            device_name (str): The name of the device
+            transport (str): "restconf", "netconf" or "cli"
+            seconds (float): The wall time of the operation, None if it never connected
+            success (bool): Whether the operation succeeded
+        """
+        with self.lock:
+            stats = self.devices.setdefault(device_name, {}).setdefault(
+                transport, {"seconds": None, "attempts": 0.0, "successes": 0.0, "runs": 0}
+            )
+            # Older outcomes fade, so a transport that starts failing is dropped within a few runs
+            stats["attempts"] = OUTCOME_DECAY * stats["attempts"] + 1
+            stats["successes"] = OUTCOME_DECAY * stats["successes"] + (1 if success else 0)
+            stats["runs"] += 1
+            stats["last"] = time.time()
+            # Only successful operations say how fast the transport is
+            if success and seconds is not None:
+                previous = stats["seconds"]
+                stats["seconds"] = seconds if previous is None else SMOOTHING * seconds + (1 - SMOOTHING) * previous
+
+    def rank(self, device_name: str, transports: list[str]) -> tuple[list[str], str]:
+        """
+        Order the transports to try on a device, and say why the first was chosen.
+
+        A transport with no history yet, or an unreliable one due a retry, is
+        tried first so every working transport gets measured. Otherwise the
+        reliable transports come first, fastest first, then the rest by success rate.
+
+        Args:
+            device_name (str): The name of the device
+            transports (list): The transports the device may use, in order of preference when unmeasured
+
+        Returns:
+            ranking (tuple): The transports in the order to try them, and the reason for the first
+        """
+        with self.lock:
+            history = {transport: dict(stats) for transport, stats in self.devices.get(device_name, {}).items()}
+
+        def success_rate(transport):
+            stats = history[transport]
+            return stats["successes"] / stats["attempts"] if stats["attempts"] else 0.0
+
+        measured = [transport for transport in transports if transport in history]
+        reliable = sorted(
+            (transport for transport in measured
+             if success_rate(transport) >= RELIABLE_SUCCESS_RATE and history[transport]["seconds"] is not None),
+            key=lambda transport: history[transport]["seconds"],
+        )
+        unreliable = sorted(
+            (transport for transport in measured if transport not in reliable), key=success_rate, reverse=True
+        )
+        ranking = reliable + unreliable
+
+        unmeasured = [transport for transport in transports if transport not in history]
+        if unmeasured:
+            return (unmeasured + ranking, f"auto: measuring {unmeasured[0]}, no history yet")
+
+        due = [transport for transport in unreliable if time.time() - history[transport]["last"] >= RETRY_SECONDS]
+        if due:
+            return (
+                due[:1] + [transport for transport in ranking if transport != due[0]],
+                f"auto: retrying {due[0]}, {success_rate(due[0]):.0%} success before",
+            )
+
+        best = ranking[0]
+        if best in reliable:
+            reason = (
+                f"auto: {best} fastest reliable, {history[best]['seconds']:.1f}s average, "
+                f"{success_rate(best):.0%} success over {history[best]['runs']} runs"
+            )
+            others = [f"{transport} {history[transport]['seconds']:.1f}s" for transport in reliable[1:]]
+            if others:
+                reason += f" ({', '.join(others)})"
+        else:
+            reason = f"auto: {best}, no reliable transport ({success_rate(best):.0%} success)"
+
+        return (ranking, reason)
+
+    def save(self) -> None:
+        """
+        Write the history file, replacing it atomically.
+        """
+        if self.path is None:
+            return
+
+        with self.lock:
+            save_json(self.path, self.devices)
@@ -0,0 +1,189 @@
+"""
+Loading the network inventory from YAML, JSON Lines or CSV files.
+
+YAML inventories are parsed with the libyaml C loader when it is available and
+the result is cached in a compact binary form, keyed by the file's mtime, size
+and content hash, so repeated invocations skip the parse. JSON Lines and CSV
+inventories are read one device at a time, so only the selected devices are
+ever held in memory.
+"""
+
+from __future__ import annotations
+import csv
+import hashlib
+import json
+import marshal
+import os
+import tempfile
+from typing import Callable, Iterator, Optional
+import yaml
+
+try:
+    from yaml import CSafeLoader as SafeLoader
+except ImportError:
+    from yaml import SafeLoader
+
+# Bump when the cached layout changes so old caches are ignored
+CACHE_VERSION = 1
+
+TRUE_VALUES = {"true", "yes", "1", "on"}
+
+
+def _file_hash(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _pack(devices: list[dict]) -> dict:
+    """
+    Store devices as one shared tuple of keys and a tuple of values per device.
+
+    Keys that are missing from a device are stored as None and dropped again
+    when unpacking, which is equivalent for inventory lookups.
+    """
+    keys = tuple(sorted({key for device in devices for key in device}))
+    rows = [tuple(device.get(key) for key in keys) for device in devices]
+    return {"keys": keys, "rows": rows}
+
+
+def _unpack(packed: dict) -> list[dict]:
+    keys = packed["keys"]
+    return [
+        {key: value for key, value in zip(keys, row) if value is not None}
+        for row in packed["rows"]
+    ]
+
+
+def _cache_path(cache_dir: str, path: str) -> str:
+    name = hashlib.sha256(os.path.abspath(path).encode()).hexdigest()[:16]
+    return os.path.join(cache_dir, f"inventory-{name}.bin")
+
+
+def _load_yaml(path: str, cache_dir: Optional[str]) -> list[dict]:
+    """
+    Load a YAML inventory, using and refreshing the binary cache.
+    """
+    stat = os.stat(path)
+    cache_file = _cache_path(cache_dir, path) if cache_dir else None
+    cached = None
+
+    if cache_file:
+        try:
+            with open(cache_file, "rb") as f:
+                cached = marshal.load(f)
+            if cached.get("version") != CACHE_VERSION:
+                cached = None
+        except (OSError, EOFError, ValueError, TypeError):
+            cached = None
+
+    # Unchanged mtime and size, trust the cache without reading the file
+    if cached and cached["mtime"] == stat.st_mtime_ns and cached["size"] == stat.st_size:
+        return _unpack(cached["inventory"])
+
+    # The file was touched, reuse the cache if the content is unchanged
+    content_hash = _file_hash(path)
+    if cached and cached["hash"] == content_hash:
+        devices = _unpack(cached["inventory"])
+    else:
+        with open(path) as f:
+            devices = yaml.load(f, Loader=SafeLoader) or []
+
+    if cache_file:
+        temporary = None
+        try:
+            os.makedirs(cache_dir, exist_ok=True)
+            # A unique temporary file, so concurrent runs do not write into each other's cache
+            with tempfile.NamedTemporaryFile("wb", dir=cache_dir, suffix=".tmp", delete=False) as f:
+                temporary = f.name
+                marshal.dump(
+                    {
+                        "version": CACHE_VERSION,
+                        "mtime": stat.st_mtime_ns,
+                        "size": stat.st_size,
+                        "hash": content_hash,
+                        "inventory": _pack(devices),
+                    },
+                    f,
+                )
+            os.replace(temporary, cache_file)
+            temporary = None
+        except (OSError, ValueError):
+            # Values marshal cannot store, or an unwritable cache, just skip caching
+            pass
+        finally:
+            if temporary is not None:
+                try:
+                    os.unlink(temporary)
+                except OSError:
+                    pass
+
+    return devices
+
+
+def _iter_jsonl(path: str) -> Iterator[dict]:
+    with open(path) as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+def _iter_csv(path: str) -> Iterator[dict]:
+    with open(path, newline="") as f:
+        for row in csv.DictReader(f):
+            device = {key: value for key, value in row.items() if key and value not in (None, "")}
+            if "restconf" in device:
+                device["restconf"] = device["restconf"].strip().lower() in TRUE_VALUES
+            if "tags" in device:
+                device["tags"] = device["tags"].replace(",", " ").split()
+            yield device
+
+
+def iter_inventory(
+    path: str, cache_dir: Optional[str] = ".rotatekey-cache"
+) -> Iterator[dict]:
+    """
+    Yield the devices in an inventory file.
+
+    The format is chosen from the file extension: .jsonl/.ndjson for JSON Lines,
+    .csv for CSV (with a header row) and YAML for anything else.
+
+    Args:
+        path (str): The inventory file
+        cache_dir (str): Directory for the YAML inventory cache, None to disable caching
+
+    Returns:
+        devices (Iterator): The inventory devices
+    """
+    extension = os.path.splitext(path)[1].lower()
+    if extension in (".jsonl", ".ndjson"):
+        return _iter_jsonl(path)
+    if extension == ".csv":
+        return _iter_csv(path)
+
+    return iter(_load_yaml(path, cache_dir))
+
+
+def load_inventory(
+    path: str,
+    device_filter: Optional[Callable[[dict], bool]] = None,
+    cache_dir: Optional[str] = ".rotatekey-cache",
+) -> list[dict]:
+    """
+    Load the devices from an inventory file, keeping only those selected.
+
+    Args:
+        path (str): The inventory file
+        device_filter (Callable): Optional function returning True for devices to keep
+        cache_dir (str): Directory for the YAML inventory cache, None to disable caching
+
+    Returns:
+        devices (list): The selected inventory devices
+    """
+    devices = iter_inventory(path, cache_dir)
+    if device_filter is None:
+        return list(devices)
+
+    return [device for device in devices if device_filter(device)]
@@ -0,0 +1,249 @@
+"""
+Run statistics in the Prometheus text format, for the node_exporter textfile collector.
+
+Metrics are collected in a process wide registry, so the device backends can
+record request latencies without having a registry passed to them. Recording
+is a dictionary update under a lock, cheap enough to leave on for every run;
+nothing is written unless a metrics file is requested.
+"""
+
+from __future__ import annotations
+from contextlib import contextmanager
+import os
+import threading
+import time
+from typing import Iterator, Optional
+
+# Upper bounds, in seconds, of the latency histogram buckets
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+# Name: (type, help) for every metric the tool records
+METRICS = {
+    "rotatekey_transport_requests_total": (
+        "counter", "Requests sent to devices, by transport and operation"),
+    "rotatekey_restconf_request_seconds": (
+        "histogram", "Latency of RESTCONF HTTP requests"),
+    "rotatekey_cli_command_seconds": (
+        "histogram", "Latency of CLI execute and configure calls"),
+    "rotatekey_netconf_rpc_seconds": (
+        "histogram", "Latency of NETCONF RPCs"),
+    "rotatekey_discovery_total": (
+        "counter", "Transport discovery outcomes"),
+    "rotatekey_devices_total": (
+        "counter", "Devices processed, by command, transport and status"),
+    "rotatekey_device_seconds": (
+        "histogram", "Wall time of a command on one device"),
+    "rotatekey_device_failures_total": (
+        "counter", "Failed devices, by command and failure reason"),
+    "rotatekey_run_seconds": (
+        "gauge", "Wall time of the run so far"),
+    "rotatekey_run_start_timestamp_seconds": (
+        "gauge", "Unix time the run started"),
+}
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(labels: tuple, extra: Optional[tuple] = None) -> str:
+    labels = labels + (extra or ())
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in labels) + "}"
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class MetricsRegistry(object):
+    """
+    Counters, gauges and histograms keyed by metric name and label set.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.gauges = {}
+        self.histograms = {}
+
+    @staticmethod
+    def _key(name: str, labels: dict) -> tuple:
+        if name not in METRICS:
+            raise KeyError(f"Unknown metric '{name}'")
+        return (name, tuple(sorted(labels.items())))
+
+    def inc(self, name: str, amount: float = 1, **labels) -> None:
+        """
+        Increase a counter.
+
+        Args:
+            name (str): The metric name
+            amount (float): The amount to add
+            labels: The metric labels
+        """
+        key = self._key(name, labels)
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + amount
+
+    def set(self, name: str, value: float, **labels) -> None:
+        """
+        Set a gauge.
+
+        Args:
+            name (str): The metric name
+            value (float): The new value
+            labels: The metric labels
+        """
+        key = self._key(name, labels)
+        with self.lock:
+            self.gauges[key] = value
+
+    def observe(self, name: str, value: float, **labels) -> None:
+        """
+        Add an observation to a histogram.
+
+        Args:
+            name (str): The metric name
+            value (float): The observed value, in seconds for latencies
+            labels: The metric labels
+        """
+        key = self._key(name, labels)
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                # Per-bucket counts (the last is +Inf), then the sum
+                histogram = self.histograms[key] = [0] * (len(LATENCY_BUCKETS) + 1) + [0.0]
+            for index, bound in enumerate(LATENCY_BUCKETS):
+                if value <= bound:
+                    histogram[index] += 1
+                    break
+            else:
+                histogram[len(LATENCY_BUCKETS)] += 1
+            histogram[-1] += value
+
+    @contextmanager
+    def time(self, name: str, **labels) -> Iterator[None]:
+        """
+        Observe the wall time of a block, whether or not it raises.
+
+        Args:
+            name (str): The histogram metric name
+            labels: The metric labels
+        """
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.observe(name, time.monotonic() - start, **labels)
+
+    def render(self) -> str:
+        """
+        Render every recorded metric in the Prometheus text format.
+
+        Returns:
+            text (str): The metrics text
+        """
+        with self.lock:
+            samples = {}
+            for (name, labels), value in self.counters.items():
+                samples.setdefault(name, []).append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+            for (name, labels), value in self.gauges.items():
+                samples.setdefault(name, []).append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+            for (name, labels), histogram in self.histograms.items():
+                lines = samples.setdefault(name, [])
+                cumulative = 0
+                for bound, count in zip(LATENCY_BUCKETS + (float("inf"),), histogram):
+                    cumulative += count
+                    bucket_labels = _format_labels(labels, (("le", _format_value(float(bound))),))
+                    lines.append(f"{name}_bucket{bucket_labels} {cumulative}")
+                lines.append(f"{name}_count{_format_labels(labels)} {cumulative}")
+                lines.append(f"{name}_sum{_format_labels(labels)} {_format_value(histogram[-1])}")
+
+        output = []
+        for name in METRICS:
+            if name not in samples:
+                continue
+            metric_type, help_text = METRICS[name]
+            output.append(f"# HELP {name} {help_text}")
+            output.append(f"# TYPE {name} {metric_type}")
+            output.extend(sorted(samples[name]) if metric_type != "histogram" else samples[name])
+
+        return "\n".join(output) + "\n"
+
+    def write(self, path: str) -> None:
+        """
+        Write the metrics to a file, replacing it atomically so collectors never read a partial file.
+
+        Args:
+            path (str): The metrics file, e.g. /var/lib/node_exporter/textfile/rotatekey.prom
+        """
+        temporary = f"{path}.{os.getpid()}.tmp"
+        with open(temporary, "w") as f:
+            f.write(self.render())
+        os.replace(temporary, path)
+
+    def reset(self) -> None:
+        """
+        Forget every recorded metric.
+        """
+        with self.lock:
+            self.counters.clear()
+            self.gauges.clear()
+            self.histograms.clear()
+
+
+# The registry shared by the whole process
+REGISTRY = MetricsRegistry()
+
+
+class MetricsWriter(object):
+    """
+    Writes the registry to a metrics file periodically during a run, and once at the end.
+    """
+
+    def __init__(self, path: str, interval: Optional[float] = None, registry: MetricsRegistry = REGISTRY):
+        """
+        Args:
+            path (str): The metrics file
+            interval (float): Seconds between writes during the run, None to only write at the end
+            registry (MetricsRegistry): The registry to write
+        """
+        self.path = path
+        self.interval = interval
+        self.registry = registry
+        self.started = time.monotonic()
+        self.stopped = threading.Event()
+
+        registry.set("rotatekey_run_start_timestamp_seconds", time.time())
+
+        self.thread = None
+        if interval:
+            self.thread = threading.Thread(target=self._run, daemon=True)
+            self.thread.start()
+
+    def write(self) -> None:
+        """
+        Update the run wall time and write the metrics file.
+        """
+        self.registry.set("rotatekey_run_seconds", time.monotonic() - self.started)
+        self.registry.write(self.path)
+
+    def _run(self) -> None:
+        while not self.stopped.wait(self.interval):
+            try:
+                self.write()
+            except OSError:
+                pass
+
+    def close(self) -> None:
+        """
+        Stop the periodic writes and write the final metrics.
+        """
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join()
+        self.write()
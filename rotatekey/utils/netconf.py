@@ -0,0 +1,325 @@
+"""
+NETCONF releated classes and functions for interacting with network devices.
+"""
+
+from __future__ import annotations
+from typing import Optional
+import logging
+import time
+from xml.etree import ElementTree
+from .concurrency import is_auth_error, is_transport_error
+from .metrics import REGISTRY
+from .secret_kinds import SecretKind, SnmpCommunities, merge_native
+from .session_log import mask_secrets
+
+try:
+    from ncclient import manager
+    from ncclient.operations import RPCError
+except ImportError:
+    # NETCONF support is optional, Netconf.validate() reports it as unavailable
+    manager = None
+    RPCError = Exception
+
+# Whether ncclient is installed, so NETCONF can be used at all
+NETCONF_AVAILABLE = manager is not None
+
+NETCONF_BASE_NS = "urn:ietf:params:xml:ns:netconf:base:1.0"
+NATIVE_MODULE = "Cisco-IOS-XE-native"
+CANDIDATE_CAPABILITY = "urn:ietf:params:netconf:capability:candidate:1.0"
+
+
+def module_namespace(module: str) -> str:
+    """
+    The XML namespace of a Cisco IOS XE YANG module.
+
+    Args:
+        module (str): The module name, e.g. "Cisco-IOS-XE-snmp"
+
+    Returns:
+        namespace (str): The module namespace
+    """
+    return f"http://cisco.com/ns/yang/{module}"
+
+
+def native_to_xml(native: dict) -> str:
+    """
+    Convert a native model fragment (as used for RESTCONF) to NETCONF XML.
+
+    Module prefixes on keys ("Cisco-IOS-XE-snmp:community-config") become XML
+    namespaces, lists become repeated elements and an "@operation" key becomes
+    the NETCONF operation attribute.
+
+    Args:
+        native (dict): A Cisco-IOS-XE-native:native fragment
+
+    Returns:
+        xml (str): The <config> element for edit-config
+    """
+    config = ElementTree.Element(f"{{{NETCONF_BASE_NS}}}config")
+    root = ElementTree.SubElement(config, f"{{{module_namespace(NATIVE_MODULE)}}}native")
+
+    def build(parent: ElementTree.Element, namespace: str, fragment: dict) -> None:
+        for key, value in fragment.items():
+            if key == "@operation":
+                parent.set(f"{{{NETCONF_BASE_NS}}}operation", value)
+                continue
+
+            module, _, name = key.rpartition(":")
+            child_namespace = module_namespace(module) if module else namespace
+            for item in value if isinstance(value, list) else [value]:
+                element = ElementTree.SubElement(parent, f"{{{child_namespace}}}{name}")
+                if isinstance(item, dict):
+                    build(element, child_namespace, item)
+                elif isinstance(item, bool):
+                    element.text = "true" if item else "false"
+                elif item is not None:
+                    element.text = str(item)
+
+    build(root, module_namespace(NATIVE_MODULE), native)
+    return ElementTree.tostring(config, encoding="unicode")
+
+
+class Netconf(object):
+    """
+    A helper class for interacting with IOS XE devices with NETCONF for common operations.
+
+    Changes are staged in the candidate datastore with a single edit-config and
+    applied with one commit when the device supports it, otherwise they are
+    sent to the running datastore in a single edit-config.
+    """
+
+    def __init__(
+        self,
+        address: str,
+        username: str,
+        password: str,
+        port: int = 830,
+        session_log: Optional[logging.Logger] = None,
+    ):
+        """
+        Setup a Netconf object for a device.
+
+        Args:
+            address (str): address for network device
+            username (str): username for network device
+            password (str): password for network device
+            port (int): NETCONF port, can point at a local stand-in server for testing
+            session_log (logging.Logger): Optional logger for RPC summaries
+
+        """
+        self.address = address
+        self.username = username
+        self.password = password
+        self.port = port
+        self.session_log = session_log
+        self.session = None
+
+        # Configuration read during this session, cleared by any change
+        self._snmp_cache = None
+        # Whether the device rejected the credentials
+        self.auth_failed = False
+        # Whether an RPC failed because the session broke
+        self.transport_failed = False
+
+        self.validate()
+
+    def _rpc(self, operation: str, *args, **kwargs):
+        # Send an RPC on the session, recording its count and latency
+        REGISTRY.inc("rotatekey_transport_requests_total", transport="netconf", operation=operation)
+        start = time.monotonic()
+        outcome = "ok"
+        try:
+            with REGISTRY.time("rotatekey_netconf_rpc_seconds", operation=operation):
+                return getattr(self.session, operation)(*args, **kwargs)
+        except Exception as e:
+            outcome = f"error: {e}"
+            if is_transport_error(e):
+                self.transport_failed = True
+            raise
+        finally:
+            if self.session_log is not None:
+                self.session_log.info(f"NETCONF {operation} -> {outcome} ({time.monotonic() - start:.3f}s)")
+
+    def invalidate_cache(self) -> None:
+        """
+        Forget the configuration read during this session so the next lookup goes to the device.
+        """
+        self._snmp_cache = None
+
+    def is_connected(self) -> bool:
+        """
+        Whether the session is still open and has not broken during a request.
+
+        Returns:
+            connected (bool): Whether the session can be used again
+        """
+        return self.enabled and not self.transport_failed and self.session is not None and self.session.connected
+
+    def disconnect(self) -> None:
+        """
+        Disconnect from the device.
+        """
+        if self.session is not None:
+            try:
+                self.session.close_session()
+            except Exception:
+                pass
+            self.session = None
+
+    def validate(self) -> bool:
+        """
+        Check if NETCONF is supported on the device by opening a session.
+
+        A connection failure caused by rejected credentials sets auth_failed.
+
+        Returns:
+            enabled (bool): Whether NETCONF is enabled on device
+        """
+        if manager is None:
+            self.enabled = False
+            return self.enabled
+
+        try:
+            self.session = manager.connect(
+                host=self.address,
+                port=self.port,
+                username=self.username,
+                password=self.password,
+                hostkey_verify=False,
+                allow_agent=False,
+                look_for_keys=False,
+                timeout=30,
+            )
+            self.candidate = CANDIDATE_CAPABILITY in self.session.server_capabilities
+            self.enabled = True
+        except Exception as e:
+            if self.session_log is not None:
+                self.session_log.info(f"NETCONF connection to {self.address}:{self.port} failed: {e}")
+            self.session = None
+            self.auth_failed = is_auth_error(e)
+            self.enabled = False
+
+        return self.enabled
+
+    def lookup_snmp_communities(self, refresh: bool = False) -> list[dict[str, str]]:
+        """
+        Lookup the currently configured SNMP communities.
+
+        The result is kept for the rest of the session and served from memory
+        until a change is made or refresh is set.
+
+        Args:
+            refresh (bool): Read from the device even if the communities are cached
+
+        Returns:
+            snmp_communities (list): List of SNMP communities and permissions
+        """
+        if self._snmp_cache is None or refresh:
+            snmp_namespace = module_namespace("Cisco-IOS-XE-snmp")
+            subtree = (
+                f'<native xmlns="{module_namespace(NATIVE_MODULE)}"><snmp-server>'
+                # Select only the leaves that are compared, not views and ACLs
+                f'<community-config xmlns="{snmp_namespace}"><name/><permission/></community-config>'
+                "</snmp-server></native>"
+            )
+            try:
+                reply = self._rpc("get_config", source="running", filter=("subtree", subtree))
+            except RPCError:
+                return None
+
+            snmp_communities = []
+            data = ElementTree.fromstring(reply.data_xml)
+            for community in data.iter(f"{{{snmp_namespace}}}community-config"):
+                snmp_communities.append(
+                    {
+                        "name": community.findtext(f"{{{snmp_namespace}}}name"),
+                        "permission": community.findtext(f"{{{snmp_namespace}}}permission"),
+                    }
+                )
+            self._snmp_cache = snmp_communities
+
+        # Hand out copies so callers cannot change the cached result
+        return [dict(community) for community in self._snmp_cache]
+
+    def create_snmp_community(self, community_name: str, permission: Optional[str] = "ro") -> tuple[bool, str]:
+        """
+        Create a new SNMP community string entry using NETCONF.
+
+        Args:
+            community_name (str): The name of the community string to create
+            permission (str): The permission level (ro or rw) for the community
+
+        Returns:
+            action_result (tuple): Details on result (success_bool, reason)
+        """
+        return self.apply_snmp_changes([{"name": community_name, "permission": permission}], [])
+
+    def delete_snmp_community(self, community_name: str) -> tuple[bool, str]:
+        """
+        Delete the provided community name using NETCONF.
+
+        Args:
+            community_name (str): The name of the community to delete.
+
+        Returns:
+            action_result (tuple): Details on result (success_bool, reason)
+        """
+        return self.apply_snmp_changes([], [community_name])
+
+    def clear_snmp_communities(self) -> tuple[bool, str]:
+        """
+        Delete all community strings currently configured on a devices in one commit.
+
+        Returns:
+            action_result (tuple): Details on result (success_bool, reason)
+        """
+        current_communities = self.lookup_snmp_communities()
+        if current_communities is None:
+            return (False, "Unable to read current communities")
+
+        return self.apply_snmp_changes([], [community["name"] for community in current_communities])
+
+    def apply_snmp_changes(self, creates: list[dict[str, str]], deletes: list[str]) -> tuple[bool, str]:
+        """
+        Delete and create a set of SNMP communities in one edit-config and commit.
+
+        Args:
+            creates (list): Communities (name, permission) to create
+            deletes (list): Names of communities to delete
+
+        Returns:
+            action_result (tuple): Details on result (success_bool, reason)
+        """
+        return self.apply_secrets([SnmpCommunities(creates, deletes)])
+
+    def apply_secrets(self, secrets: list[SecretKind]) -> tuple[bool, str]:
+        """
+        Apply a set of secret changes in one edit-config and commit.
+
+        Args:
+            secrets (list): The secret changes to apply
+
+        Returns:
+            action_result (tuple): Details on result (success_bool, reason)
+        """
+        self.invalidate_cache()
+
+        native = merge_native(secrets, removals=True)
+        if not native:
+            return (True, None)
+
+        config = native_to_xml(native)
+        try:
+            if self.candidate:
+                with self.session.locked("candidate"):
+                    try:
+                        self._rpc("edit_config", target="candidate", config=config)
+                        self._rpc("commit")
+                    except RPCError:
+                        self._rpc("discard_changes")
+                        raise
+            else:
+                self._rpc("edit_config", target="running", config=config)
+            return (True, None)
+        except Exception as e:
+            return (False, mask_secrets(str(e)))
@@ -0,0 +1,173 @@
+"""
+A live progress line for long runs, showing devices done, failed and in flight
+along with the recent throughput and an estimate of the time remaining.
+"""
+
+from __future__ import annotations
+from collections import deque
+import sys
+import threading
+import time
+from typing import Optional, TextIO
+
+# Completions older than this many seconds do not count towards the rate
+RATE_WINDOW = 30.0
+
+
+def format_duration(seconds: float) -> str:
+    """
+    Format a duration as h:mm:ss or m:ss.
+
+    Args:
+        seconds (float): The duration in seconds
+
+    Returns:
+        duration (str): The formatted duration
+    """
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    if hours:
+        return f"{hours}:{minutes:02d}:{seconds:02d}"
+    return f"{minutes}:{seconds:02d}"
+
+
+class ProgressDisplay(object):
+    """
+    Render progress events from the per-device loop as a single status line.
+
+    Events only update counters. The line is redrawn at most once per interval,
+    so rendering costs nothing measurable however fast devices complete. The
+    display switches itself off when the stream is not a terminal.
+    """
+
+    def __init__(
+        self,
+        total: int,
+        label: str = "",
+        stream: Optional[TextIO] = None,
+        interval: float = 0.25,
+        enabled: Optional[bool] = None,
+    ):
+        """
+        Args:
+            total (int): The number of devices in the run
+            label (str): Shown at the start of the line, e.g. the command name
+            stream (TextIO): Where to draw the line, defaults to stderr
+            interval (float): Minimum seconds between redraws
+            enabled (bool): Force the display on or off, by default on only for a terminal
+        """
+        self.total = total
+        self.label = label
+        self.stream = stream or sys.stderr
+        self.interval = interval
+        if enabled is None:
+            enabled = hasattr(self.stream, "isatty") and self.stream.isatty()
+        self.enabled = enabled
+
+        self.done = 0
+        self.failed = 0
+        self.in_flight = 0
+        self.completions = deque()
+        self.started_at = time.monotonic()
+        self.last_render = 0.0
+        self.width = 0
+        self.lock = threading.Lock()
+
+    def started(self) -> None:
+        """
+        Record that work on a device has started.
+        """
+        if not self.enabled:
+            return
+        with self.lock:
+            self.in_flight += 1
+            self._maybe_render()
+
+    def finished(self, success: bool) -> None:
+        """
+        Record that work on a device has finished.
+
+        Args:
+            success (bool): Whether the device succeeded
+        """
+        if not self.enabled:
+            return
+        with self.lock:
+            # Results streamed from the agent arrive without a started event
+            self.in_flight = max(0, self.in_flight - 1)
+            self.done += 1
+            if not success:
+                self.failed += 1
+            self.completions.append(time.monotonic())
+            self._maybe_render()
+
+    def close(self) -> None:
+        """
+        Draw the final state and move to a new line.
+        """
+        if not self.enabled:
+            return
+        with self.lock:
+            self._render(time.monotonic())
+            self.stream.write("\n")
+            self.stream.flush()
+            self.enabled = False
+
+    def rate(self, now: float) -> float:
+        """
+        Devices completed per second over the recent window.
+
+        Args:
+            now (float): The current monotonic time
+
+        Returns:
+            rate (float): Devices per second, 0 before the first completion
+        """
+        while self.completions and now - self.completions[0] > RATE_WINDOW:
+            self.completions.popleft()
+        if not self.completions:
+            return 0.0
+
+        # Early in the run the window is shorter than RATE_WINDOW
+        elapsed = min(RATE_WINDOW, now - self.started_at)
+        return len(self.completions) / elapsed if elapsed > 0 else 0.0
+
+    def line(self, now: float) -> str:
+        """
+        The status line for the current state.
+
+        Args:
+            now (float): The current monotonic time
+
+        Returns:
+            line (str): The status line
+        """
+        rate = self.rate(now)
+        remaining = self.total - self.done
+        if remaining == 0:
+            eta = "done"
+        elif rate > 0:
+            eta = f"ETA {format_duration(remaining / rate)}"
+        else:
+            eta = "ETA --:--"
+
+        label = f"{self.label}: " if self.label else ""
+        return (
+            f"{label}{self.done}/{self.total} done, {self.failed} failed, {self.in_flight} in flight, "
+            f"{rate:.1f} dev/s, {eta}, elapsed {format_duration(now - self.started_at)}"
+        )
+
+    def _maybe_render(self) -> None:
+        # Called with the lock held
+        now = time.monotonic()
+        if now - self.last_render >= self.interval:
+            self._render(now)
+
+    def _render(self, now: float) -> None:
+        # Called with the lock held
+        self.last_render = now
+        line = self.line(now)
+        padding = " " * max(0, self.width - len(line))
+        self.width = len(line)
+        self.stream.write(f"\r{line}{padding}")
+        self.stream.flush()
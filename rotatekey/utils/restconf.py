@@ -4,19 +4,94 @@ RESTCONF releated classes and functions for interacting with network devices.
 
 from __future__ import annotations
 from typing import Optional
+import logging
+import re
+import threading
+import time
 import requests
 import urllib3
-import xmltodict
+from .concurrency import is_auth_error
+from .metrics import REGISTRY
+from .secret_kinds import SecretKind, SnmpCommunities, merge_native
+from .session_log import mask_secrets
 
 urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
 
+NATIVE_RESOURCE = "/data/Cisco-IOS-XE-native:native"
+SNMP_COMMUNITY_RESOURCE = f"{NATIVE_RESOURCE}/snmp-server/community-config"
+
+# Only the leaves the tool compares, leaving out views, ACLs and other community settings
+SNMP_COMMUNITY_FIELDS = "fields=name;permission"
+
+# Status codes a device returns when the credentials are rejected
+AUTH_FAILED = (401, 403)
+
+# Status codes a device returns when it does not support YANG Patch. A device that
+# does support it also returns 400 for a failed patch, with a yang-patch-status body
+YANG_PATCH_UNSUPPORTED = (400, 405, 406, 415, 501)
+
+# The Link elements of a host-meta document, and the attributes of one
+HOST_META_LINK = re.compile(r"<Link\b([^>]*)>")
+XML_ATTRIBUTE = re.compile(r"""([\w:-]+)\s*=\s*(?:"([^"]*)"|'([^']*)')""")
+
+
+class RestconfSession(requests.Session):
+    """
+    A requests session that notes when a request fails on the connection itself.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.transport_failed = False
+
+    def request(self, *args, **kwargs) -> requests.Response:
+        try:
+            return super().request(*args, **kwargs)
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+            self.transport_failed = True
+            raise
+
+
+def parse_host_meta(text: str) -> Optional[str]:
+    """
+    Find the RESTCONF root in a host-meta (RFC 6415) document.
+
+    Only the Link elements are scanned rather than parsing the whole XML document.
+
+    Args:
+        text (str): The host-meta XML
+
+    Returns:
+        restconf_resource (str): The href of the restconf link, None if there is none
+    """
+    for link in HOST_META_LINK.finditer(text):
+        attributes = {
+            match.group(1): match.group(2) if match.group(2) is not None else match.group(3)
+            for match in XML_ATTRIBUTE.finditer(link.group(1))
+        }
+        if attributes.get("rel") == "restconf" and attributes.get("href"):
+            return attributes["href"]
+    return None
+
 
 class Restconf(object):
     """
     A helper class for interacting with IOS XE devices with RESTCONF for common operations.
     """
 
-    def __init__(self, address: str, username: str, password: str):
+    # Whether each device address accepts YANG Patch and the fields query parameter,
+    # shared by every session in the process
+    yang_patch_support = {}
+    fields_support = {}
+    support_lock = threading.Lock()
+
+    def __init__(
+        self,
+        address: str,
+        username: str,
+        password: str,
+        session_log: Optional[logging.Logger] = None,
+    ):
         """
         Setup a Restconf object for a device.
 
@@ -24,14 +99,16 @@ class Restconf(object):
             address (str): address for network device
             username (str): username for network device
             password (str): password for network device
+            session_log (logging.Logger): Optional logger for request/response summaries
 
         """
         self.address = address
+        self.session_log = session_log
         self.base_url = f"https://{address}"
         self.username = username
         self.password = password
 
-        self.http_session = requests.Session()
+        self.http_session = RestconfSession()
         self.http_session.auth = (username, password)
         self.http_session.headers.update(
             {
@@ -40,8 +117,56 @@ class Restconf(object):
             }
         )
         self.http_session.verify = False
+        self.http_session.hooks["response"].append(self._record_response)
+        self.http_session.hooks["response"].append(self._check_auth)
+        if session_log is not None:
+            self.http_session.hooks["response"].append(self._log_response)
+        # Configuration read during this session, cleared by any change
+        self._snmp_cache = None
+        # Whether the device rejected the credentials
+        self.auth_failed = False
+
         self.validate()
 
+    @staticmethod
+    def _record_response(response: requests.Response, *args, **kwargs) -> None:
+        # Response hook, records the count and latency (to the response headers) of every request
+        method = response.request.method
+        REGISTRY.inc("rotatekey_transport_requests_total", transport="restconf", operation=method)
+        REGISTRY.observe(
+            "rotatekey_restconf_request_seconds",
+            response.elapsed.total_seconds(),
+            method=method,
+            code=str(response.status_code),
+        )
+
+    def _check_auth(self, response: requests.Response, *args, **kwargs) -> None:
+        # Response hook, notes rejected credentials on any request
+        if response.status_code == 401:
+            self.auth_failed = True
+
+    def _log_response(self, response: requests.Response, *args, **kwargs) -> None:
+        # Response hook, writes a one line summary of each request to the session log
+        self.session_log.info(
+            f"RESTCONF {response.request.method} {response.url} -> {response.status_code} "
+            f"({len(response.content)} bytes, {response.elapsed.total_seconds():.3f}s)"
+        )
+
+    def invalidate_cache(self) -> None:
+        """
+        Forget the configuration read during this session so the next lookup goes to the device.
+        """
+        self._snmp_cache = None
+
+    def is_connected(self) -> bool:
+        """
+        Whether the session has not failed to reach the device, or been refused, since it connected.
+
+        Returns:
+            connected (bool): Whether the session can be used again
+        """
+        return self.enabled and not self.auth_failed and not self.http_session.transport_failed
+
     def disconnect(self) -> None:
         """
         Disconnect from the device.
@@ -50,45 +175,82 @@ class Restconf(object):
 
     def validate(self) -> bool:
         """
-        Check if RESTCONF is supported on the device by testing the .well-known/host-meta path.
+        Check if RESTCONF is supported on the device by testing the .well-known/host-meta path,
+        then log in by reading the RESTCONF root it points to.
+
+        A 401 or 403 from either sets auth_failed, so the caller can tell rejected
+        credentials from a device without RESTCONF.
 
         Returns:
             enabled (bool): Whether RESTCONF is enabled on device
         """
         try:
             response = self.http_session.get(f"{self.base_url}/.well-known/host-meta")
-            if response.status_code == 200:
-                body = xmltodict.parse(response.text)
-                restconf_resource = body["XRD"]["Link"]["@href"]
+            if response.status_code in AUTH_FAILED:
+                self.auth_failed = True
+                if self.session_log is not None:
+                    self.session_log.info(f"RESTCONF authentication to {self.base_url} failed: {response.status_code}")
+            restconf_resource = parse_host_meta(response.text) if response.status_code == 200 else None
+            if restconf_resource:
                 self.base_url = f"{self.base_url}{restconf_resource}"
-                self.enabled = True
+                # host-meta is usually served without credentials, the RESTCONF root is not
+                response = self.http_session.get(self.base_url)
+                if response.status_code in AUTH_FAILED:
+                    self.auth_failed = True
+                    if self.session_log is not None:
+                        self.session_log.info(
+                            f"RESTCONF authentication to {self.base_url} failed: {response.status_code}"
+                        )
+                self.enabled = not self.auth_failed
             else:
                 self.enabled = False
-        except requests.exceptions.ConnectionError:
+        except requests.exceptions.ConnectionError as e:
+            if self.session_log is not None:
+                self.session_log.info(f"RESTCONF connection to {self.base_url} failed: {e}")
+            self.auth_failed = is_auth_error(e)
             self.enabled = False
 
         return self.enabled
 
-    def lookup_snmp_communities(self) -> list[dict[str, str]]:
+    def lookup_snmp_communities(self, refresh: bool = False) -> list[dict[str, str]]:
         """
         Lookup the currently configured SNMP communities.
 
+        Only the name and permission leaves are requested, with the RESTCONF
+        fields query parameter, falling back to the whole list on devices that
+        reject it. The result is kept for the rest of the session and served
+        from memory until a change is made or refresh is set.
+
+        Args:
+            refresh (bool): Read from the device even if the communities are cached
+
         Returns:
             snmp_communtites (list): List of SNMP communities and permissions
         """
-        target_resource = (
-            "/data/Cisco-IOS-XE-native:native/snmp-server/community-config"
-        )
-        response = self.http_session.get(f"{self.base_url}{target_resource}")
+        if self._snmp_cache is None or refresh:
+            url = f"{self.base_url}{SNMP_COMMUNITY_RESOURCE}"
 
-        if response.status_code == 200:
-            body = response.json()
-            snmp_communities = body["Cisco-IOS-XE-snmp:community-config"]
-            return snmp_communities
-        elif response.status_code == 204:
-            return []
-        else:
-            return None
+            # Ask for the name and permission leaves only, unless the device is known to reject it
+            use_fields = self.fields_support.get(self.address, True)
+            response = self.http_session.get(f"{url}?{SNMP_COMMUNITY_FIELDS}" if use_fields else url)
+            if use_fields and response.status_code == 400:
+                with self.support_lock:
+                    self.fields_support[self.address] = False
+                response = self.http_session.get(url)
+
+            if response.status_code == 200:
+                body = response.json()
+                self._snmp_cache = [
+                    {"name": community["name"], "permission": community.get("permission")}
+                    for community in body["Cisco-IOS-XE-snmp:community-config"]
+                ]
+            elif response.status_code == 204:
+                self._snmp_cache = []
+            else:
+                return None
+
+        # Hand out copies so callers cannot change the cached result
+        return [dict(community) for community in self._snmp_cache]
 
     def create_snmp_community(
         self, community_name: str, permission: Optional[str] = "ro"
@@ -103,6 +265,7 @@ class Restconf(object):
         Returns:
             action_result (tuple): Details on result (success_bool, reason)
         """
+        self.invalidate_cache()
         target_resource = "/data/Cisco-IOS-XE-native:native/snmp-server/"
 
         body = {
@@ -130,6 +293,7 @@ class Restconf(object):
         Returns:
             action_result (tuple): Details on result (success_bool, reason)
         """
+        self.invalidate_cache()
         target_resource = f"/data/Cisco-IOS-XE-native:native/snmp-server/community-config={community_name}"
         response = self.http_session.delete(f"{self.base_url}{target_resource}")
 
@@ -155,8 +319,175 @@ class Restconf(object):
             success, reason = self.delete_snmp_community(community["name"])
             if not success:
                 return_status = False
-                return_reasons = return_reasons.append(
-                    f"Community {community}, {reason}"
+                return_reasons.append(f"Community {community}, {reason}")
+
+        return (return_status, ", ".join(return_reasons))
+
+    def apply_snmp_changes(
+        self, creates: list[dict[str, str]], deletes: list[str]
+    ) -> tuple[bool, str]:
+        """
+        Delete and create a set of SNMP communities using RESTCONF.
+
+        All creates are merged with a single PATCH request rather than one POST
+        per community.
+
+        Args:
+            creates (list): Communities (name, permission) to create
+            deletes (list): Names of communities to delete
+
+        Returns:
+            action_result (tuple): Details on result (success_bool, reason)
+        """
+        return self.apply_secrets([SnmpCommunities(creates, deletes)])
+
+    def apply_secrets(self, secrets: list[SecretKind]) -> tuple[bool, str]:
+        """
+        Apply a set of secret changes using RESTCONF.
+
+        Where the device supports it, every delete and merge is sent as a single
+        YANG Patch request. Otherwise the deletes are sent one by one and the
+        merges combined into a single PATCH request. Whether a device supports
+        YANG Patch is remembered for the rest of the process.
+
+        Args:
+            secrets (list): The secret changes to apply
+
+        Returns:
+            action_result (tuple): Details on result (success_bool, reason)
+        """
+        self.invalidate_cache()
+
+        if self.yang_patch_support.get(self.address, True):
+            result = self.yang_patch(secrets)
+            if result is not None:
+                return result
+
+        return_status = True
+        return_reasons = []
+
+        for secret in secrets:
+            for target_resource in secret.restconf_deletes():
+                response = self.http_session.delete(f"{self.base_url}{target_resource}")
+                if response.status_code != 204:
+                    return_status = False
+                    return_reasons.append(f"{secret.describe()}, {response.reason}")
+
+        native = merge_native(secrets)
+        if native:
+            body = {"Cisco-IOS-XE-native:native": native}
+            response = self.http_session.patch(
+                f"{self.base_url}{NATIVE_RESOURCE}", json=body
+            )
+            if response.status_code not in (200, 204):
+                return_status = False
+                return_reasons.append(
+                    f"{', '.join(secret.describe() for secret in secrets)}, {response.reason}"
                 )
 
         return (return_status, ", ".join(return_reasons))
+
+    def yang_patch(self, secrets: list[SecretKind]) -> Optional[tuple[bool, str]]:
+        """
+        Apply a set of secret changes as one YANG Patch (RFC 8072) request.
+
+        Args:
+            secrets (list): The secret changes to apply
+
+        Returns:
+            action_result (tuple): Details on result (success_bool, reason), None if the
+                device does not support YANG Patch
+        """
+        edits = []
+        descriptions = {}
+        for secret in secrets:
+            for target_resource in secret.restconf_deletes():
+                edit_id = str(len(edits) + 1)
+                descriptions[edit_id] = secret.describe()
+                # "remove" rather than "delete" so an already missing entry is not an error
+                edits.append(
+                    {
+                        "edit-id": edit_id,
+                        "operation": "remove",
+                        "target": target_resource[len(NATIVE_RESOURCE):],
+                    }
+                )
+
+        native = merge_native(secrets)
+        if native:
+            edit_id = str(len(edits) + 1)
+            descriptions[edit_id] = ", ".join(secret.describe() for secret in secrets)
+            edits.append(
+                {
+                    "edit-id": edit_id,
+                    "operation": "merge",
+                    "target": "/",
+                    "value": {"Cisco-IOS-XE-native:native": native},
+                }
+            )
+
+        if not edits:
+            return (True, None)
+
+        body = {
+            "ietf-yang-patch:yang-patch": {
+                "patch-id": f"rotatekey-{int(time.time() * 1000)}",
+                "edit": edits,
+            }
+        }
+        response = self.http_session.patch(
+            f"{self.base_url}{NATIVE_RESOURCE}",
+            json=body,
+            headers={"Content-Type": "application/yang-patch+json"},
+        )
+
+        if response.status_code in (200, 204):
+            with self.support_lock:
+                self.yang_patch_support[self.address] = True
+            return (True, None)
+
+        status = self._yang_patch_status(response)
+        edit_errors = self._yang_patch_errors(status, descriptions)
+
+        # A device without YANG Patch support rejects the request as a whole. A patch status,
+        # even with a 400, means the device took the YANG Patch and the edits failed
+        if status is not None:
+            with self.support_lock:
+                self.yang_patch_support[self.address] = True
+        elif response.status_code in YANG_PATCH_UNSUPPORTED:
+            if not self.yang_patch_support.get(self.address, False):
+                with self.support_lock:
+                    self.yang_patch_support[self.address] = False
+                return None
+
+        return (False, ", ".join(edit_errors) or response.reason)
+
+    @staticmethod
+    def _yang_patch_status(response: requests.Response) -> Optional[dict]:
+        """
+        The yang-patch-status of a YANG Patch response, None if the body has none.
+        """
+        try:
+            status = response.json()["ietf-yang-patch:yang-patch-status"]
+        except (ValueError, KeyError, TypeError):
+            return None
+
+        return status if isinstance(status, dict) else None
+
+    @staticmethod
+    def _yang_patch_errors(status: Optional[dict], descriptions: dict[str, str]) -> list[str]:
+        """
+        Collect the per-edit errors from a yang-patch-status.
+        """
+        if status is None:
+            return []
+
+        errors = []
+        for edit in status.get("edit-status", {}).get("edit", []):
+            for error in edit.get("errors", {}).get("error", []):
+                message = error.get("error-message") or error.get("error-tag")
+                errors.append(f"{descriptions.get(edit.get('edit-id'), 'edit')}: {mask_secrets(str(message))}")
+        for error in status.get("errors", {}).get("error", []):
+            errors.append(mask_secrets(str(error.get("error-message") or error.get("error-tag"))))
+
+        return errors
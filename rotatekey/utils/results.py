@@ -0,0 +1,81 @@
+"""
+Structured per-device results written by each run, and merging them into a fleet report.
+
+Results files use the same JSON Lines layout as snapshots and plans: a header
+line followed by one line per device.
+"""
+
+from __future__ import annotations
+from datetime import datetime, timezone
+import json
+from .snapshot import load_journal, open_private
+
+
+def write_results(path: str, command: str, results: list[dict], **header) -> None:
+    """
+    Write the per-device results of a run.
+
+    Args:
+        path (str): The results file to write
+        command (str): The command that produced the results
+        results (list): The per-device results
+        header: Any additional values to store in the header line, such as the shard
+    """
+    with open_private(path) as f:
+        f.write(
+            json.dumps(
+                {
+                    "kind": "results",
+                    "command": command,
+                    "created": datetime.now(timezone.utc).isoformat(),
+                    **header,
+                }
+            )
+            + "\n"
+        )
+        for result in results:
+            f.write(json.dumps(result, default=str) + "\n")
+
+
+def merge_files(paths: list[str]) -> dict[str, dict]:
+    """
+    Merge results, snapshot and plan files from several runner hosts.
+
+    Files are grouped by kind and command. Within a group, device entries from
+    all files are combined; if a device appears more than once the first entry
+    wins, which keeps the earliest state for snapshots.
+
+    Args:
+        paths (list): The files to merge
+
+    Returns:
+        merged (dict): For each "kind command" group, the headers and combined device entries
+    """
+    merged = {}
+    for path in paths:
+        header, entries = load_journal(path)
+        group_name = f"{header.get('kind', 'unknown')} {header.get('command', '')}".strip()
+        group = merged.setdefault(group_name, {"headers": [], "devices": {}})
+        group["headers"].append({**header, "file": path})
+        for entry in entries:
+            group["devices"].setdefault(entry["device_name"], entry)
+
+    return merged
+
+
+def missing_shards(headers: list[dict]) -> list[int]:
+    """
+    Find shards that have no file among a set of merged headers.
+
+    Args:
+        headers (list): The headers of the merged files
+
+    Returns:
+        shards (list): The missing shard numbers, empty if the files were not sharded
+    """
+    totals = {header["shard"][1] for header in headers if header.get("shard")}
+    if len(totals) != 1:
+        return []
+
+    seen = {header["shard"][0] for header in headers if header.get("shard")}
+    return [shard for shard in range(1, totals.pop() + 1) if shard not in seen]
@@ -0,0 +1,181 @@
+"""
+Helpers for running device operations concurrently across the inventory.
+"""
+
+from __future__ import annotations
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+import threading
+import time
+from typing import Any, Callable, Iterable, Iterator, Optional
+from .concurrency import AimdController, failure_kind
+
+
+def _timed(func: Callable[[Any], Any], item: Any) -> tuple[float, Any]:
+    start = time.monotonic()
+    result = func(item)
+    return (time.monotonic() - start, result)
+
+
+def iter_parallel(
+    items: Iterable,
+    func: Callable[[Any], Any],
+    workers: int,
+    controller: Optional[AimdController] = None,
+    group_key: Optional[Callable[[Any], Any]] = None,
+    max_per_group: Optional[int] = None,
+    start_at: Optional[Callable[[Any], float]] = None,
+    stop: Optional[threading.Event] = None,
+) -> Iterator[tuple[int, Any]]:
+    """
+    Run a function against every item concurrently, yielding results as they complete.
+
+    Items are submitted as workers free up, so if the caller stops iterating
+    no further items are started. With a controller, the number of items in
+    flight follows the controller's limit and each item's wall time and
+    failure kind are fed back to it.
+
+    With a group key and a per-group cap, items are taken from the groups in
+    turn so work is spread across groups, and no group ever has more than the
+    cap in flight. Items whose group key is None are not capped.
+
+    With start_at, items are started in order of their start time and none
+    is started before it, for spreading work over a time window.
+
+    Once the stop event is set no further items are started, the results of
+    the items in flight are still yielded, and the items never started are
+    left out.
+
+    Args:
+        items (Iterable): The items (typically inventory devices) to process
+        func (Callable): The function to call for each item
+        workers (int): Maximum number of items processed at the same time
+        controller (AimdController): Optional adaptive concurrency controller
+        group_key (Callable): Optional function returning the group (e.g. site) of an item
+        max_per_group (int): Maximum number of items from one group processed at the same time
+        start_at (Callable): Optional function returning the earliest time.monotonic() to start an item
+        stop (threading.Event): Optional event that stops further items being started
+
+    Returns:
+        results (Iterator): (index, result) for each item started, in completion order
+    """
+    items = list(items)
+    if not items:
+        return
+
+    workers = max(1, min(workers, len(items)))
+    capped = group_key is not None and max_per_group is not None
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        # Queue the items per group, keeping their original (or start time) order within each group
+        order = range(len(items))
+        if start_at is not None:
+            start_times = [start_at(item) for item in items]
+            order = sorted(order, key=start_times.__getitem__)
+        pending = {}
+        for index in order:
+            group = group_key(items[index]) if capped else None
+            pending.setdefault(group, deque()).append((index, items[index]))
+        groups = deque(pending)
+
+        in_flight = {}
+        group_in_flight = {group: 0 for group in pending}
+
+        def next_item(now):
+            # Take the next item from the first group, in rotation, that is under its cap and due
+            for _ in range(len(groups)):
+                group = groups[0]
+                groups.rotate(-1)
+                if group is not None and capped and group_in_flight[group] >= max_per_group:
+                    continue
+                if start_at is not None and start_times[pending[group][0][0]] > now:
+                    continue
+                index, item = pending[group].popleft()
+                if not pending[group]:
+                    groups.remove(group)
+                return (group, index, item)
+            return None
+
+        def stopped():
+            return stop is not None and stop.is_set()
+
+        while (groups and not stopped()) or in_flight:
+            limit = controller.limit if controller else workers
+            now = time.monotonic()
+            while groups and len(in_flight) < limit and not stopped():
+                selected = next_item(now)
+                if selected is None:
+                    break
+                group, index, item = selected
+                group_in_flight[group] += 1
+                in_flight[executor.submit(_timed, func, item)] = (group, index)
+
+            # Wake up for the next item that becomes due, if any are waiting on their start time.
+            # Items that are due but held back by a cap wait for a completion instead
+            timeout = None
+            if start_at is not None and groups:
+                now = time.monotonic()
+                upcoming = [start_times[pending[group][0][0]] for group in groups]
+                upcoming = [start for start in upcoming if start > now]
+                if upcoming:
+                    timeout = min(upcoming) - now
+            if not in_flight:
+                if stop is not None:
+                    stop.wait(timeout or 0)
+                else:
+                    time.sleep(timeout or 0)
+                continue
+
+            done, _ = wait(in_flight, timeout=timeout, return_when=FIRST_COMPLETED)
+            for future in done:
+                group, index = in_flight.pop(future)
+                group_in_flight[group] -= 1
+                latency, result = future.result()
+                if controller:
+                    controller.record(latency, failure_kind(result))
+                yield (index, result)
+
+
+def parse_waves(spec: str, total: int) -> list[int]:
+    """
+    Convert a wave specification into the number of devices in each wave.
+
+    Each entry in the specification is the cumulative size of the rollout once
+    that wave completes, either as an absolute device count or a percentage of
+    the inventory. For example "1,10%,50%,100%" on 200 devices gives waves of
+    1, 19, 80 and 100 devices.
+
+    Args:
+        spec (str): Comma separated list of wave sizes, e.g. "1,10%,50%,100%"
+        total (int): The number of devices in the inventory
+
+    Returns:
+        wave_sizes (list): Number of devices to process in each wave
+    """
+    wave_sizes = []
+    completed = 0
+
+    for entry in spec.split(","):
+        entry = entry.strip()
+        if not entry:
+            continue
+
+        if entry.endswith("%"):
+            # Round up so that any non-zero percentage includes at least one device
+            target = -(-total * float(entry[:-1]) // 100)
+        else:
+            target = int(entry)
+        target = min(int(target), total)
+
+        if target < 0:
+            raise ValueError(f"Invalid wave size '{entry}'")
+
+        if target > completed:
+            wave_sizes.append(target - completed)
+            completed = target
+
+    # Any devices not covered by the specification go out in a final wave
+    if completed < total:
+        wave_sizes.append(total - completed)
+
+    return wave_sizes
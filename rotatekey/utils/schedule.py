@@ -0,0 +1,172 @@
+"""
+Scheduling helpers for the rotation daemon.
+
+A rotation cycle is spread over a time window so the whole fleet does not hit
+AAA, syslog and config archive systems at once. Each device gets a slot in
+the window from a hash of its name, so it keeps roughly the same place from
+cycle to cycle, plus random jitter within the slot.
+"""
+
+from __future__ import annotations
+import hashlib
+import random
+import re
+import threading
+import time
+from typing import Optional
+from .device import DeviceRecord
+
+DURATION_UNITS = {"s": 1, "m": 60, "h": 3600, "d": 86400}
+DURATION_PATTERN = re.compile(r"(\d+(?:\.\d+)?)([smhd]?)")
+
+
+def parse_duration(spec: str) -> float:
+    """
+    Parse a duration such as "90s", "30m", "12h", "1d" or "1h30m".
+
+    Args:
+        spec (str): The duration, a bare number is seconds
+
+    Returns:
+        seconds (float): The duration in seconds
+    """
+    spec = spec.strip().lower()
+    position = 0
+    seconds = 0.0
+    for match in DURATION_PATTERN.finditer(spec):
+        if match.start() != position:
+            break
+        seconds += float(match.group(1)) * DURATION_UNITS[match.group(2) or "s"]
+        position = match.end()
+
+    if not spec or position != len(spec):
+        raise ValueError(f"Invalid duration '{spec}', use e.g. 90s, 30m, 12h or 1d")
+
+    return seconds
+
+
+def spread_start_times(
+    devices: list[DeviceRecord], window: float, start: float, rng: Optional[random.Random] = None
+) -> dict[str, float]:
+    """
+    Give each device a start time within a window.
+
+    The window is split into one slot per device, devices are placed in the
+    slots in the order of a hash of their name, and each start time is
+    jittered uniformly within its slot.
+
+    Args:
+        devices (list): The devices to schedule
+        window (float): The length of the window in seconds, 0 to start every device at once
+        start (float): The time.monotonic() the window opens
+        rng (random.Random): Source of jitter
+
+    Returns:
+        start_times (dict): The time.monotonic() to start each device, by device name
+    """
+    rng = rng or random.Random()
+    if not devices or window <= 0:
+        return {device.device_name: start for device in devices}
+
+    slot = window / len(devices)
+    ordered = sorted(devices, key=lambda device: hashlib.blake2b(device.device_name.encode(), digest_size=8).digest())
+    return {device.device_name: start + index * slot + rng.uniform(0, slot) for index, device in enumerate(ordered)}
+
+
+class DaemonStatus(object):
+    """
+    The daemon's current state, updated by the scheduler and read through the status socket.
+    """
+
+    def __init__(self, interval: float, window: float):
+        """
+        Args:
+            interval (float): Seconds between cycles
+            window (float): Seconds each cycle is spread over
+        """
+        self.lock = threading.Lock()
+        self.interval = interval
+        self.window = window
+        self.started = time.time()
+        self.state = "starting"
+        self.cycle = 0
+        self.next_cycle = None
+        self.current = None
+        self.last = None
+
+    def waiting(self, next_cycle: float) -> None:
+        """
+        Record that the daemon is waiting for the next cycle.
+
+        Args:
+            next_cycle (float): Unix time the next cycle starts
+        """
+        with self.lock:
+            self.state = "waiting"
+            self.next_cycle = next_cycle
+
+    def start_cycle(self, cycle: int, devices: int) -> None:
+        """
+        Record the start of a cycle.
+
+        Args:
+            cycle (int): The cycle number
+            devices (int): The number of devices in the cycle
+        """
+        with self.lock:
+            self.state = "rotating"
+            self.cycle = cycle
+            self.current = {
+                "cycle": cycle,
+                "started": time.time(),
+                "window_ends": time.time() + self.window,
+                "devices": devices,
+                "succeeded": 0,
+                "failed": 0,
+                "failures": [],
+            }
+
+    def record(self, result: dict) -> None:
+        """
+        Record the result of one device in the current cycle.
+
+        Args:
+            result (dict): The per-device result
+        """
+        with self.lock:
+            if result["success"]:
+                self.current["succeeded"] += 1
+            else:
+                self.current["failed"] += 1
+                self.current["failures"].append({"device_name": result["device_name"], "reasons": result["reasons"]})
+
+    def finish_cycle(self) -> dict:
+        """
+        Record the end of the current cycle.
+
+        Returns:
+            cycle (dict): The summary of the cycle
+        """
+        with self.lock:
+            self.current["finished"] = time.time()
+            self.last, self.current = self.current, None
+            return dict(self.last)
+
+    def snapshot(self) -> dict:
+        """
+        The current state, for the status socket.
+
+        Returns:
+            status (dict): The daemon state
+        """
+        with self.lock:
+            return {
+                "state": self.state,
+                "uptime": round(time.time() - self.started),
+                "interval": self.interval,
+                "window": self.window,
+                "cycle": self.cycle,
+                "next_cycle": self.next_cycle,
+                "current": dict(self.current, failures=list(self.current["failures"])) if self.current else None,
+                "last": dict(self.last) if self.last else None,
+            }
@@ -0,0 +1,255 @@
+"""
+Secret kinds that can be rotated on network devices.
+
+Each kind knows how to express its change as CLI configuration lines and as a
+fragment of the Cisco-IOS-XE-native RESTCONF model, so the device backends can
+apply any mix of kinds in a single configuration session or a single request.
+"""
+
+from __future__ import annotations
+from typing import Optional
+
+
+class SecretKind(object):
+    """
+    Base class for a secret that can be configured on a device.
+    """
+
+    # Short name used for reporting
+    name = "secret"
+
+    def describe(self) -> str:
+        """
+        A description of the change that does not include the secret itself.
+
+        Returns:
+            description (str): Description of the change
+        """
+        return self.name
+
+    def cli_commands(self) -> list[str]:
+        """
+        The CLI configuration lines that apply the change.
+
+        Returns:
+            commands (list): Configuration lines
+        """
+        raise NotImplementedError
+
+    def restconf_deletes(self) -> list[str]:
+        """
+        RESTCONF resources, relative to the data root, to delete before merging the change.
+
+        Returns:
+            resources (list): Resource paths
+        """
+        return []
+
+    def restconf_native(self) -> dict:
+        """
+        The fragment of the Cisco-IOS-XE-native:native container to merge.
+
+        Returns:
+            native (dict): Native model fragment
+        """
+        raise NotImplementedError
+
+    def native_removals(self) -> dict:
+        """
+        The fragment of the native container to remove, for NETCONF edit-config.
+
+        Entries to remove carry an "@operation": "remove" key. Entries that are
+        also merged by restconf_native() are left out, so each list entry gets
+        one operation in the edit-config.
+
+        Returns:
+            native (dict): Native model fragment
+        """
+        return {}
+
+
+class SnmpCommunities(SecretKind):
+    """
+    SNMP community strings to create and delete.
+    """
+
+    name = "snmp"
+
+    def __init__(
+        self,
+        creates: Optional[list[dict[str, str]]] = None,
+        deletes: Optional[list[str]] = None,
+    ):
+        """
+        Args:
+            creates (list): Communities (name, permission) to create
+            deletes (list): Names of communities to delete
+        """
+        self.creates = creates or []
+        self.deletes = deletes or []
+
+    def describe(self) -> str:
+        return f"snmp communities ({len(self.creates)} create, {len(self.deletes)} delete)"
+
+    def cli_commands(self) -> list[str]:
+        commands = [f"no snmp-server community {name}" for name in self.deletes]
+        commands += [
+            f"snmp-server community {community['name']} {community.get('permission', 'ro')}"
+            for community in self.creates
+        ]
+        return commands
+
+    def restconf_deletes(self) -> list[str]:
+        return [
+            f"/data/Cisco-IOS-XE-native:native/snmp-server/community-config={name}"
+            for name in self.deletes
+        ]
+
+    def restconf_native(self) -> dict:
+        if not self.creates:
+            return {}
+        return {"snmp-server": {"Cisco-IOS-XE-snmp:community-config": self.creates}}
+
+    def native_removals(self) -> dict:
+        # A community deleted and created again only changes its permission, which the
+        # merge of the create does on its own. Removing it in the same edit-config
+        # would target the same list entry twice
+        created = {community["name"] for community in self.creates}
+        removed = [name for name in self.deletes if name not in created]
+        if not removed:
+            return {}
+        return {
+            "snmp-server": {
+                "Cisco-IOS-XE-snmp:community-config": [
+                    {"@operation": "remove", "name": name} for name in removed
+                ]
+            }
+        }
+
+
+class TacacsKey(SecretKind):
+    """
+    The global TACACS+ server key.
+    """
+
+    name = "tacacs-key"
+
+    def __init__(self, key: str):
+        """
+        Args:
+            key (str): The new TACACS+ key
+        """
+        self.key = key
+
+    def cli_commands(self) -> list[str]:
+        return [f"tacacs-server key {self.key}"]
+
+    def restconf_native(self) -> dict:
+        return {"tacacs-server": {"Cisco-IOS-XE-aaa:key": {"key": self.key}}}
+
+
+class RadiusKey(SecretKind):
+    """
+    The global RADIUS server key.
+    """
+
+    name = "radius-key"
+
+    def __init__(self, key: str):
+        """
+        Args:
+            key (str): The new RADIUS key
+        """
+        self.key = key
+
+    def cli_commands(self) -> list[str]:
+        return [f"radius-server key {self.key}"]
+
+    def restconf_native(self) -> dict:
+        return {"radius-server": {"Cisco-IOS-XE-aaa:key": {"key": self.key}}}
+
+
+class EnableSecret(SecretKind):
+    """
+    The enable secret.
+    """
+
+    name = "enable-secret"
+
+    def __init__(self, secret: str):
+        """
+        Args:
+            secret (str): The new enable secret
+        """
+        self.secret = secret
+
+    def cli_commands(self) -> list[str]:
+        return [f"enable secret {self.secret}"]
+
+    def restconf_native(self) -> dict:
+        return {"enable": {"secret": {"type": "0", "secret": self.secret}}}
+
+
+class LocalUser(SecretKind):
+    """
+    The password of a local user account.
+    """
+
+    name = "local-user"
+
+    def __init__(self, username: str, password: str):
+        """
+        Args:
+            username (str): The local user to update
+            password (str): The new password for the user
+        """
+        self.username = username
+        self.password = password
+
+    def describe(self) -> str:
+        return f"local user {self.username}"
+
+    def cli_commands(self) -> list[str]:
+        return [f"username {self.username} secret {self.password}"]
+
+    def restconf_native(self) -> dict:
+        return {
+            "username": [
+                {
+                    "name": self.username,
+                    "secret": {"encryption": "0", "secret": self.password},
+                }
+            ]
+        }
+
+
+def merge_native(secrets: list[SecretKind], removals: bool = False) -> dict:
+    """
+    Merge the native model fragments of several secrets into one body.
+
+    Nested containers are merged and lists are concatenated.
+
+    Args:
+        secrets (list): The secrets to merge
+        removals (bool): Include each secret's removals ahead of its merges
+
+    Returns:
+        native (dict): Combined Cisco-IOS-XE-native:native fragment
+    """
+
+    def merge(target: dict, fragment: dict) -> None:
+        for key, value in fragment.items():
+            if isinstance(value, dict) and isinstance(target.get(key), dict):
+                merge(target[key], value)
+            elif isinstance(value, list) and isinstance(target.get(key), list):
+                target[key] = target[key] + value
+            else:
+                target[key] = value
+
+    native = {}
+    for secret in secrets:
+        if removals:
+            merge(native, secret.native_removals())
+        merge(native, secret.restconf_native())
+
+    return native
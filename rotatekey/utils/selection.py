@@ -0,0 +1,181 @@
+"""
+Selecting a subset of the inventory with --limit patterns.
+
+Patterns may be:
+
+    - an exact device name, e.g. "rtr-edge-03"
+    - a glob on the device name, e.g. "rtr-edge-*"
+    - a regular expression on the device name, prefixed with "~", e.g. "~^rtr-(sp|edge)0[34]$"
+    - an address or CIDR block, e.g. "192.168.5.118" or "192.168.5.0/24"
+    - a tag, site or group, e.g. "tag:core", "site:lab", "group:edge"
+
+A pattern prefixed with "!" removes the devices it matches.
+"""
+
+from __future__ import annotations
+from bisect import bisect_left, bisect_right
+import fnmatch
+import ipaddress
+import re
+from .device import DeviceRecord
+
+GLOB_CHARACTERS = "*?["
+
+# Patterns that can only be meant as an address or CIDR block
+ADDRESS_LIKE = re.compile(r"^(\d+(\.\d+){3}|[0-9A-Fa-f]*:[0-9A-Fa-f:.]*)(/\d*)?$|/")
+
+
+def compile_pattern(pattern: str):
+    """
+    Check a --limit pattern, compiling it if it is a regular expression or address.
+
+    Args:
+        pattern (str): A --limit pattern, without any "!" prefix
+
+    Returns:
+        compiled (re.Pattern | ipaddress.IPv4Network | ipaddress.IPv6Network): The compiled
+            regular expression or network, None for other patterns
+
+    Raises:
+        ValueError: If the pattern is an invalid regular expression or address
+    """
+    if pattern.startswith(("tag:", "site:", "group:")):
+        return None
+
+    if pattern.startswith("~"):
+        try:
+            return re.compile(pattern[1:])
+        except re.error as e:
+            raise ValueError(f"Invalid regular expression in '{pattern}': {e}")
+
+    if any(character in pattern for character in GLOB_CHARACTERS) or not ADDRESS_LIKE.search(pattern):
+        return None
+
+    try:
+        return ipaddress.ip_network(pattern, strict=False)
+    except ValueError as e:
+        raise ValueError(f"Invalid address or CIDR block '{pattern}': {e}")
+
+
+def check_patterns(patterns: list[str]) -> None:
+    """
+    Check every --limit pattern before any devices are selected.
+
+    Args:
+        patterns (list): The --limit patterns
+
+    Raises:
+        ValueError: If a pattern is an invalid regular expression or address
+    """
+    for pattern in patterns:
+        compile_pattern(pattern[1:] if pattern.startswith("!") else pattern)
+
+
+class InventoryIndex(object):
+    """
+    Indexes over the inventory so patterns are resolved without scanning every device.
+    """
+
+    def __init__(self, devices: list[DeviceRecord]):
+        """
+        Build the indexes.
+
+        Args:
+            devices (list): The inventory devices
+        """
+        self.devices = devices
+
+        # Position of each device in the inventory, so selections keep inventory order
+        self.by_name = {}
+        for position, device in enumerate(devices):
+            self.by_name.setdefault(device.device_name, []).append(position)
+        self.sorted_names = sorted(self.by_name)
+
+        # Addresses as (version, integer) pairs, sorted for range lookups
+        addresses = []
+        for position, device in enumerate(devices):
+            try:
+                address = ipaddress.ip_address(device.address)
+            except ValueError:
+                continue
+            addresses.append((address.version, int(address), position))
+        addresses.sort()
+        self.address_keys = [(version, value) for version, value, _ in addresses]
+        self.address_positions = [position for _, _, position in addresses]
+
+        self.by_label = {}
+        for position, device in enumerate(devices):
+            labels = [f"tag:{tag}" for tag in device.tags]
+            if device.site:
+                labels.append(f"site:{device.site}")
+            if device.group:
+                labels.append(f"group:{device.group}")
+            for label in labels:
+                self.by_label.setdefault(label, []).append(position)
+
+    def _names(self, names) -> set[int]:
+        return {position for name in names for position in self.by_name[name]}
+
+    def match(self, pattern: str) -> set[int]:
+        """
+        Find the inventory positions of the devices matching one pattern.
+
+        Args:
+            pattern (str): A --limit pattern
+
+        Returns:
+            positions (set): Positions in the inventory of the matching devices
+
+        Raises:
+            ValueError: If the pattern is an invalid regular expression or address
+        """
+        if pattern.startswith(("tag:", "site:", "group:")):
+            return set(self.by_label.get(pattern, ()))
+
+        if pattern.startswith("~"):
+            regex = compile_pattern(pattern)
+            return self._names(name for name in self.sorted_names if regex.search(name))
+
+        if any(character in pattern for character in GLOB_CHARACTERS):
+            # Only names sharing the literal prefix of the glob need to be checked
+            prefix = re.split(r"[*?\[]", pattern, maxsplit=1)[0]
+            start = bisect_left(self.sorted_names, prefix)
+            end = bisect_left(self.sorted_names, prefix + "\U0010ffff") if prefix else len(self.sorted_names)
+            return self._names(
+                name for name in self.sorted_names[start:end] if fnmatch.fnmatchcase(name, pattern)
+            )
+
+        if pattern in self.by_name:
+            return self._names([pattern])
+
+        network = compile_pattern(pattern)
+        if network is None:
+            try:
+                network = ipaddress.ip_network(pattern, strict=False)
+            except ValueError:
+                return set()
+
+        start = bisect_left(self.address_keys, (network.version, int(network.network_address)))
+        end = bisect_right(self.address_keys, (network.version, int(network.broadcast_address)))
+        return set(self.address_positions[start:end])
+
+    def select(self, patterns: list[str]) -> list[DeviceRecord]:
+        """
+        Select the devices matching any of the patterns, minus any excluded with "!".
+
+        Args:
+            patterns (list): The --limit patterns
+
+        Returns:
+            devices (list): The selected devices, in inventory order
+        """
+        included = [pattern for pattern in patterns if not pattern.startswith("!")]
+        excluded = [pattern[1:] for pattern in patterns if pattern.startswith("!")]
+
+        positions = set(range(len(self.devices))) if not included else set()
+        for pattern in included:
+            positions |= self.match(pattern)
+        for pattern in excluded:
+            positions -= self.match(pattern)
+
+        return [self.devices[position] for position in sorted(positions)]
@@ -0,0 +1,207 @@
+"""
+Per-device session logs, written by a background thread.
+
+Each device's CLI dialog and RESTCONF/NETCONF request summaries go to their
+own file instead of being interleaved on the terminal. Worker threads only
+put lines on a queue; one writer thread buffers them per device and appends
+to the files in batches, so logging never waits on the disk. Every file is
+capped in size, and can be gzip compressed.
+
+Secrets in the dialog (passwords, keys and community strings) are masked
+before they are written, and the files are readable by the owner only.
+"""
+
+from __future__ import annotations
+import gzip
+import logging
+import os
+import queue
+import re
+import threading
+from .snapshot import open_private
+
+# Characters that are not safe in a log file name
+UNSAFE_CHARACTERS = re.compile(r"[^A-Za-z0-9._-]")
+
+# Secrets in CLI configuration and RESTCONF paths, the part before the secret is kept
+# Communities go first, so a community named like a keyword is already masked
+SECRET_PATTERNS = [
+    re.compile(r"(\bsnmp-server\s+community\s+)\S+"),
+    re.compile(r"(community-config=)[^/?\s]+"),
+    # username NAME secret|password, enable secret|password, TACACS+ and RADIUS keys, with an optional type
+    re.compile(r"(\b(?:secret|password|key)(?:\s+\d{1,2})?\s+)\S+"),
+]
+
+
+def mask_secrets(text: str) -> str:
+    """
+    Replace the secrets in session log text with asterisks.
+
+    Args:
+        text (str): The text to mask
+
+    Returns:
+        text (str): The text with every secret replaced
+    """
+    for pattern in SECRET_PATTERNS:
+        text = pattern.sub(r"\1********", text)
+    return text
+
+
+class _SessionLogHandler(logging.Handler):
+    """
+    Sends the records of one device's logger to the writer.
+    """
+
+    def __init__(self, writer: "SessionLogWriter", device_name: str):
+        super().__init__()
+        self.writer = writer
+        self.device_name = device_name
+        self.setFormatter(logging.Formatter("%(asctime)s %(message)s"))
+
+    def emit(self, record: logging.LogRecord) -> None:
+        try:
+            self.writer.write(self.device_name, self.format(record) + "\n")
+        except Exception:
+            self.handleError(record)
+
+
+class SessionLogWriter(object):
+    """
+    Buffers session log lines per device and appends them to one file per device.
+    """
+
+    def __init__(
+        self,
+        directory: str,
+        max_bytes: int = 10 * 1024 * 1024,
+        compress: bool = False,
+        flush_bytes: int = 64 * 1024,
+        flush_interval: float = 1.0,
+    ):
+        """
+        Args:
+            directory (str): Directory for the log files, created if needed
+            max_bytes (int): Most bytes of log to keep per device, later lines are dropped
+            compress (bool): Write gzip compressed files (DEVICE.log.gz)
+            flush_bytes (int): Write a device's buffer once it holds this many bytes
+            flush_interval (float): Write every buffer at least this often, in seconds
+        """
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.compress = compress
+        self.flush_bytes = flush_bytes
+        self.flush_interval = flush_interval
+
+        os.makedirs(directory, mode=0o700, exist_ok=True)
+
+        # A bounded queue, so a slow disk holds back logging rather than memory
+        self.queue = queue.Queue(maxsize=10000)
+        self.buffers = {}
+        self.written = {}
+        self.loggers = {}
+        self.lock = threading.Lock()
+
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def path(self, device_name: str) -> str:
+        """
+        The log file for a device.
+
+        Args:
+            device_name (str): The name of the device
+
+        Returns:
+            path (str): The log file path
+        """
+        extension = ".log.gz" if self.compress else ".log"
+        return os.path.join(self.directory, UNSAFE_CHARACTERS.sub("_", device_name) + extension)
+
+    def logger(self, device_name: str) -> logging.Logger:
+        """
+        A logger whose records go to a device's session log.
+
+        The logger is not registered with the logging module, so loggers for
+        large fleets are freed with the writer.
+
+        Args:
+            device_name (str): The name of the device
+
+        Returns:
+            logger (logging.Logger): The device's session logger
+        """
+        with self.lock:
+            logger = self.loggers.get(device_name)
+            if logger is None:
+                logger = logging.Logger(f"rotatekey.session.{device_name}", logging.DEBUG)
+                logger.addHandler(_SessionLogHandler(self, device_name))
+                self.loggers[device_name] = logger
+        return logger
+
+    def write(self, device_name: str, text: str) -> None:
+        """
+        Queue text for a device's session log.
+
+        Args:
+            device_name (str): The name of the device
+            text (str): The text to append
+        """
+        self.queue.put((device_name, text))
+
+    def _run(self) -> None:
+        while True:
+            try:
+                item = self.queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                self._flush_all()
+                continue
+
+            if item is None:
+                self._flush_all()
+                return
+
+            device_name, text = item
+            buffer = self.buffers.setdefault(device_name, [0, []])
+            buffer[0] += len(text)
+            buffer[1].append(text)
+            if buffer[0] >= self.flush_bytes:
+                self._flush(device_name)
+
+    def _flush_all(self) -> None:
+        for device_name in list(self.buffers):
+            self._flush(device_name)
+
+    def _flush(self, device_name: str) -> None:
+        # Only called from the writer thread
+        _, lines = self.buffers.pop(device_name, (0, []))
+        if not lines:
+            return
+
+        written = self.written.get(device_name, 0)
+        if written >= self.max_bytes:
+            return
+
+        text = mask_secrets("".join(lines))
+        if written + len(text) > self.max_bytes:
+            text = text[:self.max_bytes - written] + f"\n[session log truncated at {self.max_bytes} bytes]\n"
+        self.written[device_name] = written + len(text)
+
+        # Files are opened per flush rather than held open, so large fleets do not run out of descriptors
+        try:
+            if self.compress:
+                with open_private(self.path(device_name), "ab") as raw, gzip.open(raw, "at", compresslevel=6) as f:
+                    f.write(text)
+            else:
+                with open_private(self.path(device_name), "a") as f:
+                    f.write(text)
+        except OSError:
+            pass
+
+    def close(self) -> None:
+        """
+        Write everything still buffered and stop the writer thread.
+        """
+        if self.thread.is_alive():
+            self.queue.put(None)
+            self.thread.join()
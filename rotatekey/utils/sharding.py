@@ -0,0 +1,74 @@
+"""
+Deterministic partitioning of the inventory across several runner hosts.
+"""
+
+from __future__ import annotations
+import hashlib
+from .device import DeviceRecord
+
+
+def parse_shard(spec: str) -> tuple[int, int]:
+    """
+    Parse a shard specification of the form K/N.
+
+    Args:
+        spec (str): The shard specification, e.g. "2/4"
+
+    Returns:
+        shard (tuple): The shard number (1 based) and total number of shards
+    """
+    try:
+        shard, total = (int(part) for part in spec.split("/"))
+    except ValueError:
+        raise ValueError(f"Shard '{spec}' is not in the form K/N")
+
+    if total < 1 or not 1 <= shard <= total:
+        raise ValueError(f"Shard '{spec}' must satisfy 1 <= K <= N")
+
+    return (shard, total)
+
+
+def device_shard(device_name: str, address: str, total: int) -> int:
+    """
+    Find the shard a device belongs to using rendezvous (highest random weight) hashing.
+
+    The result depends only on the device and the number of shards, so every
+    runner host computes the same partition. Changing the number of shards only
+    moves the devices that land on the added or removed shard.
+
+    Args:
+        device_name (str): The name of the device
+        address (str): The address of the device
+        total (int): The total number of shards
+
+    Returns:
+        shard (int): The shard number (1 based) for the device
+    """
+    key = f"{device_name}|{address}"
+
+    def weight(shard: int) -> bytes:
+        return hashlib.blake2b(f"{shard}:{key}".encode(), digest_size=8).digest()
+
+    return max(range(1, total + 1), key=weight)
+
+
+def select_shard(devices: list[DeviceRecord], shard: int, total: int) -> list[DeviceRecord]:
+    """
+    Select the devices that belong to a shard.
+
+    Args:
+        devices (list): The devices to select from
+        shard (int): The shard number (1 based)
+        total (int): The total number of shards
+
+    Returns:
+        devices (list): The devices in the shard, in their original order
+    """
+    if total == 1:
+        return list(devices)
+
+    return [
+        device
+        for device in devices
+        if device_shard(device.device_name, device.address, total) == shard
+    ]
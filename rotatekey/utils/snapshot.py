@@ -0,0 +1,164 @@
+"""
+Record and reload the SNMP communities on devices before they are changed.
+
+Snapshots are written as JSON Lines: a header line followed by one line per
+device, flushed as soon as each device is read so that a snapshot survives an
+interrupted run. Plan files use the same layout, with the planned creates and
+deletes added to each device line, so a plan can also be used as a snapshot.
+
+Each community is recorded by name and permission only, the leaves the
+transports read. Views and ACLs attached to a community are not recorded, so a
+rollback does not restore them. The files hold community strings and are
+created readable by the owner only.
+"""
+
+from __future__ import annotations
+from datetime import datetime, timezone
+import json
+import os
+import threading
+from .device import DeviceRecord
+
+
+def default_snapshot_file(kind: str = "snapshot") -> str:
+    """
+    Build a timestamped snapshot file name in the current directory.
+
+    Args:
+        kind (str): The kind of file, "snapshot" or "plan"
+
+    Returns:
+        file_name (str): Snapshot file name
+    """
+    return f"snmp-{kind}-{datetime.now().strftime('%Y%m%d-%H%M%S')}.jsonl"
+
+
+def open_private(path: str, mode: str = "w"):
+    """
+    Open a file for writing, readable and writable by the owner only.
+
+    Args:
+        path (str): The file to open
+        mode (str): "w" to truncate or "a" to append, with "b" for binary
+
+    Returns:
+        file (IO): The open file
+    """
+    flags = os.O_WRONLY | os.O_CREAT | (os.O_APPEND if "a" in mode else os.O_TRUNC)
+    fd = os.open(path, flags, 0o600)
+    try:
+        # os.open only sets the mode of a new file
+        os.fchmod(fd, 0o600)
+        return os.fdopen(fd, mode)
+    except BaseException:
+        os.close(fd)
+        raise
+
+
+class SnapshotWriter(object):
+    """
+    A thread safe writer for device SNMP community snapshots.
+    """
+
+    def __init__(self, path: str, kind: str = "snapshot", **header):
+        """
+        Create the snapshot file and write the header.
+
+        Args:
+            path (str): The snapshot file to create
+            kind (str): The kind of file, "snapshot" or "plan"
+            header: Any additional values to store in the header line
+        """
+        self.path = path
+        self.lock = threading.Lock()
+        self.file = open_private(path)
+        self._write(
+            {
+                "kind": kind,
+                "created": datetime.now(timezone.utc).isoformat(),
+                **header,
+            }
+        )
+
+    def _write(self, entry: dict) -> None:
+        with self.lock:
+            self.file.write(json.dumps(entry) + "\n")
+            self.file.flush()
+
+    def record(
+        self,
+        device: DeviceRecord,
+        transport: str,
+        communities: list[dict[str, str]],
+        **extra,
+    ) -> None:
+        """
+        Record the communities configured on a device.
+
+        Args:
+            device (DeviceRecord): The device
+            transport (str): The transport used to read the device
+            communities (list): The communities configured on the device
+            extra: Any additional values to store for the device
+        """
+        self._write(
+            {
+                "device_name": device.device_name,
+                "address": device.address,
+                "site": device.site or device.group,
+                "transport": transport,
+                "communities": communities,
+                **extra,
+            }
+        )
+
+    def close(self) -> None:
+        """
+        Close the snapshot file.
+        """
+        self.file.close()
+
+
+def load_journal(path: str) -> tuple[dict, list[dict]]:
+    """
+    Load the header and every device entry from a snapshot or plan file.
+
+    Args:
+        path (str): The file to read
+
+    Returns:
+        journal (tuple): The header and the list of device entries
+    """
+    header = {}
+    entries = []
+    with open(path) as f:
+        for line in f:
+            if not line.strip():
+                continue
+            entry = json.loads(line)
+            if "device_name" in entry:
+                entries.append(entry)
+            elif not header:
+                header = entry
+
+    return (header, entries)
+
+
+def load_snapshot(path: str) -> list[dict]:
+    """
+    Load the device entries from a snapshot file.
+
+    If a device appears more than once the earliest entry wins, as that is the
+    state from before any change was made.
+
+    Args:
+        path (str): The snapshot file to read
+
+    Returns:
+        devices (list): Snapshot entries with device_name, address, transport and communities
+    """
+    devices = {}
+    for entry in load_journal(path)[1]:
+        devices.setdefault(entry["device_name"], entry)
+
+    return list(devices.values())
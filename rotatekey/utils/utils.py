@@ -57,3 +57,71 @@ def check_result(
             fg="red",
             err=True,
         )
+
+
+def diff_communities(
+    current: list[dict[str, str]], target: list[dict[str, str]]
+) -> tuple[list[dict[str, str]], list[str]]:
+    """
+    Work out the changes needed to move a device from one set of SNMP communities to another.
+
+    A community whose permission differs is deleted and then recreated.
+
+    Args:
+        current (list): Communities currently configured on the device
+        target (list): Communities that should be configured on the device
+
+    Returns:
+        changes (tuple): Communities to create and names of communities to delete
+    """
+    current_permissions = {
+        community["name"]: community.get("permission") for community in current
+    }
+    target_permissions = {
+        community["name"]: community.get("permission") for community in target
+    }
+
+    deletes = [
+        name
+        for name, permission in current_permissions.items()
+        if target_permissions.get(name, object()) != permission
+    ]
+    creates = [
+        community
+        for community in target
+        if current_permissions.get(community["name"], object())
+        != community.get("permission")
+    ]
+
+    return (creates, deletes)
+
+
+def intended_communities(
+    current: list[dict[str, str]],
+    delete_current: bool,
+    ro_community: str = None,
+    rw_community: str = None,
+) -> list[dict[str, str]]:
+    """
+    Work out the SNMP communities a device should have after an update.
+
+    Args:
+        current (list): Communities configured on the device before the update
+        delete_current (bool): Whether the current communities are being deleted
+        ro_community (str): The new Read-Only community string
+        rw_community (str): The new Read-Write community string
+
+    Returns:
+        snmp_communities (list): List of SNMP communities and permissions
+    """
+    new_communities = [
+        {"name": name, "permission": permission}
+        for name, permission in ((ro_community, "ro"), (rw_community, "rw"))
+        if name
+    ]
+    new_names = {community["name"] for community in new_communities}
+
+    kept = [] if delete_current else current
+    return [
+        community for community in kept if community["name"] not in new_names
+    ] + new_communities
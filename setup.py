@@ -8,6 +8,9 @@ setup(
     install_requires=[
         'click==7.1.2',
     ],
+    extras_require={
+        'netconf': ['ncclient'],
+    },
     entry_points='''
         [console_scripts]
         rotatekey=rotatekey.rotatekey:cli
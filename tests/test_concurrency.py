@@ -0,0 +1,48 @@
+"""
+Tests of the adaptive concurrency controller.
+"""
+
+from rotatekey.utils.concurrency import AimdController
+
+
+def test_sustained_failures_back_off_to_one():
+    controller = AimdController(max_limit=32, initial_limit=32)
+    for _ in range(200):
+        controller.record(1.0, "timeout")
+
+    assert controller.limit == 1
+    assert [limit for _, limit, _ in controller.history] == [32, 16, 8, 4, 2, 1]
+
+
+def test_burst_of_failures_backs_off_once():
+    controller = AimdController(max_limit=32, initial_limit=16)
+    # A burst no longer than the new limit halves the limit only once
+    for _ in range(8):
+        controller.record(1.0, "auth")
+
+    assert controller.limit == 8
+
+
+def test_flat_latency_grows_the_limit():
+    controller = AimdController(max_limit=10, initial_limit=2)
+    for _ in range(2 + 3 + 4):
+        controller.record(1.0)
+
+    assert controller.limit == 5
+
+
+def test_round_with_back_off_does_not_grow():
+    controller = AimdController(max_limit=10, initial_limit=4)
+    controller.record(1.0, "server")
+    # The success completes the round of two that backed off
+    controller.record(1.0)
+
+    assert controller.limit == 2
+
+
+def test_other_failures_do_not_back_off():
+    controller = AimdController(max_limit=10, initial_limit=4)
+    for _ in range(4):
+        controller.record(1.0, "other")
+
+    assert controller.limit == 5
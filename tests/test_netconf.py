@@ -0,0 +1,76 @@
+"""
+Tests of the edit-config the Netconf backend sends, against a stand-in NETCONF session.
+"""
+
+from xml.etree import ElementTree
+
+import pytest
+
+from rotatekey.utils import netconf
+from rotatekey.utils.netconf import NETCONF_BASE_NS, Netconf, module_namespace
+from rotatekey.utils.utils import diff_communities
+
+SNMP_NS = module_namespace("Cisco-IOS-XE-snmp")
+OPERATION = f"{{{NETCONF_BASE_NS}}}operation"
+
+
+class StandInSession(object):
+    """
+    Records the RPCs sent on a NETCONF session to the running datastore.
+    """
+
+    server_capabilities = []
+    connected = True
+
+    def __init__(self):
+        self.edits = []
+
+    def edit_config(self, target, config):
+        self.edits.append((target, config))
+
+    def close_session(self):
+        pass
+
+
+@pytest.fixture
+def session(monkeypatch):
+    session = StandInSession()
+
+    class StandInManager(object):
+        @staticmethod
+        def connect(**kwargs):
+            return session
+
+    monkeypatch.setattr(netconf, "manager", StandInManager)
+    return session
+
+
+def communities(config: str) -> list:
+    # The community-config entries of an edit-config, as (name, permission, operation)
+    root = ElementTree.fromstring(config)
+    return [
+        (entry.findtext(f"{{{SNMP_NS}}}name"), entry.findtext(f"{{{SNMP_NS}}}permission"), entry.get(OPERATION))
+        for entry in root.iter(f"{{{SNMP_NS}}}community-config")
+    ]
+
+
+def test_permission_change_is_one_merge(session):
+    current = [{"name": "public", "permission": "ro"}, {"name": "old", "permission": "ro"}]
+    target = [{"name": "public", "permission": "rw"}]
+    creates, deletes = diff_communities(current, target)
+
+    device = Netconf("192.0.2.1", "user", "password")
+    assert device.apply_snmp_changes(creates, deletes) == (True, None)
+
+    assert len(session.edits) == 1
+    datastore, config = session.edits[0]
+    assert datastore == "running"
+    # The changed community is merged once, only the community that goes away is removed
+    assert sorted(communities(config), key=str) == [("old", None, "remove"), ("public", "rw", None)]
+
+
+def test_create_and_delete(session):
+    device = Netconf("192.0.2.1", "user", "password")
+    assert device.apply_snmp_changes([{"name": "new", "permission": "ro"}], ["gone"]) == (True, None)
+
+    assert communities(session.edits[0][1]) == [("gone", None, "remove"), ("new", "ro", None)]
@@ -0,0 +1,36 @@
+"""
+Tests of the secret masking used for session logs and failure reasons.
+"""
+
+import pytest
+
+from rotatekey.utils.secret_kinds import EnableSecret, LocalUser, RadiusKey, SnmpCommunities, TacacsKey
+from rotatekey.utils.session_log import mask_secrets
+
+SECRET = "Zq8-secret-value"
+
+
+@pytest.mark.parametrize(
+    "secret",
+    [
+        TacacsKey(SECRET),
+        RadiusKey(SECRET),
+        EnableSecret(SECRET),
+        LocalUser("admin", SECRET),
+        SnmpCommunities([{"name": SECRET, "permission": "rw"}], [SECRET]),
+    ],
+    ids=lambda secret: secret.name,
+)
+def test_configuration_is_masked(secret):
+    # As a unicon configure failure reports it, the command echo followed by the device output
+    output = "\n".join(secret.cli_commands()) + "\n% Invalid input detected at '^' marker."
+
+    masked = mask_secrets(output)
+    assert SECRET not in masked
+    assert "% Invalid input detected" in masked
+
+
+def test_restconf_path_is_masked():
+    masked = mask_secrets(f"DELETE /data/Cisco-IOS-XE-native:native/snmp-server/community-config={SECRET} -> 204")
+    assert SECRET not in masked
+    assert masked.endswith("-> 204")
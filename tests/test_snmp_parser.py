@@ -0,0 +1,81 @@
+"""
+Tests of the snmp-server community parser, for the forms listed in its docstring.
+"""
+
+import pytest
+
+from rotatekey.utils.snmp_parser import parse_communities, show_command
+
+
+def community(name, permission="ro", view=None, acl=None, ipv6_acl=None, group=None, encryption=None):
+    return {
+        "name": name,
+        "permission": permission,
+        "view": view,
+        "acl": acl,
+        "ipv6_acl": ipv6_acl,
+        "group": group,
+        "encryption": encryption,
+    }
+
+
+@pytest.mark.parametrize(
+    "line, expected",
+    [
+        ("snmp-server community PUBLIC", community("PUBLIC")),
+        ("snmp-server community PUBLIC RO", community("PUBLIC")),
+        ("snmp-server community PRIVATE RW", community("PRIVATE", "rw")),
+        ("snmp-server community PUBLIC ro 10", community("PUBLIC", acl="10")),
+        ("snmp-server community SN view V RO SNMP-ACL", community("SN", view="V", acl="SNMP-ACL")),
+        (
+            "snmp-server community SN RW ipv6 V6-MGMT MGMT-ACL",
+            community("SN", "rw", ipv6_acl="V6-MGMT", acl="MGMT-ACL"),
+        ),
+        ("snmp-server community 7 0822455D0A16 RO", community("0822455D0A16", encryption="7")),
+        ("snmp-server community 0 PLAIN RW", community("PLAIN", "rw", encryption="0")),
+        # A community named like an encryption type
+        ("snmp-server community 7 RW", community("7", "rw")),
+        ("snmp-server community OPS group network-operator", community("OPS", group="network-operator")),
+        ("snmp-server community ADMIN group network-admin", community("ADMIN", "rw", group="network-admin")),
+        ("snmp-server community OPS use-acl MGMT-ACL", community("OPS", acl="MGMT-ACL")),
+        ("snmp-server community OPS use-ipv4acl MGMT-ACL", community("OPS", acl="MGMT-ACL")),
+        ("snmp-server community OPS use-ipv6acl V6-ACL", community("OPS", ipv6_acl="V6-ACL")),
+        ("snmp-server community PUBLIC RO\r", community("PUBLIC")),
+    ],
+)
+def test_forms(line, expected):
+    assert parse_communities(line) == [expected]
+
+
+def test_unknown_options_still_report_the_community():
+    assert parse_communities("snmp-server community SN view V RO SNMP-ACL extra") == [
+        community("SN", view="V", acl="SNMP-ACL")
+    ]
+    assert [(c["name"], c["permission"]) for c in parse_communities("snmp-server community SN unknown RW")] == [
+        ("SN", "rw")
+    ]
+
+
+def test_nxos_lines_are_merged():
+    output = "snmp-server community OPS group network-admin\nsnmp-server community OPS use-ipv4acl MGMT-ACL\n"
+    assert parse_communities(output) == [community("OPS", "rw", acl="MGMT-ACL", group="network-admin")]
+
+
+def test_unfiltered_configuration():
+    output = "\n".join(
+        [
+            "hostname r1",
+            "interface GigabitEthernet1",
+            " description snmp-server community NOT-A-COMMUNITY RO",
+            "snmp-server community PUBLIC RO",
+            "snmp-server host 192.0.2.1 version 2c PUBLIC",
+            "snmp-server community PRIVATE RW",
+            "end",
+        ]
+    )
+    assert [c["name"] for c in parse_communities(output)] == ["PUBLIC", "PRIVATE"]
+
+
+def test_show_command():
+    assert "snmp" in show_command("nxos")
+    assert show_command(None) == show_command("iosxe")